@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Per-block activation checkpointing for transformer backbones.
+
+A training forward keeps every block's intermediate activations alive for
+backward, which is what limits the batch size when fully fine-tuning
+DeiT-base or Swin. set_checkpointing(model, every=k) makes every k-th
+transformer block keep only its input and recompute its internals during
+backward (torch.utils.checkpoint, non-reentrant): less activation memory
+for roughly one extra forward of each checkpointed block. Blocks are found
+by name (Hugging Face encoder.layer, timm ViT .blocks, timm Swin
+layers[i].blocks), and only their forward is patched, so state dict keys
+and checkpoints are unchanged.
+
+profile_blocks() measures, once, how much each block saves for backward and
+how big its input is; estimate_activation_mb() predicts the activation
+memory of any policy from that profile, and choose_checkpointing() picks the
+least checkpointing that fits a memory budget. checkpoint_tradeoff() (run
+`python activation_checkpoint.py`) measures peak RSS and step time of each
+policy on this machine.
+"""
+
+import copy
+import gc
+import sys
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from train_step import autocast
+
+BLOCK_CONTAINERS = ('layer', 'blocks')
+POLICIES = (None, 4, 3, 2, 1)  # least to most checkpointing
+
+
+# The transformer blocks of model, in forward order
+def transformer_blocks(model):
+    return [block for name, module in model.named_modules()
+            if name.split('.')[-1] in BLOCK_CONTAINERS and isinstance(module, (nn.ModuleList, nn.Sequential))
+            for block in module]
+
+
+def _checkpointed(forward):
+    def run(*args, **kwargs):
+        if not torch.is_grad_enabled():
+            return forward(*args, **kwargs)
+        return checkpoint(forward, *args, use_reentrant=False, **kwargs)
+    return run
+
+
+# Checkpoint blocks 0, k, 2k, ... (every=1: all blocks, None: none).
+# Returns the number of checkpointed blocks. Apply after any deepcopy of model.
+def set_checkpointing(model, every):
+    count = 0
+    for i, block in enumerate(transformer_blocks(model)):
+        block.__dict__.pop('forward', None)  # back to the class forward
+        if every and i % every == 0:
+            block.forward = _checkpointed(block.forward)
+            count += 1
+    return count
+
+
+# MB per sample saved for backward outside the blocks, by each block, and the
+# size of each block's input (what a checkpointed block keeps instead).
+# Measured as the difference between batch 2 and batch 1 so weights cancel out.
+def profile_blocks(model, forward, device='cpu', precision='fp32', image_size=224):
+    blocks = transformer_blocks(model)
+
+    def measure(n):
+        current = [None]
+        other, saved, inputs = 0, [0] * len(blocks), [0] * len(blocks)
+        seen = set()
+
+        def pack(t):
+            nonlocal other
+            key = (t.data_ptr(), t.numel())
+            if not isinstance(t, nn.Parameter) and key not in seen:
+                seen.add(key)
+                nbytes = t.numel() * t.element_size()
+                if current[0] is None:
+                    other += nbytes
+                else:
+                    saved[current[0]] += nbytes
+            return t
+
+        def enter(i):
+            def hook(module, args):
+                current[0] = i
+                if args and torch.is_tensor(args[0]):
+                    inputs[i] = args[0].numel() * args[0].element_size()
+            return hook
+
+        def leave(module, args, output):
+            current[0] = None
+
+        handles = []
+        for i, block in enumerate(blocks):
+            handles.append(block.register_forward_pre_hook(enter(i)))
+            handles.append(block.register_forward_hook(leave))
+        x = torch.randn(n, 3, image_size, image_size, device=device)
+        try:
+            with torch.random.fork_rng(devices=[]), torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+                with autocast(device, precision):
+                    forward(model, x)
+        finally:
+            for handle in handles:
+                handle.remove()
+        return other, saved, inputs
+
+    one, two = measure(1), measure(2)
+    mb = 1024 ** 2
+    return {
+        'other': (two[0] - one[0]) / mb,
+        'saved': [(b - a) / mb for a, b in zip(one[1], two[1])],
+        'inputs': [(b - a) / mb for a, b in zip(one[2], two[2])],
+    }
+
+
+# Predicted activation MB for batch_size samples under a policy: checkpointed
+# blocks keep their input only, plus one block's internals while recomputing
+def estimate_activation_mb(profile, every, batch_size=1):
+    saved, inputs = profile['saved'], profile['inputs']
+    wrapped = [i for i in range(len(saved)) if every and i % every == 0]
+    per_sample = (profile['other'] + sum(saved)
+                  - sum(saved[i] for i in wrapped) + sum(inputs[i] for i in wrapped)
+                  + max((saved[i] for i in wrapped), default=0))
+    return per_sample * batch_size
+
+
+# Least checkpointing whose activations for batch_size samples fit the budget
+# (every block if none does; accumulation micro-batches can cover the rest)
+def choose_checkpointing(profile, batch_size, memory_budget_mb, policies=POLICIES):
+    for every in policies:
+        estimate = estimate_activation_mb(profile, every, batch_size)
+        if estimate <= memory_budget_mb:
+            break
+    label = 'off' if every is None else f"every {every} block(s)"
+    print(f"✅ Activation checkpointing {label}: ~{estimate:.0f} MB activations "
+          f"for batch {batch_size} (budget {memory_budget_mb} MB)")
+    return every
+
+
+def _reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')  # resets VmHWM (Linux >= 4.0)
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+
+# Peak RSS (peak allocated memory on CUDA) and seconds per AdamW training step
+# for each policy. Policies run from most to least checkpointing, so memory the
+# allocator kept from an earlier policy never exceeds a later policy's peak.
+def checkpoint_tradeoff(model, num_classes, forward=None, device='cpu', batch_size=32, image_size=224, steps=3,
+                        policies=(1, 2, 4, None)):
+    forward = forward or (lambda m, x: m(x))
+    device = torch.device(device)
+    images = torch.randn(batch_size, 3, image_size, image_size, device=device)
+    labels = torch.randint(0, num_classes, (batch_size,), device=device)
+    criterion = nn.CrossEntropyLoss()
+    was_training = model.training
+    profile = profile_blocks(model.train(), forward, device, image_size=image_size)
+    model.train(was_training)
+
+    results = {}
+    for every in policies:
+        candidate = copy.deepcopy(model).to(device).train()
+        set_checkpointing(candidate, every)
+        optimizer = torch.optim.AdamW(candidate.parameters(), lr=1e-5)
+
+        def train_step():
+            optimizer.zero_grad()
+            criterion(forward(candidate, images), labels).backward()
+            optimizer.step()
+
+        train_step()  # warm-up, allocates the optimizer state
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            _reset_peak_rss()
+        start = time.perf_counter()
+        for _ in range(steps):
+            train_step()
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = (time.perf_counter() - start) / steps
+        peak = torch.cuda.max_memory_allocated() / 1024 ** 2 if device.type == 'cuda' else _peak_rss_mb()
+        results[every] = {'peak_mb': peak, 'step_time_s': elapsed,
+                          'estimated_mb': estimate_activation_mb(profile, every, batch_size)}
+        del candidate, optimizer
+        gc.collect()
+
+    base = results.get(None)
+    print(f"Activation checkpointing trade-off (batch {batch_size}, {image_size}x{image_size}, {device}):")
+    for every, r in results.items():
+        label = 'off' if every is None else f"every {every}"
+        line = (f"  {label:<8} peak {r['peak_mb']:8.0f} MB  (activations ~{r['estimated_mb']:6.0f} MB)  "
+                f"{r['step_time_s']:.3f} s/step")
+        if base is not None and every is not None:
+            line += f"  ({r['peak_mb'] - base['peak_mb']:+.0f} MB, {r['step_time_s'] / base['step_time_s']:.2f}x time)"
+        print(line)
+    return results
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or ['deit', 'swin_tiny_patch4_window7_224']
+    for name in names:
+        if name == 'deit':
+            from transformers import DeiTForImageClassification
+            base = DeiTForImageClassification.from_pretrained("facebook/deit-base-distilled-patch16-224", num_labels=10)
+            checkpoint_tradeoff(base, 10, forward=lambda m, x: m(x).logits)
+        else:
+            from timm import create_model
+            checkpoint_tradeoff(create_model(name, pretrained=False, num_classes=10), 10)
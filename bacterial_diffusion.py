@@ -18,13 +18,7 @@ import zipfile, os
 
 uploaded = files.upload()  # Upload bacterial.zip here
 zip_filename = next(iter(uploaded))
-output_dir = "./bacterial_dataset"
-os.makedirs(output_dir, exist_ok=True)
-
-with zipfile.ZipFile(zip_filename, 'r') as zip_ref:
-    zip_ref.extractall(output_dir)
-
-print(f"✅ Extracted {zip_filename} to {output_dir}")
+print(f"✅ Uploaded {zip_filename} (images are read straight from the zip, no extraction)")
 
 # STEP 3: Dataset Preparation
 import glob
@@ -32,28 +26,18 @@ import torch
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms
 from PIL import Image
+from zip_dataset import ZipImageDataset
 import matplotlib.pyplot as plt
 import numpy as np
 import random
 
-class BacterialDiffusionDataset(Dataset):
-    def __init__(self, root_dir, transform=None, num_samples=None):
-        valid_exts = ('.jpg', '.jpeg', '.png', '.bmp')
-        self.image_paths = [f for f in glob.glob(f"{root_dir}/**/*", recursive=True) if f.lower().endswith(valid_exts)]
+class BacterialDiffusionDataset(ZipImageDataset):
+    def __init__(self, zip_path, transform=None, num_samples=None, target_size=None):
+        super().__init__(zip_path, transform=transform, target_size=target_size,
+                         valid_exts=('.jpg', '.jpeg', '.png', '.bmp'))
         if num_samples:
-            self.image_paths = random.sample(self.image_paths, min(num_samples, len(self.image_paths)))
-        self.transform = transform
-        print(f"✅ Found {len(self.image_paths)} images with valid extensions.")
-
-    def __len__(self):
-        return len(self.image_paths)
-
-    def __getitem__(self, idx):
-        img_path = self.image_paths[idx]
-        image = Image.open(img_path).convert("RGB")
-        if self.transform:
-            image = self.transform(image)
-        return image
+            self.members = random.sample(self.members, min(num_samples, len(self.members)))
+        print(f"✅ Found {len(self.members)} images with valid extensions.")
 
 transform = transforms.Compose([
     transforms.Resize((224, 224)),
@@ -61,7 +45,7 @@ transform = transforms.Compose([
     transforms.Normalize([0.5], [0.5])
 ])
 
-dataset = BacterialDiffusionDataset(output_dir, transform=transform)
+dataset = BacterialDiffusionDataset(zip_filename, transform=transform, target_size=(224, 224))
 print(f"✅ Loaded {len(dataset)} bacterial images")
 
 # STEP 4: Show Sample Images
@@ -102,26 +86,37 @@ model = UNet2DModel(
 
 model.enable_xformers_memory_efficient_attention()
 
+# torch.cuda.amp.autocast() is a no-op on CPU; torch.autocast runs bf16 there too
+# on CPUs with native bf16 (auto_precision falls back to fp32 elsewhere)
+from train_step import autocast, auto_precision
+PRECISION = auto_precision(device)
+
 noise_scheduler = DDPMScheduler(num_train_timesteps=500, beta_schedule="linear")
 optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4, weight_decay=1e-6)
 
 # STEP 6: Training Loop
 from tqdm.auto import tqdm
 
-dataloader = DataLoader(dataset, batch_size=4, shuffle=True, pin_memory=True)
+# Workers / prefetch / pinning tuned for this machine (cached after the first run)
+from torch_loaders import make_loader
+dataloader = make_loader(dataset, batch_size=4, shuffle=True)
 num_epochs = 10
 losses = []
 accumulation_steps = 4
 
+# The epoch loss is summed on the device and read back once per epoch
+from device_metrics import RunningSums
+running = RunningSums()
+
 for epoch in range(num_epochs):
     model.train()
-    epoch_loss = 0
+    running.reset()
     optimizer.zero_grad()
 
     for step, batch in enumerate(tqdm(dataloader, desc=f"Epoch {epoch+1}/{num_epochs}")):
         batch = batch.to(device)
 
-        with torch.cuda.amp.autocast():
+        with autocast(device, PRECISION):
             noise = torch.randn_like(batch)
             timesteps = torch.randint(0, noise_scheduler.num_train_timesteps, (batch.shape[0],)).long().to(device)
             noisy_images = noise_scheduler.add_noise(batch, noise, timesteps)
@@ -135,9 +130,9 @@ for epoch in range(num_epochs):
             optimizer.zero_grad()
             torch.cuda.empty_cache()
 
-        epoch_loss += loss.item() * accumulation_steps
+        running.add(loss=loss * accumulation_steps)
 
-    avg_loss = epoch_loss / len(dataloader)
+    avg_loss = running.means()['loss']
     losses.append(avg_loss)
     print(f"✅ Epoch {epoch+1} - Loss: {avg_loss:.4f}")
 
@@ -164,7 +159,7 @@ synthetic_images = []
 print("🔄 Generating 50 synthetic bacterial images...")
 
 for i in tqdm(range(0, num_images, gen_batch_size)):
-    with torch.cuda.amp.autocast():
+    with autocast(device, PRECISION):
         images = pipeline(
             batch_size=gen_batch_size,
             num_inference_steps=500,
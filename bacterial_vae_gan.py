@@ -35,9 +35,12 @@ transform = transforms.Compose([
 ])
 
 # Step 3: Custom Dataset
+from image_io import open_rgb
+
 class BacterialDataset(Dataset):
-    def __init__(self, image_dir, transform=None):
+    def __init__(self, image_dir, transform=None, target_size=None):
         self.transform = transform
+        self.target_size = target_size  # decode JPEGs at reduced resolution
         self.image_paths = []
         valid_exts = ('.jpg', '.jpeg', '.png', '.bmp')
         for root, _, files in os.walk(image_dir):
@@ -49,14 +52,14 @@ class BacterialDataset(Dataset):
         return len(self.image_paths)
 
     def __getitem__(self, idx):
-        image = Image.open(self.image_paths[idx]).convert("RGB")
+        image = open_rgb(self.image_paths[idx], self.target_size)
         if self.transform:
             image = self.transform(image)
         return image
 
 # Step 4: Load Dataset
 image_dir = './bacterial_dataset/'
-dataset = BacterialDataset(image_dir, transform)
+dataset = BacterialDataset(image_dir, transform, target_size=(64, 64))
 print(f"✅ Total bacterial images found: {len(dataset)}")
 
 dataloader = DataLoader(dataset, batch_size=32, shuffle=True)
@@ -144,7 +147,12 @@ def reparameterize(mu, logvar):
 # Step 7: Training Loop
 def train(num_epochs=120):
     start = time.time()
+    # Epoch-mean losses are summed on the device and read back once per epoch
+    from device_metrics import RunningSums
+    running = RunningSums()
+
     for epoch in range(num_epochs):
+        running.reset()
         for batch in dataloader:
             real_imgs = batch.to(device)
             batch_size = real_imgs.size(0)
@@ -180,8 +188,10 @@ def train(num_epochs=120):
             d_loss = 0.5 * (loss_real + loss_fake)
             d_loss.backward()
             optimizer_D.step()
+            running.add(n=batch_size, d_loss=d_loss, g_loss=g_loss)
 
-        print(f"Epoch {epoch+1}/{num_epochs} | D Loss: {d_loss.item():.4f} | G Loss: {g_loss.item():.4f}")
+        epoch_losses = running.means()
+        print(f"Epoch {epoch+1}/{num_epochs} | D Loss: {epoch_losses['d_loss']:.4f} | G Loss: {epoch_losses['g_loss']:.4f}")
 
         # Show generated images
         with torch.no_grad():
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Asynchronous, atomic training checkpoints with resume.
+
+CheckpointManager.save() snapshots model, optimizer, scheduler, RNG and
+epoch state into CPU copies on the training thread (cheap), then serialises
+them on a background thread: torch.save to a temp file, fsync, os.replace,
+so a preempted run never leaves a torn checkpoint. It keeps the last N epoch
+checkpoints plus best.pt, and resume() restores everything so an
+interrupted run continues from the next epoch instead of from zero.
+Under torch.distributed only rank 0 writes; every rank can resume.
+
+config (the run's hyperparameters: lr, batch size, epochs, schedule, ...) is
+written to config.json next to the checkpoints. resume() only continues a
+run with the same config; otherwise the old checkpoints are moved to
+previous/ and training starts fresh.
+"""
+
+import glob
+import json
+import os
+import random
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+# Deep copy of a (nested) state dict with every tensor cloned to the CPU, so
+# training can keep updating the live tensors while the copy is written
+def _to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def _rng_state():
+    state = {'torch': torch.get_rng_state(), 'numpy': np.random.get_state(), 'python': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['python'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def _is_main_rank():
+    return not (dist.is_available() and dist.is_initialized()) or dist.get_rank() == 0
+
+
+# JSON round trip, so tuples / numbers compare equal to what config.json holds
+def _normalise_config(config):
+    return json.loads(json.dumps(config, sort_keys=True, default=str))
+
+
+def _atomic_save(obj, path):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        torch.save(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# mode='min' treats a lower metric as better (val loss), 'max' a higher one (accuracy)
+class CheckpointManager:
+    def __init__(self, directory='checkpoints', keep_last=2, mode='min', config=None):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.mode = mode
+        self.config = _normalise_config(config) if config is not None else None
+        self.best_metric = None
+        self._pending = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        os.makedirs(directory, exist_ok=True)
+
+    def _epoch_paths(self):
+        paths = glob.glob(os.path.join(self.directory, 'epoch-*.pt'))
+        return sorted(paths, key=lambda p: int(re.search(r'epoch-(\d+)\.pt$', p).group(1)))
+
+    def _config_path(self):
+        return os.path.join(self.directory, 'config.json')
+
+    def _stored_config(self):
+        try:
+            with open(self._config_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_config(self):
+        tmp_path = self._config_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.config, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._config_path())
+
+    # Move the checkpoints of a run with another config to previous/
+    def _archive(self):
+        previous = os.path.join(self.directory, 'previous')
+        shutil.rmtree(previous, ignore_errors=True)
+        os.makedirs(previous)
+        for path in self._epoch_paths() + [os.path.join(self.directory, 'best.pt'), self._config_path()]:
+            if os.path.exists(path):
+                os.replace(path, os.path.join(previous, os.path.basename(path)))
+
+    def _is_better(self, metric):
+        if metric is None:
+            return False
+        if self.best_metric is None:
+            return True
+        return metric < self.best_metric if self.mode == 'min' else metric > self.best_metric
+
+    # Record that `epoch` epochs are complete. Returns True if metric is a new best.
+    # extra: anything picklable to restore on resume (e.g. the history lists).
+    def save(self, epoch, model, optimizer=None, scheduler=None, metric=None, extra=None):
+        is_best = self._is_better(metric)
+        if is_best:
+            self.best_metric = metric
+        if not _is_main_rank():
+            return is_best
+        if self.config is not None and self._stored_config() != self.config:
+            self._write_config()
+        state = {
+            'epoch': epoch,
+            'model': _to_cpu(model.state_dict()),
+            'optimizer': _to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+            'scheduler': scheduler.state_dict() if scheduler is not None else None,
+            'rng': _rng_state(),
+            'metric': metric,
+            'best_metric': self.best_metric,
+            'extra': extra,
+        }
+        self.wait()  # at most one write in flight
+        self._pending = self._executor.submit(self._write, state, is_best)
+        return is_best
+
+    def _write(self, state, is_best):
+        path = os.path.join(self.directory, f"epoch-{state['epoch']:03d}.pt")
+        _atomic_save(state, path)
+        if is_best:
+            # Hardlink the file just written, then rename over best.pt (no second serialisation)
+            best_tmp = os.path.join(self.directory, 'best.pt.tmp')
+            if os.path.exists(best_tmp):
+                os.remove(best_tmp)
+            try:
+                os.link(path, best_tmp)
+            except OSError:
+                _atomic_save(state, os.path.join(self.directory, 'best.pt'))
+            else:
+                os.replace(best_tmp, os.path.join(self.directory, 'best.pt'))
+        for old in self._epoch_paths()[:-self.keep_last]:
+            os.remove(old)
+
+    # Block until the background write has finished (and re-raise its errors)
+    def wait(self):
+        if self._pending is not None:
+            self._pending.result()
+            self._pending = None
+
+    def latest(self):
+        paths = self._epoch_paths()
+        return paths[-1] if paths else None
+
+    # Restore the newest checkpoint into model/optimizer/scheduler and the RNGs.
+    # Returns (epochs already done, extra), or (0, None) when starting fresh
+    # (no checkpoint, or one written with a different config).
+    def resume(self, model, optimizer=None, scheduler=None, map_location='cpu'):
+        # config.json is read first and archived last, so other DDP ranks never
+        # see a matching config with checkpoints that rank 0 is moving away
+        stored = self._stored_config()
+        path = self.latest()
+        if path is None:
+            return 0, None
+        if self.config is not None and stored is not None and stored != self.config:
+            changed = sorted(k for k in set(stored) | set(self.config) if stored.get(k) != self.config.get(k))
+            print(f"⚠️ {self.directory} holds a run with a different config ({', '.join(changed)}); "
+                  f"moving it to {os.path.join(self.directory, 'previous')} and starting fresh")
+            if _is_main_rank():
+                self._archive()
+            return 0, None
+        state = torch.load(path, map_location=map_location, weights_only=False)
+        model.load_state_dict(state['model'])
+        if optimizer is not None and state['optimizer'] is not None:
+            optimizer.load_state_dict(state['optimizer'])
+        if scheduler is not None and state['scheduler'] is not None:
+            scheduler.load_state_dict(state['scheduler'])
+        _set_rng_state(state['rng'])
+        self.best_metric = state['best_metric']
+        print(f"✅ Resumed from {path} (epoch {state['epoch']})")
+        return state['epoch'], state['extra']
+
+    # Load the best weights into model (after training)
+    def load_best(self, model, map_location='cpu'):
+        self.wait()
+        state = torch.load(os.path.join(self.directory, 'best.pt'), map_location=map_location, weights_only=False)
+        model.load_state_dict(state['model'])
+        return state['metric']
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Data echoing for input-bound training.
+
+A small model like the conv TwinsSVT trains a CPU batch in less time than
+the loader workers need to read and decode its JPEGs, so the training loop
+spends much of each epoch waiting in next(loader). EchoLoader wraps a
+DataLoader and yields every fetched batch `factor` times: the fetched batch
+itself, then re-augmented copies (random horizontal flip and a random
+shifted crop with zero padding, per sample, as a few tensor ops in the main
+process). Each epoch fetches the dataset once, as before, and the model sees
+`factor` times as many (partly repeated) batches, so it no longer waits for
+the loader.
+
+With factor='auto' the factor is re-chosen every `window` fetched batches
+from the measured time spent waiting for the loader and the time the
+training loop spends between batches (echo_factor()): the loader needs about
+wait + factor * compute seconds per batch, and echoing more than
+loader time / compute time would only repeat data the loader could have
+delivered fresh. Echoing starts at 1; a window without waiting steps it
+back down by one to re-measure. Under DDP every rank applies the largest
+factor any rank chose, so all ranks run the same number of steps.
+"""
+
+import math
+import time
+
+try:
+    import torch
+    import torch.nn.functional as F
+except ImportError:  # Keras-only scripts (tf_data's echo stage) don't need torch
+    torch = F = None
+
+
+# Echo factor that covers loader_s seconds per fetched batch with compute_s
+# seconds per training step, clamped to [1, max_factor]
+def echo_factor(loader_s, compute_s, max_factor=4):
+    if compute_s <= 0:
+        return max_factor
+    return max(1, min(max_factor, math.floor(loader_s / compute_s + 1e-9)))  # 0.3 / 0.1 -> 3, not 2
+
+
+# Random horizontal flip and random shift by up to `padding` pixels (zero
+# padded), drawn per sample; works on uint8 and normalised float NCHW batches
+def reaugment(images, padding=16, hflip=True):
+    n, _, h, w = images.shape
+    if hflip:
+        flip = torch.rand(n, 1, 1, 1, device=images.device) < 0.5
+        images = torch.where(flip, images.flip(3), images)
+    if not padding:
+        return images
+    padded = F.pad(images, (padding, padding, padding, padding))
+    dy = torch.randint(0, 2 * padding + 1, (n,)).tolist()
+    dx = torch.randint(0, 2 * padding + 1, (n,)).tolist()
+    return torch.stack([padded[i, :, y:y + h, x:x + w] for i, (y, x) in enumerate(zip(dy, dx))])
+
+
+# DDP ranks must run the same number of steps: all take the largest factor
+def _agree(factor):
+    from ddp import is_distributed
+    if not is_distributed():
+        return factor
+    import torch.distributed as dist
+    t = torch.tensor([factor])
+    dist.all_reduce(t, op=dist.ReduceOp.MAX)
+    return int(t.item())
+
+
+class EchoLoader:
+    # loader yields (images, labels) batches; factor is an int or 'auto'
+    def __init__(self, loader, factor='auto', max_factor=4, window=20, padding=16, hflip=True):
+        self.loader = loader
+        self.auto = factor == 'auto'
+        self.factor = 1 if self.auto else int(factor)
+        self.max_factor = max_factor
+        self.window = window
+        self.padding = padding
+        self.hflip = hflip
+
+    # set_epoch() / len(dataset) see the wrapped loader's sampler and dataset
+    @property
+    def sampler(self):
+        return self.loader.sampler
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self):
+        return len(self.loader) * self.factor
+
+    def __iter__(self):
+        it = iter(self.loader)
+        wait = compute = 0.0
+        fetched = steps = 0
+        first = True
+        while True:
+            start = time.perf_counter()
+            try:
+                images, labels = next(it)
+            except StopIteration:
+                return
+            # The first fetch includes worker start-up, not steady-state loading
+            if not first:
+                wait += time.perf_counter() - start
+                fetched += 1
+            for i in range(self.factor):
+                echoed = images if i == 0 else reaugment(images, self.padding, self.hflip)
+                handed = time.perf_counter()
+                yield echoed, labels
+                if not first:
+                    compute += time.perf_counter() - handed
+                    steps += 1
+            first = False
+            if self.auto and fetched >= self.window:
+                self._update(wait / fetched, compute / steps)
+                wait = compute = 0.0
+                fetched = steps = 0
+
+    def _update(self, wait_s, compute_s):
+        if wait_s < 0.05 * compute_s:
+            # No waiting tells nothing about how much slower the loader is
+            # (e.g. JPEGs now come from the page cache): probe one lower
+            factor = max(1, self.factor - 1)
+        else:
+            factor = echo_factor(wait_s + self.factor * compute_s, compute_s, self.max_factor)
+        factor = _agree(factor)
+        if factor != self.factor:
+            print(f"Data echoing x{factor} (loader wait {wait_s * 1000:.0f} ms/batch, "
+                  f"compute {compute_s * 1000:.0f} ms/step)")
+            self.factor = factor
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Split manifests for the PlantVillage and onion datasets.
+
+Instead of copying every image into train/val/test folders, the split is
+written once to a small CSV manifest (path, split, label) and the loaders
+read straight from the original files.
+
+Split assignment is a hash of the file name (or content), so adding images
+never moves existing ones: new files land in a split and everything built
+on the old split stays valid. The ratios / key / salt a manifest was built
+with are stored next to it (<manifest>.json); a script asking for different
+ones gets a fresh split instead of silently reusing the old one.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+
+from image_io import open_rgb
+
+try:
+    from torch.utils.data import Dataset
+except ImportError:  # Keras-only scripts don't need torch
+    Dataset = object
+
+SPLITS = ('train', 'val', 'test')
+VALID_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+# Group a PlantVillage-style folder (one sub-folder per class) into {label: [paths]}
+def scan_class_folders(data_dir, valid_exts=VALID_EXTS, min_images=0):
+    class_to_images = {}
+    for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+        if not entry.is_dir():
+            continue
+        images = sorted(
+            f.path for f in os.scandir(entry.path)
+            if f.is_file() and f.name.lower().endswith(valid_exts)
+        )
+        if len(images) < min_images:
+            continue  # Skip classes with too few samples
+        class_to_images[entry.name] = images
+    return class_to_images
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# Stable split for a key: the hash maps it to [0, 1) and ratios are (train, val)
+def hash_split(key, ratios=(0.8, 0.1), salt=''):
+    digest = hashlib.sha1((salt + key).encode('utf-8')).digest()
+    u = int.from_bytes(digest[:8], 'big') / 2 ** 64
+    return 'train' if u < ratios[0] else 'val' if u < ratios[0] + ratios[1] else 'test'
+
+
+def split_key(path, key='name'):
+    return file_digest(path) if key == 'content' else os.path.basename(path)
+
+
+# Assign every image to a split; test gets whatever train/val don't.
+# key='name' hashes the file name, key='content' hashes the bytes (rename-proof).
+# groups ({path: group key}, e.g. from phash_index.find_duplicate_groups) hashes
+# the group key instead, so near-duplicates always share a split.
+def build_split_manifest(class_to_images, ratios=(0.8, 0.1), key='name', salt='', groups=None):
+    rows = []
+    for label in sorted(class_to_images):
+        for path in sorted(class_to_images[label]):
+            k = groups[path] if groups else split_key(path, key)
+            rows.append({'path': path, 'split': hash_split(k, ratios, salt), 'label': label})
+    return rows
+
+
+def _split_params(ratios, key, salt, groups):
+    return {'ratios': [float(r) for r in ratios], 'key': key, 'salt': salt, 'grouped': bool(groups)}
+
+
+def _load_split_params(manifest_path):
+    try:
+        with open(manifest_path + '.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Incremental version: rows already in manifest_path keep their split, only new
+# files are hashed and assigned, and files that disappeared are dropped. A new
+# file whose duplicate group already has a split joins that split. A manifest
+# built with other ratios / key / salt (or without a record of them) is rebuilt.
+def update_split_manifest(class_to_images, manifest_path='split_manifest.csv',
+                          ratios=(0.8, 0.1), key='name', salt='', groups=None):
+    params = _split_params(ratios, key, salt, groups)
+    previous = {}
+    if os.path.exists(manifest_path):
+        stored = _load_split_params(manifest_path)
+        if stored == params:
+            previous = {r['path']: r for r in load_split_manifest(manifest_path)}
+        else:
+            print(f"⚠️ {manifest_path} was built with {stored}, not {params}; re-splitting")
+
+    group_split = {}
+    if groups:
+        for path, r in sorted(previous.items()):
+            if path in groups:
+                group_split.setdefault(groups[path], r['split'])
+
+    rows, added = [], 0
+    for label in sorted(class_to_images):
+        for path in sorted(class_to_images[label]):
+            old = previous.get(path)
+            if old is not None and old['label'] == label:
+                rows.append(old)
+                continue
+            if groups:
+                split = group_split.setdefault(groups[path], hash_split(groups[path], ratios, salt))
+            else:
+                split = hash_split(split_key(path, key), ratios, salt)
+            rows.append({'path': path, 'split': split, 'label': label})
+            added += 1
+
+    removed = len(set(previous) - {r['path'] for r in rows})
+    if added or removed or not previous:
+        save_split_manifest(rows, manifest_path)
+        tmp_path = manifest_path + '.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(params, f)
+        os.replace(tmp_path, manifest_path + '.json')
+    print(f"Split manifest: {len(rows)} images ({added} new, {removed} removed)")
+    if groups:
+        splits_per_group = {}
+        for r in rows:
+            splits_per_group.setdefault(groups[r['path']], set()).add(r['split'])
+        leaked = sum(1 for s in splits_per_group.values() if len(s) > 1)
+        if leaked:
+            print(f"⚠️ {leaked} duplicate groups span several splits (assigned before grouping); "
+                  f"delete {manifest_path} to re-split them")
+    return rows
+
+
+def save_split_manifest(rows, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['path', 'split', 'label'])
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, manifest_path)
+
+
+def load_split_manifest(manifest_path):
+    with open(manifest_path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def split_rows(rows, split):
+    return [r for r in rows if r['split'] == split]
+
+
+# Print per-split, per-class counts (replaces os.listdir on the copied folders)
+def print_split_stats(rows):
+    for split in SPLITS:
+        print(f"\n{split.upper()}")
+        counts = {}
+        for r in split_rows(rows, split):
+            counts[r['label']] = counts.get(r['label'], 0) + 1
+        for label in sorted(counts):
+            print(f"  {label}: {counts[label]} images")
+
+
+# DataFrame for Keras' ImageDataGenerator.flow_from_dataframe(x_col='path', y_col='label')
+def manifest_dataframe(rows, split):
+    import pandas as pd
+    return pd.DataFrame(split_rows(rows, split), columns=['path', 'split', 'label'])
+
+
+# Optional: materialise the split as hardlinks so folder-based tools still work.
+# Only missing links are created and stale ones removed, so re-splitting after
+# adding images touches just the delta and never copies image bytes. Every
+# split gets a folder for every label, even an empty one, so folder-based
+# loaders see the same classes (and class indices) in each split.
+def link_split_dirs(rows, out_root='.'):
+    for split in SPLITS:
+        for label in sorted({r['label'] for r in rows}):
+            os.makedirs(os.path.join(out_root, split, label), exist_ok=True)
+
+    wanted = {}
+    for r in rows:
+        dst = os.path.join(out_root, r['split'], r['label'], os.path.basename(r['path']))
+        wanted[dst] = r['path']
+
+    for split in SPLITS:
+        for root, _, files in os.walk(os.path.join(out_root, split)):
+            for name in files:
+                dst = os.path.join(root, name)
+                if dst not in wanted:
+                    os.remove(dst)
+
+    for dst, src in wanted.items():
+        if os.path.exists(dst):
+            continue
+        try:
+            os.link(src, dst)
+        except OSError:  # Cross-device or unsupported filesystem
+            shutil.copyfile(src, dst)
+
+
+# Drop-in replacement for torchvision's ImageFolder that reads from the manifest.
+# target_size lets JPEGs decode at reduced resolution (see image_io.open_rgb).
+class ManifestDataset(Dataset):
+    def __init__(self, rows, split, transform=None, classes=None, target_size=None):
+        # Class order must match across splits, so derive it from all rows
+        self.classes = classes or sorted({r['label'] for r in rows})
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.samples = [(r['path'], self.class_to_idx[r['label']]) for r in split_rows(rows, split)]
+        self.targets = [t for _, t in self.samples]
+        self.transform = transform
+        self.target_size = target_size
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        path, target = self.samples[idx]
+        image = open_rgb(path, self.target_size)
+        if self.transform:
+            image = self.transform(image)
+        return image, target
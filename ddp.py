@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Multi-process CPU data-parallel training (torch.distributed, gloo).
+
+`python ddp.py --nproc 4 onion_convnext.py` runs the script in 4 processes
+that train one model together: every rank computes gradients on its shard of
+each batch and DistributedDataParallel averages them over gloo before the
+optimizer step. Each rank is pinned to its own block of cores (blocks are
+filled socket by socket, so no rank straddles two sockets) and runs that many
+torch threads. Ranks meet over TCP at --master-addr:--master-port; for
+several nodes run the launcher on each with --nnodes, --node-rank and the
+first node's address (the checkpoint directory must then be shared storage).
+Ranks on localhost are enough to test it.
+
+Inside a script, init_distributed() joins the process group (a no-op without
+the launcher), wrap_model() adds DDP, and shard_loader() gives each rank its
+part of the data: a DistributedSampler for training, an unpadded strided
+shard for evaluation so the all-reduced metrics count every sample once.
+Batch sizes passed to shard_loader() are global, so hyperparameters do not
+change with the number of ranks. Only rank 0 prints (print(..., force=True)
+prints from any rank), CheckpointManager writes on rank 0 only, and
+ClassificationMetrics all-reduces its sums. finish() ends the group after
+training; rank 0 then runs the test/report cells alone.
+
+The Colab exports contain `!` shell lines, so they are run through IPython.
+Under the launcher the scripts skip their download/split cells: run the
+script (or those cells) once in a single process first.
+"""
+
+import argparse
+import builtins
+import os
+import subprocess
+import sys
+import time
+from datetime import timedelta
+
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Sampler
+from torch.utils.data.distributed import DistributedSampler
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main():
+    return get_rank() == 0
+
+
+# Replace print on the other ranks so the scripts' logging needs no rank checks
+def _print_on_main_only(rank):
+    builtin_print = builtins.print
+
+    def print(*args, force=False, **kwargs):
+        if rank == 0 or force:
+            builtin_print(*args, **kwargs)
+
+    builtins.print = print
+
+
+# Join the gloo group described by the launcher's environment (RANK,
+# WORLD_SIZE, MASTER_ADDR, MASTER_PORT). Returns (rank, world_size); (0, 1)
+# when the script was started directly.
+def init_distributed(timeout_minutes=30):
+    if int(os.environ.get('WORLD_SIZE', 1)) > 1 and not is_distributed():
+        dist.init_process_group('gloo', timeout=timedelta(minutes=timeout_minutes))
+        if hasattr(os, 'sched_getaffinity'):
+            torch.set_num_threads(len(os.sched_getaffinity(0)))
+        _print_on_main_only(dist.get_rank())
+        print(f"✅ Rank 0 of {dist.get_world_size()} gloo ranks ({torch.get_num_threads()} threads each)")
+    return get_rank(), get_world_size()
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+# DDP around model when distributed, the model itself otherwise. Keep the
+# plain model for state_dict/checkpoints. The classifiers here have no
+# BatchNorm, so buffers need no per-forward broadcast.
+def wrap_model(model):
+    if not is_distributed():
+        return model
+    return DistributedDataParallel(model, broadcast_buffers=False)
+
+
+# End the process group after training; only rank 0 returns
+def finish():
+    if not is_distributed():
+        return
+    dist.barrier()
+    rank = dist.get_rank()
+    dist.destroy_process_group()
+    if rank != 0:
+        sys.exit(0)
+
+
+# Indices rank, rank + W, rank + 2W, ...: unlike DistributedSampler no
+# sample is repeated to even out the shards
+class StridedShardSampler(Sampler):
+    def __init__(self, dataset):
+        self.indices = range(get_rank(), len(dataset), get_world_size())
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+# DataLoader over this rank's shard; batch_size is the global batch.
+# Without a process group it is a plain DataLoader over the whole dataset.
+def shard_loader(dataset, batch_size=32, shuffle=False, **kwargs):
+    if not is_distributed():
+        return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **kwargs)
+    sampler = DistributedSampler(dataset, shuffle=True) if shuffle else StridedShardSampler(dataset)
+    return DataLoader(dataset, batch_size=max(1, batch_size // get_world_size()), sampler=sampler, **kwargs)
+
+
+# Reshuffle a training shard_loader for the new epoch (same permutation on all ranks)
+def set_epoch(loader, epoch):
+    if isinstance(getattr(loader, 'sampler', None), DistributedSampler):
+        loader.sampler.set_epoch(epoch)
+
+
+def _socket_of(cpu):
+    try:
+        with open(f'/sys/devices/system/cpu/cpu{cpu}/topology/physical_package_id') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+
+# nprocs equal blocks of the CPUs this process may use, ordered socket by socket
+def cpu_blocks(nprocs):
+    cpus = sorted(os.sched_getaffinity(0), key=lambda c: (_socket_of(c), c))
+    per_rank = len(cpus) // nprocs
+    if per_rank == 0:
+        raise ValueError(f"{nprocs} ranks need at least {nprocs} CPUs, found {len(cpus)}")
+    return [cpus[i * per_rank:(i + 1) * per_rank] for i in range(nprocs)]
+
+
+# Notebook exports with `!`/`%` lines run through IPython from a .ipy copy
+# next to the script (so its sibling modules still import)
+def _command(script, args):
+    with open(script) as f:
+        source = f.read()
+    if not any(line.lstrip().startswith(('!', '%')) for line in source.splitlines()):
+        return [sys.executable, script, *args], None
+    ipy_path = os.path.splitext(script)[0] + '.ddp.ipy'
+    with open(ipy_path, 'w') as f:
+        f.write(source)
+    return [sys.executable, '-m', 'IPython', ipy_path, '--', *args], ipy_path
+
+
+# Start nprocs ranks of script on this node and wait for them. If one rank
+# fails the others are terminated. Returns the first non-zero exit code (or 0).
+def launch(script, args=(), nprocs=1, nnodes=1, node_rank=0, master_addr='127.0.0.1', master_port=29500):
+    command, temp_path = _command(script, list(args))
+    blocks = cpu_blocks(nprocs) if hasattr(os, 'sched_getaffinity') else [None] * nprocs
+    procs = []
+    try:
+        for local_rank, cores in enumerate(blocks):
+            env = {
+                **os.environ,
+                'RANK': str(node_rank * nprocs + local_rank),
+                'LOCAL_RANK': str(local_rank),
+                'WORLD_SIZE': str(nnodes * nprocs),
+                'LOCAL_WORLD_SIZE': str(nprocs),
+                'MASTER_ADDR': master_addr,
+                'MASTER_PORT': str(master_port),
+            }
+            preexec = None
+            if cores is not None:
+                env['OMP_NUM_THREADS'] = str(len(cores))
+                preexec = lambda cores=cores: os.sched_setaffinity(0, cores)
+            procs.append(subprocess.Popen(command, env=env, preexec_fn=preexec))
+
+        exit_code = 0
+        while procs:
+            for proc in list(procs):
+                code = proc.poll()
+                if code is None:
+                    continue
+                procs.remove(proc)
+                if code != 0 and exit_code == 0:
+                    exit_code = code
+                    for other in procs:
+                        other.terminate()
+            time.sleep(0.5)
+        return exit_code
+    finally:
+        for proc in procs:
+            proc.kill()
+        if temp_path is not None:
+            os.remove(temp_path)
+
+
+def _num_sockets():
+    if not hasattr(os, 'sched_getaffinity'):
+        return 1
+    return len({_socket_of(c) for c in os.sched_getaffinity(0)})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a training script in N gloo DDP ranks per node")
+    parser.add_argument('--nproc', type=int, default=_num_sockets(), help="ranks on this node (default: one per socket)")
+    parser.add_argument('--nnodes', type=int, default=1)
+    parser.add_argument('--node-rank', type=int, default=0)
+    parser.add_argument('--master-addr', default='127.0.0.1')
+    parser.add_argument('--master-port', type=int, default=29500)
+    parser.add_argument('script')
+    parser.add_argument('args', nargs=argparse.REMAINDER)
+    opts = parser.parse_args()
+    sys.exit(launch(opts.script, opts.args, nprocs=opts.nproc, nnodes=opts.nnodes, node_rank=opts.node_rank,
+                    master_addr=opts.master_addr, master_port=opts.master_port))
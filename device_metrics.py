@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Running training metrics kept on the device.
+
+Calling loss.item() or (preds == labels).sum().item() on every batch forces
+a host/device sync per batch and stalls the pipeline. These accumulators add
+each batch into tensors on the training device and only copy to the host
+when compute() / totals() is called, once per epoch or logging interval.
+Under torch.distributed, ClassificationMetrics.compute() all-reduces the
+sums so every rank sees the metrics of the whole (sharded) dataset.
+
+ClassificationMetrics keeps loss, correct count and a bincount confusion
+matrix for the classifier loops; RunningSums keeps arbitrary named losses
+for the VAE / GAN / diffusion loops.
+"""
+
+import torch
+import torch.distributed as dist
+
+
+class ClassificationMetrics:
+    def __init__(self, num_classes, device):
+        self.num_classes = num_classes
+        self.device = torch.device(device)
+        self.reset()
+
+    def reset(self):
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.correct = torch.zeros((), dtype=torch.int64, device=self.device)
+        self.confusion = torch.zeros(self.num_classes ** 2, dtype=torch.int64, device=self.device)
+        self.count = 0  # batch sizes are known on the host, so no sync needed
+
+    # loss: the batch's mean loss tensor (or None for test-only passes)
+    @torch.no_grad()
+    def update(self, outputs, labels, loss=None):
+        preds = outputs.argmax(1)
+        labels = labels.to(preds.device)
+        n = labels.size(0)
+        if loss is not None:
+            self.loss_sum += loss.detach().double() * n
+        self.correct += (preds == labels).sum()
+        self.confusion += torch.bincount(labels * self.num_classes + preds, minlength=self.num_classes ** 2)
+        self.count += n
+
+    # One device -> host copy: {'loss', 'accuracy', 'count', 'confusion'}
+    def compute(self):
+        sums = torch.stack([self.loss_sum, self.correct.double(),
+                            torch.tensor(float(self.count), dtype=torch.float64, device=self.device)])
+        confusion = self.confusion
+        if dist.is_available() and dist.is_initialized():
+            confusion = confusion.clone()
+            dist.all_reduce(sums)
+            dist.all_reduce(confusion)
+        loss_sum, correct, count = sums.tolist()
+        return {
+            'loss': loss_sum / max(count, 1),
+            'accuracy': correct / max(count, 1),
+            'count': int(count),
+            'confusion': confusion.view(self.num_classes, self.num_classes).cpu().numpy(),
+        }
+
+
+# Named running sums, e.g. sums.add(d_loss=d_loss, g_loss=g_loss). With n, each
+# value is weighted by n (pass the batch size for per-sample means).
+class RunningSums:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sums = {}
+        self.counts = {}
+
+    @torch.no_grad()
+    def add(self, n=1, **values):
+        for name, value in values.items():
+            value = value.detach().double() * n
+            self.sums[name] = self.sums[name] + value if name in self.sums else value
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    # One device -> host copy of every sum
+    def totals(self):
+        names = list(self.sums)
+        if not names:
+            return {}
+        return dict(zip(names, torch.stack([self.sums[k] for k in names]).tolist()))
+
+    def means(self):
+        return {name: total / self.counts[name] for name, total in self.totals().items()}
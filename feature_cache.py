@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Frozen-backbone feature cache for head-only ("linear probe") training.
+
+When everything except the classifier is frozen, the backbone output for an
+image never changes, so running it every epoch is wasted work.
+cache_features() runs forward_features + pooling once per image and per
+augmentation view (all K views from one decode of each batch, K capped by
+an optional storage budget), and writes the pooled embeddings to a float16 memmap
+(prefix.features.npy, views x N x D) with a label array and a JSON header.
+feature_loader() then streams batches from that store, picking a random view
+per sample for training, so the head trains in seconds per epoch.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler, SubsetRandomSampler
+
+from torch_loaders import make_loader
+
+
+def _paths(prefix):
+    return prefix + '.json', prefix + '.features.npy', prefix + '.labels.npy'
+
+
+def read_header(prefix):
+    with open(_paths(prefix)[0]) as f:
+        return json.load(f)
+
+
+# Identifies the images behind a dataset: sample paths for ManifestDataset /
+# ImageFolder, the packed header's paths for PackedImageDataset
+def _source_digest(dataset):
+    if hasattr(dataset, 'samples'):
+        paths = [p for p, _ in dataset.samples]
+    elif hasattr(dataset, 'prefix'):
+        from packed_store import read_header as read_packed_header
+        paths = read_packed_header(dataset.prefix)['paths']
+    else:
+        paths = [str(len(dataset))]
+    return hashlib.sha1('\n'.join(paths).encode()).hexdigest()
+
+
+# view_transform for cache_features. batch_transform is a BatchTransform
+# (called with train=False). Without augment, even views are the images as is
+# and odd views their horizontal flip (two views cover RandomHorizontalFlip
+# exactly). With augment (tensor transforms on one uint8 CHW image, e.g.
+# RandomResizedCrop / RandomRotation / ColorJitter), view 0 is the clean image
+# and every other view draws fresh random parameters per image.
+def augment_views(batch_transform, augment=None):
+    def view_transform(images, view):
+        if augment is None:
+            images = images.flip(3) if view % 2 else images
+        elif view > 0:
+            images = torch.stack([augment(image) for image in images])
+        return batch_transform(images, train=False)
+    view_transform.key = repr(augment) if augment is not None else 'flip'
+    return view_transform
+
+
+# Run the frozen backbone once over dataset and store pooled features under prefix,
+# `views` augmented views per image. storage_budget_mb caps the store size by
+# lowering the number of views; seed makes the augmented views repeatable.
+# Skips the work if the header already describes the same model, images and views.
+@torch.no_grad()
+def cache_features(model, dataset, prefix, view_transform, views=1, batch_size=64,
+                   device='cpu', loader_settings=None, storage_budget_mb=None, seed=0):
+    header_path, features_path, labels_path = _paths(prefix)
+    if storage_budget_mb is not None:
+        view_mb = len(dataset) * model.num_features * 2 / 1024 ** 2  # float16
+        fit = max(1, int(storage_budget_mb // view_mb))
+        if fit < views:
+            print(f"⚠️ {views} views need {views * view_mb:.0f} MB, budget is {storage_budget_mb} MB: caching {fit}")
+            views = fit
+    header = {
+        'model': getattr(model, 'pretrained_cfg', {}).get('architecture', type(model).__name__),
+        'count': len(dataset),
+        'dim': model.num_features,
+        'views': views,
+        'augment': getattr(view_transform, 'key', None),
+        'seed': seed,
+        'dtype': 'float16',
+        'source': _source_digest(dataset),
+    }
+    if os.path.exists(header_path) and os.path.exists(features_path) and read_header(prefix) == header:
+        print(f"✅ Reusing feature cache {prefix} ({len(dataset)} images x {views} views)")
+        return prefix
+
+    os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+    features = np.lib.format.open_memmap(features_path + '.tmp.npy', mode='w+', dtype=np.float16,
+                                         shape=(views, len(dataset), header['dim']))
+    labels = np.empty(len(dataset), dtype=np.int64)
+    loader = make_loader(dataset, batch_size=batch_size, settings=loader_settings, tune=False)
+
+    was_training = model.training
+    model.eval()
+    offset = 0
+    with torch.random.fork_rng(devices=[]):  # leave the training RNG untouched
+        torch.manual_seed(seed)
+        # Each batch is decoded once and run through the backbone once per view
+        for images, targets in loader:
+            images = images.to(device, non_blocking=True)
+            for view in range(views):
+                pooled = model.forward_head(model.forward_features(view_transform(images, view)), pre_logits=True)
+                features[view, offset:offset + len(targets)] = pooled.float().cpu().numpy()
+            labels[offset:offset + len(targets)] = targets.numpy()
+            offset += len(targets)
+    model.train(was_training)
+
+    features.flush()
+    del features
+    os.replace(features_path + '.tmp.npy', features_path)
+    np.save(labels_path, labels)
+    with open(header_path + '.tmp', 'w') as f:
+        json.dump(header, f)
+    os.replace(header_path + '.tmp', header_path)
+    print(f"✅ Cached {len(labels)} x {views} features into {features_path}")
+    return prefix
+
+
+# Dataset indexed by a list of sample indices (one whole batch per __getitem__),
+# so a batch is a single gather from the memmap instead of N small reads
+class FeatureDataset(Dataset):
+    def __init__(self, prefix, random_view=False):
+        header = read_header(prefix)
+        self.views = header['views']
+        self.features = np.load(_paths(prefix)[1], mmap_mode='r')
+        self.targets = np.load(_paths(prefix)[2])
+        self.random_view = random_view and self.views > 1
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, indices):
+        idx = np.sort(np.asarray(indices))
+        view = np.random.randint(self.views, size=len(idx)) if self.random_view else np.zeros(len(idx), dtype=np.int64)
+        x = torch.from_numpy(self.features[view, idx].astype(np.float32))
+        return x, torch.from_numpy(self.targets[idx])
+
+
+# Batches of (float32 features, labels) from a feature cache. Training loaders
+# shuffle and draw one random augmentation view per sample each epoch.
+# indices restricts the loader to those samples (e.g. a validation subsample).
+def feature_loader(prefix, batch_size=256, shuffle=False, indices=None):
+    dataset = FeatureDataset(prefix, random_view=shuffle)
+    if indices is not None:
+        sampler = SubsetRandomSampler(indices) if shuffle else list(indices)
+    else:
+        sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=False), batch_size=None)
@@ -25,31 +25,26 @@ import time
 
 # Upload the zipped dataset containing 'healthy' images
 uploaded = files.upload()
-# Extract the uploaded zip file
-dataset_folder = "healthy_dataset"
+# Images are read straight from the uploaded zip file(s), no extraction
+from PIL import Image
+from zip_dataset import ZipImageDataset
 
-for file in uploaded.keys():
-    if file.endswith(".zip"):
-        with ZipFile(file, 'r') as zip_ref:
-            zip_ref.extractall(dataset_folder)
-
-# Recursive image loader function
-def load_images_recursive(root_folder, img_size=(64, 64)):
+# Zip image loader function
+def load_images_from_zip(zip_path, img_size=(64, 64)):
+    dataset = ZipImageDataset(zip_path, target_size=img_size, valid_exts=('.png', '.jpg', '.jpeg'))
     image_list = []
-    for root, dirs, files in os.walk(root_folder):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg')):
-                try:
-                    img = load_img(os.path.join(root, file), target_size=img_size)
-                    img = img_to_array(img)
-                    img = (img - 127.5) / 127.5  # Normalize to [-1, 1]
-                    image_list.append(img)
-                except Exception as e:
-                    print(f"Error loading {file}: {e}")
-    return np.array(image_list)
-
-# Load images safely from subdirectories
-image_data = load_images_recursive(dataset_folder)
+    for idx in range(len(dataset)):
+        try:
+            img = dataset[idx].resize((img_size[1], img_size[0]), Image.NEAREST)  # same as load_img(target_size=...)
+            img = img_to_array(img)
+            img = (img - 127.5) / 127.5  # Normalize to [-1, 1]
+            image_list.append(img)
+        except Exception as e:
+            print(f"Error loading {dataset.members[idx][0]}: {e}")
+    return image_list
+
+# Load images safely from every uploaded zip
+image_data = np.array([img for file in uploaded.keys() if file.endswith(".zip") for img in load_images_from_zip(file)])
 print(f"✅ Loaded {image_data.shape[0]} images of shape {image_data.shape[1:]}")
 
 plt.figure(figsize=(10, 4))
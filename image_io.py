@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Reduced-resolution image decoding shared by all Dataset classes.
+
+JPEG stores 8x8 DCT blocks, so libjpeg can decode straight to 1/2, 1/4 or
+1/8 scale for a fraction of the cost of a full decode. PIL exposes this as
+Image.draft(); open_rgb() asks for the smallest such scale that is still at
+least the target size, and the usual Resize then does the last step.
+Non-JPEG files fall back to a normal full decode.
+
+Run `python image_io.py <image_dir> [size]` to benchmark decode time.
+"""
+
+import os
+import sys
+import time
+
+from PIL import Image
+
+
+# Open an image as RGB. With target_size=(h, w) (or an int), JPEGs are decoded
+# at the nearest power-of-two scale that keeps both sides >= the target.
+def open_rgb(path, target_size=None):
+    image = Image.open(path)
+    if target_size is not None and image.format == 'JPEG':
+        if isinstance(target_size, int):
+            target_size = (target_size, target_size)
+        # draft() takes (width, height) and never goes below the requested size
+        image.draft('RGB', (target_size[1], target_size[0]))
+    return image.convert('RGB')
+
+
+# ImageFolder(loader=...) compatible loader bound to a target size
+def draft_loader(target_size):
+    def loader(path):
+        return open_rgb(path, target_size)
+    return loader
+
+
+# Mean decode+resize time per image, full decode vs draft decode
+def benchmark_decode(paths, target_size=(224, 224), repeats=3):
+    results = {}
+    for name, size in (('full', None), ('draft', target_size)):
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for path in paths:
+                open_rgb(path, size).resize((target_size[1], target_size[0]), Image.BILINEAR)
+        results[name] = (time.perf_counter() - start) / (repeats * len(paths))
+    return results
+
+
+if __name__ == '__main__':
+    image_dir = sys.argv[1]
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 224
+    paths = []
+    for root, _, files in os.walk(image_dir):
+        paths += [os.path.join(root, f) for f in files if f.lower().endswith(('.jpg', '.jpeg'))]
+    paths = sorted(paths)[:200]
+    if not paths:
+        raise ValueError(f"No JPEG images found in {image_dir}")
+
+    res = benchmark_decode(paths, (size, size))
+    print(f"Decode + resize to {size}x{size} over {len(paths)} images:")
+    print(f"  full decode : {res['full'] * 1000:.2f} ms/image")
+    print(f"  draft decode: {res['draft'] * 1000:.2f} ms/image ({res['full'] / res['draft']:.1f}x faster)")
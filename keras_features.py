@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Embedding cache for Keras models with a frozen base.
+
+With the ViT layer / DenseNet121 base frozen, model.fit still recomputes the
+backbone for every batch of every epoch. split_frozen_model() cuts such a
+model at its global pooling layer into a frozen feature extractor and a
+trainable head that shares the original head layers. cache_keras_features()
+runs the extractor once per split, optionally over K augmented views, into a
+float16 memmap (same layout as feature_cache.py), feature_dataset() streams
+the cached features through tf.data, and assemble_model() stacks extractor
+and trained head back into a single image -> probabilities model for export.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+
+def _paths(prefix):
+    return prefix + '.json', prefix + '.features.npy', prefix + '.labels.npy'
+
+
+def read_header(prefix):
+    with open(_paths(prefix)[0]) as f:
+        return json.load(f)
+
+
+def _is_pooling(layer):
+    return type(layer).__name__.startswith('Global')
+
+
+# (extractor, head): extractor maps images to the pooled features, head maps
+# pooled features to class probabilities. The head re-uses the model's own
+# Dense/Dropout layers, so training it updates the original model as well.
+def split_frozen_model(model, feature_layer=None):
+    if feature_layer is None:
+        feature_layer = [l for l in model.layers if _is_pooling(l)][-1]
+    elif isinstance(feature_layer, str):
+        feature_layer = model.get_layer(feature_layer)
+    extractor = tf.keras.Model(model.input, feature_layer.output, name='feature_extractor')
+    extractor.trainable = False
+
+    inputs = tf.keras.Input(shape=feature_layer.output.shape[1:])
+    x = inputs
+    for layer in model.layers[model.layers.index(feature_layer) + 1:]:
+        x = layer(x)
+    return extractor, tf.keras.Model(inputs, x, name='head')
+
+
+# Single image -> probabilities model for export/predict
+def assemble_model(extractor, head):
+    return tf.keras.Model(extractor.input, head(extractor.output), name='assembled')
+
+
+# Layer configs without the auto-generated names, for the cache header
+def _augment_config(augment):
+    return [{k: v for k, v in l.get_config().items() if k != 'name'} for l in augment.layers]
+
+
+# Run the extractor once over an image_dataset() split (not shuffled) and store
+# the pooled features under prefix, `views` per image: view 0 is the clean image,
+# the others pass through augment (e.g. tf_data.augmentation_layers(...)) with
+# fresh random parameters. storage_budget_mb lowers the number of views to fit.
+# key names the frozen base (e.g. its weights); the cache is reused while key,
+# image list, views and feature size are unchanged.
+def cache_keras_features(extractor, dataset, prefix, key, views=1, augment=None,
+                         storage_budget_mb=None, seed=0):
+    header_path, features_path, labels_path = _paths(prefix)
+    count, dim = int(dataset.samples), int(extractor.output.shape[-1])
+    if augment is None:
+        views = 1
+    if storage_budget_mb is not None:
+        view_mb = count * dim * 2 / 1024 ** 2  # float16
+        fit = max(1, int(storage_budget_mb // view_mb))
+        if fit < views:
+            print(f"⚠️ {views} views need {views * view_mb:.0f} MB, budget is {storage_budget_mb} MB: caching {fit}")
+            views = fit
+    header = {
+        'model': key,
+        'count': count,
+        'dim': dim,
+        'views': views,
+        'augment': _augment_config(augment) if views > 1 else None,
+        'seed': seed,
+        'dtype': 'float16',
+        'source': hashlib.sha1('\n'.join(dataset.filepaths).encode()).hexdigest(),
+    }
+    if os.path.exists(header_path) and os.path.exists(features_path) and read_header(prefix) == header:
+        print(f"✅ Reusing feature cache {prefix} ({count} images x {views} views)")
+        return prefix
+
+    os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+    features = np.lib.format.open_memmap(features_path + '.tmp.npy', mode='w+', dtype=np.float16,
+                                         shape=(views, count, dim))
+    labels = np.empty(count, dtype=np.int64)
+    tf.random.set_seed(seed)
+    offset = 0
+    # Each batch is decoded once and run through the extractor once per view
+    for x, y in dataset:
+        y = y.numpy()
+        n = len(y)
+        for view in range(views):
+            x_view = augment(x, training=True) if view > 0 else x
+            features[view, offset:offset + n] = extractor(x_view, training=False).numpy()
+        labels[offset:offset + n] = np.argmax(y, axis=-1) if y.ndim > 1 else y
+        offset += n
+    features.flush()
+    del features
+    os.replace(features_path + '.tmp.npy', features_path)
+
+    np.save(labels_path, labels)
+    with open(header_path + '.tmp', 'w') as f:
+        json.dump(header, f)
+    os.replace(header_path + '.tmp', header_path)
+    print(f"✅ Cached {offset} x {views} features into {features_path}")
+    return prefix
+
+
+# tf.data source over a feature cache: yields (float32 features, labels).
+# Shuffled (training) datasets draw one random view per sample each epoch.
+def feature_dataset(prefix, num_classes, batch_size=32, shuffle=False, one_hot=True, seed=None):
+    header = read_header(prefix)
+    features = np.load(_paths(prefix)[1], mmap_mode='r')
+    labels = np.load(_paths(prefix)[2])
+    rng = np.random.default_rng(seed)
+
+    def gather(idx):
+        idx = np.sort(idx)  # sequential reads from the memmap
+        view = rng.integers(header['views'], size=len(idx)) if shuffle else np.zeros(len(idx), dtype=np.int64)
+        return features[view, idx].astype(np.float32), labels[idx]
+
+    ds = tf.data.Dataset.range(len(labels))
+    if shuffle:
+        ds = ds.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(lambda idx: tf.numpy_function(gather, [idx], (tf.float32, tf.int64)),
+                num_parallel_calls=tf.data.AUTOTUNE)
+
+    def set_shapes(x, y):
+        x.set_shape([None, header['dim']])
+        y.set_shape([None])
+        return x, tf.one_hot(y, num_classes) if one_hot else y
+
+    return ds.map(set_shapes).prefetch(tf.data.AUTOTUNE)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Low-rank adapter (LoRA) fine-tuning for ViT / DeiT.
+
+Full fine-tuning of deit-base trains all ~86M weights: AdamW keeps two fp32
+state tensors per weight (~650 MB) and every backward pass computes all the
+weight gradients. add_lora() freezes the model and wraps the attention
+(query/key/value/output) and MLP projections in LoRALinear, which adds
+(alpha / rank) * B @ A to the frozen weight, with A (rank x in) and B
+(out x rank) zero-initialised so training starts from the pretrained model.
+Only A, B and the classifier head are trained. merge_lora() folds B @ A back
+into the dense weights and restores plain nn.Linear modules, so inference
+runs the original architecture at the original speed.
+
+Module names cover Hugging Face ViT/DeiT (query, key, value, dense) and timm
+ViTs (qkv, proj, fc1, fc2). compare_finetuning() reports optimizer-state
+memory and step time of LoRA against full fine-tuning on synthetic batches.
+"""
+
+import copy
+import math
+import time
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+TARGETS = ('query', 'key', 'value', 'dense', 'qkv', 'proj', 'fc1', 'fc2')
+HEADS = ('classifier', 'distillation_classifier', 'head', 'head_dist')
+
+
+class LoRALinear(nn.Module):
+    def __init__(self, base, rank=8, alpha=16, dropout=0.0):
+        super().__init__()
+        self.base = base
+        self.scaling = alpha / rank
+        self.lora_a = nn.Parameter(base.weight.new_empty(rank, base.in_features))
+        self.lora_b = nn.Parameter(base.weight.new_zeros(base.out_features, rank))
+        nn.init.kaiming_uniform_(self.lora_a, a=math.sqrt(5))
+        self.dropout = nn.Dropout(dropout) if dropout else nn.Identity()
+
+    def forward(self, x):
+        return self.base(x) + F.linear(F.linear(self.dropout(x), self.lora_a), self.lora_b) * self.scaling
+
+    # The base Linear with the low-rank update added to its weight
+    @torch.no_grad()
+    def merged(self):
+        self.base.weight += (self.lora_b @ self.lora_a).to(self.base.weight.dtype) * self.scaling
+        return self.base
+
+
+def _is_head(name):
+    return name.split('.')[0] in HEADS
+
+
+# Wrap every nn.Linear called one of `targets` (outside the heads) in LoRALinear,
+# then train only the adapters and the head parameters. Modifies model in place.
+def add_lora(model, rank=8, alpha=16, dropout=0.0, targets=TARGETS):
+    wrapped = 0
+    for name, module in list(model.named_modules()):
+        if _is_head(name):
+            continue
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, nn.Linear) and child_name in targets:
+                setattr(module, child_name, LoRALinear(child, rank, alpha, dropout))
+                wrapped += 1
+    for name, param in model.named_parameters():
+        param.requires_grad = 'lora_' in name or _is_head(name)
+    trainable = sum(p.numel() for p in model.parameters() if p.requires_grad)
+    total = sum(p.numel() for p in model.parameters())
+    print(f"✅ LoRA rank {rank} on {wrapped} projections: training {trainable:,} of {total:,} "
+          f"parameters ({100 * trainable / total:.2f}%)")
+    return model
+
+
+# Replace every LoRALinear by its merged nn.Linear (for inference / export)
+def merge_lora(model):
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, LoRALinear):
+                setattr(module, child_name, child.merged())
+    for param in model.parameters():
+        param.requires_grad = True
+    return model
+
+
+def trainable_parameters(model):
+    return [p for p in model.parameters() if p.requires_grad]
+
+
+def optimizer_state_mb(optimizer):
+    return sum(t.numel() * t.element_size() for state in optimizer.state.values()
+               for t in state.values() if torch.is_tensor(t)) / 1024 ** 2
+
+
+# Optimizer-state MB, trainable parameters and seconds per training step of full
+# fine-tuning vs LoRA on synthetic batches. Each mode trains its own copy of model;
+# forward(model, images) -> logits (e.g. lambda m, x: m(x).logits for Hugging Face).
+def compare_finetuning(model, num_classes, forward=None, device='cpu', batch_size=8, image_size=224, steps=3,
+                       lr=1e-4, **lora_kwargs):
+    forward = forward or (lambda m, x: m(x))
+    device = torch.device(device)
+    images = torch.randn(batch_size, 3, image_size, image_size, device=device)
+    labels = torch.randint(0, num_classes, (batch_size,), device=device)
+    criterion = nn.CrossEntropyLoss()
+
+    results = {}
+    for mode in ('full', 'lora'):
+        candidate = copy.deepcopy(model).to(device).train()
+        if mode == 'lora':
+            add_lora(candidate, **lora_kwargs)
+        params = trainable_parameters(candidate)
+        optimizer = torch.optim.AdamW(params, lr=lr)
+        timings = []
+        for i in range(steps + 1):  # the first step is warm-up
+            start = time.perf_counter()
+            optimizer.zero_grad()
+            criterion(forward(candidate, images), labels).backward()
+            optimizer.step()
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            if i:
+                timings.append(time.perf_counter() - start)
+        results[mode] = {
+            'trainable_params': sum(p.numel() for p in params),
+            'optimizer_state_mb': optimizer_state_mb(optimizer),
+            'step_time_s': sum(timings) / len(timings),
+        }
+        del candidate, optimizer
+
+    print(f"Fine-tuning cost (batch {batch_size}, {image_size}x{image_size}, {device}):")
+    for mode, r in results.items():
+        print(f"  {mode:<5} {r['trainable_params']:>12,} params  {r['optimizer_state_mb']:8.1f} MB optimizer state  "
+              f"{r['step_time_s']:.3f} s/step")
+    full, lora = results['full'], results['lora']
+    print(f"  LoRA: {full['optimizer_state_mb'] / max(lora['optimizer_state_mb'], 1e-9):.0f}x less optimizer state, "
+          f"{full['step_time_s'] / lora['step_time_s']:.2f}x faster steps")
+    return results
+
+
+if __name__ == '__main__':
+    from transformers import DeiTForImageClassification
+
+    base = DeiTForImageClassification.from_pretrained("facebook/deit-base-distilled-patch16-224", num_labels=10)
+    compare_finetuning(base, 10, forward=lambda m, x: m(x).logits)
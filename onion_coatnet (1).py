@@ -25,92 +25,39 @@ GCS_URI = "gs://onion11"
 
 # STEP 4: Set up data directories and split into train/val/test
 import os
-import shutil
-import random
 import warnings
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tf_data import image_dataset
 
 # Base folder containing all .jpg and .txt files
 base_dir = 'OnionData'
 
-# Optional: parse class index to name mapping from classes.txt
-class_id_to_name = {}
-classes_txt_path = os.path.join(base_dir, 'classes.txt')
-if os.path.exists(classes_txt_path):
-    with open(classes_txt_path, 'r') as f:
-        for i, line in enumerate(f):
-            class_id_to_name[str(i)] = line.strip()
+# One scandir pass + threaded, cached parsing of the YOLO label files
+from onion_labels import index_onion_labels, load_class_names, group_by_class
 
-# Get all base names with both .jpg and .txt present
-jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.jpg')}
-txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.txt')}
+class_id_to_name = load_class_names(base_dir)  # Optional mapping from classes.txt
+index = index_onion_labels(base_dir)
+print(f"Found {len(index['images'])} valid image-label pairs.")
 
-paired = [base for base in jpgs if base in txts]
+# Group images by class
+class_to_images = group_by_class(index, class_id_to_name)
 
-print(f"Found {len(paired)} valid image-label pairs.")
+# Stable hash-based split; train/val/test are hardlinks, updated incrementally
+from data_splits import update_split_manifest, link_split_dirs, print_split_stats
 
-# Group images by class
-class_to_images = {}
-
-for base in paired:
-    txt_path = os.path.join(base_dir, txts[base])
-    try:
-        with open(txt_path, 'r') as f:
-            line = f.readline().strip()
-            if not line:
-                continue
-            class_id = line.split()[0]  # First token is class index
-            class_label = class_id_to_name.get(class_id, f"class_{class_id}")  # Optional mapping
-            if class_label not in class_to_images:
-                class_to_images[class_label] = []
-            class_to_images[class_label].append(jpgs[base])
-    except Exception as e:
-        print(f"Skipping {txt_path} due to error: {e}")
-
-# Prepare train, val, test directories
-for split in ['train', 'val', 'test']:
-    shutil.rmtree(split, ignore_errors=True)
-    for label in class_to_images.keys():
-        os.makedirs(os.path.join(split, label), exist_ok=True)
-
-# Split and copy images
-for label, images in class_to_images.items():
-    random.shuffle(images)
-    total = len(images)
-    train_n = int(0.8 * total)
-    val_n = int(0.1 * total)
-    test_n = total - train_n - val_n
-
-    for img in images[:train_n]:
-        shutil.copyfile(os.path.join(base_dir, img), os.path.join('train', label, img))
-    for img in images[train_n:train_n+val_n]:
-        shutil.copyfile(os.path.join(base_dir, img), os.path.join('val', label, img))
-    for img in images[train_n+val_n:]:
-        shutil.copyfile(os.path.join(base_dir, img), os.path.join('test', label, img))
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1))
+link_split_dirs(manifest)
 
 # Show final stats
-for split in ['train', 'val', 'test']:
-    print(f"\n{split.upper()}")
-    for label in sorted(class_to_images.keys()):
-        count = len(os.listdir(os.path.join(split, label)))
-        print(f"  {label}: {count} images")
+print_split_stats(manifest)
 
 # STEP 5: Data loading and augmentation
 IMG_SIZE = 224
 BATCH_SIZE = 32
 
-train_datagen = ImageDataGenerator(rescale=1./255)
-val_datagen = ImageDataGenerator(rescale=1./255)
-test_datagen = ImageDataGenerator(rescale=1./255)
-
-train_generator = train_datagen.flow_from_directory(
-    'train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-
-val_generator = val_datagen.flow_from_directory(
-    'val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-
-test_generator = test_datagen.flow_from_directory(
-    'test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
+# tf.data pipelines: parallel decode/resize, packed uint8 cache, prefetching
+train_generator = image_dataset('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, shuffle=True, cache='packed')
+val_generator = image_dataset('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed', classes=list(train_generator.class_indices))
+test_generator = image_dataset('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed', classes=list(train_generator.class_indices))
 
 print("Detected classes:", train_generator.class_indices)
 
@@ -145,6 +92,11 @@ model = build_coatnet(input_shape, num_classes)
 model.compile(optimizer=Adam(learning_rate=1e-4), loss='categorical_crossentropy', metrics=['accuracy'])
 model.summary()
 
+# Data echoing: if the pipeline is slower than a training step, each batch is
+# reused as flipped / shifted copies; the factor comes from timing both
+from tf_data import measure_echo_factor, echo_batches
+train_generator = echo_batches(train_generator, measure_echo_factor(train_generator, model))
+
 # STEP 7: Train model
 import time
 EPOCHS = 10
@@ -10,13 +10,10 @@ Original file is located at
 # -*- coding: utf-8 -*-
 import os
 import time
-import shutil
-import random
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import torchvision.transforms as transforms
-import torchvision.datasets as datasets
 from torch.utils.data import DataLoader, random_split
 from torchvision.models import convnext_tiny
 import matplotlib.pyplot as plt
@@ -25,77 +22,73 @@ import numpy as np
 from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, roc_curve, auc
 from sklearn.preprocessing import label_binarize
 
-# STEP 1: Authenticate with GCS
-from google.colab import files
-uploaded = files.upload()  # Upload your GCS JSON key file
-
-json_filename = list(uploaded.keys())[0]
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = json_filename
-print(f"Authenticated using: {json_filename}")
-
-# STEP 2: Download dataset from GCS
-GCS_URI = "gs://onion11"
-!mkdir -p OnionData
-!gsutil -m cp -r {GCS_URI}/* OnionData/
-
-# STEP 3: Organize data into train, val, test folders
-base_dir = 'OnionData'
-jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.jpg')}
-txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.txt')}
-paired = [base for base in jpgs if base in txts]
-
-class_id_to_name = {}
-class_txt = os.path.join(base_dir, 'classes.txt')
-if os.path.exists(class_txt):
-    with open(class_txt, 'r') as f:
-        for i, line in enumerate(f):
-            class_id_to_name[str(i)] = line.strip()
-
-class_to_images = {}
-for base in paired:
-    txt_path = os.path.join(base_dir, txts[base])
-    try:
-        with open(txt_path, 'r') as f:
-            line = f.readline().strip()
-            class_id = line.split()[0]
-            class_label = class_id_to_name.get(class_id, f"class_{class_id}")
-            class_to_images.setdefault(class_label, []).append(jpgs[base])
-    except:
-        continue
-
-for split in ['train', 'val', 'test']:
-    shutil.rmtree(split, ignore_errors=True)
-    for label in class_to_images:
-        os.makedirs(os.path.join(split, label), exist_ok=True)
-
-for label, images in class_to_images.items():
-    random.shuffle(images)
-    total = len(images)
-    train_n = int(0.8 * total)
-    val_n = int(0.1 * total)
-
-    for img in images[:train_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('train', label, img))
-    for img in images[train_n:train_n+val_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('val', label, img))
-    for img in images[train_n+val_n:]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('test', label, img))
+# `python ddp.py --nproc N onion_convnext.py` runs this script in N gloo DDP
+# ranks (one core block each); started directly it is a single process
+from ddp import init_distributed, is_main, wrap_model, shard_loader, set_epoch, finish
+rank, world_size = init_distributed()
 
-# STEP 4: Data Transform
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.RandomHorizontalFlip(),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+# STEPS 1-3 download and split the data; DDP ranks reuse the split manifest
+if world_size == 1:
+    # STEP 1: Authenticate with GCS
+    from google.colab import files
+    uploaded = files.upload()  # Upload your GCS JSON key file
+
+    json_filename = list(uploaded.keys())[0]
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = json_filename
+    print(f"Authenticated using: {json_filename}")
+
+    # STEP 2: Download dataset from GCS
+    GCS_URI = "gs://onion11"
+    !mkdir -p OnionData
+    !gsutil -m cp -r {GCS_URI}/* OnionData/
 
-train_dataset = datasets.ImageFolder('train', transform=transform)
-val_dataset = datasets.ImageFolder('val', transform=transform)
-test_dataset = datasets.ImageFolder('test', transform=transform)
+    # STEP 3: Split into train, val, test
+    # Split is a stable hash of each file name, recorded in a manifest and updated incrementally
+    from onion_labels import index_onion_labels, load_class_names, group_by_class
+    from data_splits import update_split_manifest
 
-train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
-test_loader = DataLoader(test_dataset, batch_size=32, shuffle=False)
+    base_dir = 'OnionData'
+    class_id_to_name = load_class_names(base_dir)
+    class_to_images = group_by_class(index_onion_labels(base_dir), class_id_to_name)
+
+    manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1))
+else:
+    from data_splits import load_split_manifest
+    manifest = load_split_manifest('split_manifest.csv')  # written by a single-process run
+
+# STEP 4: Data Transform
+# Workers only resize and return uint8 CHW tensors; flip + normalize run
+# batched on the device (random flip for training batches only)
+from torch_loaders import uint8_transform, BatchTransform
+transform = uint8_transform((224, 224))
+batch_transform = BatchTransform([0.485, 0.456, 0.406], [0.229, 0.224, 0.225], hflip=True)
+
+# Images are read straight from OnionData through the split manifest,
+# JPEGs decoded at reduced resolution before the 224x224 resize
+from data_splits import ManifestDataset
+train_dataset = ManifestDataset(manifest, 'train', transform=transform, target_size=(224, 224))
+val_dataset = ManifestDataset(manifest, 'val', transform=transform, target_size=(224, 224))
+test_dataset = ManifestDataset(manifest, 'test', transform=transform, target_size=(224, 224))
+
+# Workers / prefetch / pinning tuned for this machine (cached after the first run)
+from torch_loaders import tune_loader_settings, make_loader
+# (under DDP the ranks already use every core, so they load without workers)
+loader_settings = tune_loader_settings(train_dataset, batch_size=32) if world_size == 1 else {}
+
+train_loader = make_loader(train_dataset, batch_size=32, shuffle=True, settings=loader_settings)
+val_loader = shard_loader(val_dataset, batch_size=32, **loader_settings)
+test_loader = make_loader(test_dataset, batch_size=32, settings=loader_settings)
+
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs), the last one on all of it; accuracy comes with a
+# 95% confidence interval
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.5
+val_subset_loader = shard_loader(Subset(val_dataset, stratified_indices(val_dataset.targets, VAL_FRACTION)),
+                                 batch_size=32, **loader_settings)
+val_schedule = ValidationSchedule(val_loader, val_subset_loader, every=VAL_EVERY)
 
 num_classes = len(train_dataset.classes)
 print("Detected classes:", train_dataset.classes)
@@ -114,57 +107,109 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model = PlantDiseaseModel(num_classes).to(device)
 
 criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=0.001)
+# Fused (or foreach) optimizer update; COMPILE=True runs forward, loss, backward
+# and update as one torch.compile graph (eager fallback, graphs cached on disk)
+from train_step import TrainStep, auto_precision, fast_optimizer
+COMPILE = False
+LR = 0.001
+
+optimizer = fast_optimizer(optim.Adam, model.parameters(), lr=LR)
+
+# bf16 autocast where the hardware runs it natively (fp32 otherwise) and NHWC weights/batches,
+# which the convolution kernels prefer; `python train_step.py` compares the modes.
+# The weights go NHWC before DDP wraps them, so its gradient buckets match their layout
+model.to(memory_format=torch.channels_last)
+step = TrainStep(wrap_model(model), criterion, optimizer, device, precision=auto_precision(device),
+                 channels_last=True, compile=COMPILE)
 
 # STEP 6: Training Function
+# Progressive resizing: the first epochs train at 128 then 160 px (about 3x and
+# 2x cheaper per image) with a proportionally larger batch, the last at 224
+from progressive import ResolutionSchedule, resize_batch, save_curve, plot_curves
+PROGRESSIVE = False  # opt-in; the baseline trains every epoch at 224
+MODE = 'progressive' if PROGRESSIVE else 'fixed'  # separate checkpoints / curve per mode
+EPOCHS = 10
+schedule = ResolutionSchedule(EPOCHS, sizes=(128, 160, 224) if PROGRESSIVE else (224,))
+
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+
+# Model/optimizer/RNG/epoch state is written every epoch on a background thread
+# (atomic rename); a rerun after preemption resumes from the last finished epoch,
+# a rerun with a different config starts fresh
+from checkpoints import CheckpointManager
+ckpt = CheckpointManager(f"checkpoints/onion_convnext-{MODE}", keep_last=2, mode='min',
+                         config={'lr': LR, 'batch_size': 32, 'epochs': EPOCHS, 'sizes': schedule.sizes,
+                                 'val_every': VAL_EVERY, 'val_fraction': VAL_FRACTION})
+
 def train_model(model, train_loader, val_loader, criterion, optimizer, epochs=10):
     start = time.time()
-    train_acc, val_acc, train_loss, val_loss = [], [], [], []
-
-    for epoch in range(epochs):
+    train_acc, val_acc, train_loss, val_loss, wall_clock = [], [], [], [], []
+    metrics = ClassificationMetrics(num_classes, device)
+    start_epoch, extra = ckpt.resume(model, optimizer)
+    if extra:
+        train_acc, val_acc, train_loss, val_loss, wall_clock = extra['history']
+        start -= extra.get('training_time', 0.0)  # count the epochs before the resume
+
+    for epoch in range(start_epoch, epochs):
+        size = schedule.size(epoch)
+        if epoch == start_epoch or schedule.stage_changed(epoch):
+            batch_size = schedule.batch_size(epoch, 32)
+            train_loader = shard_loader(train_dataset, batch_size=batch_size, shuffle=True, **loader_settings)
+            print(f"Training at {size}x{size}, batch size {batch_size}")
+        set_epoch(train_loader, epoch)
+        epoch_start = time.time()
         model.train()
-        correct, total, loss_sum = 0, 0, 0
+        metrics.reset()
 
         for images, labels in train_loader:
-            images, labels = images.to(device), labels.to(device)
-            optimizer.zero_grad()
-            outputs = model(images)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-
-            loss_sum += loss.item()
-            _, preds = torch.max(outputs, 1)
-            total += labels.size(0)
-            correct += (preds == labels).sum().item()
-
-        train_acc.append(100 * correct / total)
-        train_loss.append(loss_sum / len(train_loader))
-
-        # Validation
-        model.eval()
-        correct, total, loss_sum = 0, 0, 0
-        with torch.no_grad():
-            for images, labels in val_loader:
-                images, labels = images.to(device), labels.to(device)
-                outputs = model(images)
-                loss = criterion(outputs, labels)
-                loss_sum += loss.item()
-                _, preds = torch.max(outputs, 1)
-                total += labels.size(0)
-                correct += (preds == labels).sum().item()
-
-        val_acc.append(100 * correct / total)
-        val_loss.append(loss_sum / len(val_loader))
-
-        print(f"Epoch {epoch+1}/{epochs}, Train Acc: {train_acc[-1]:.2f}%, Val Acc: {val_acc[-1]:.2f}%")
-
+            images = resize_batch(batch_transform(images.to(device), train=True), size)
+            images, labels = step.prepare(images), labels.to(device)
+            loss, outputs = step(images, labels)
+            metrics.update(outputs, labels, loss)
+
+        epoch_metrics = metrics.compute()
+        train_acc.append(100 * epoch_metrics['accuracy'])
+        train_loss.append(epoch_metrics['loss'])
+
+        # Validation (skipped or subsampled per val_schedule; NaN when skipped)
+        loader = val_schedule.loader(epoch, epochs)
+        if loader is not None:
+            model.eval()
+            metrics.reset()
+            with torch.no_grad():
+                for images, labels in loader:
+                    images, labels = step.prepare(batch_transform(images.to(device), train=False)), labels.to(device)
+                    outputs = step.evaluate(images)
+                    metrics.update(outputs, labels, criterion(outputs, labels))
+
+            epoch_metrics = metrics.compute()
+            val_acc.append(100 * epoch_metrics['accuracy'])
+            val_loss.append(epoch_metrics['loss'])
+            val_note = format_accuracy(epoch_metrics, val_schedule.is_full(loader))
+        else:
+            val_acc.append(float('nan'))
+            val_loss.append(float('nan'))
+            val_note = "skipped"
+
+        print(f"Epoch {epoch+1}/{epochs}, Train Acc: {train_acc[-1]:.2f}%, Val Acc: {val_note}")
+        wall_clock.append((wall_clock[-1] if wall_clock else 0.0) + time.time() - epoch_start)
+        ckpt.save(epoch + 1, model, optimizer, metric=val_loss[-1] if loader is not None else None,
+                  extra={'history': (train_acc, val_acc, train_loss, val_loss, wall_clock),
+                         'training_time': time.time() - start})
+
+    ckpt.wait()
     duration = time.time() - start
+    # Wall-clock-to-accuracy curve of this run, overlaid with the other mode's run
+    if is_main():
+        save_curve(f"curves/onion_convnext-{MODE}.json", wall_clock, val_acc)
+        plot_curves("curves/onion_convnext")
     return train_acc, val_acc, train_loss, val_loss, duration
 
 train_acc, val_acc, train_loss, val_loss, training_time = train_model(
-    model, train_loader, val_loader, criterion, optimizer, epochs=10
+    model, train_loader, val_loader, criterion, optimizer, epochs=EPOCHS
 )
+finish()  # DDP ranks other than 0 exit here; rank 0 evaluates alone
 
 # STEP 7: Plot Loss Curve
 plt.figure(figsize=(10,5))
@@ -178,16 +223,13 @@ plt.grid(True)
 plt.show()
 
 # STEP 8: Test Accuracy
-correct, total = 0, 0
+test_metrics = ClassificationMetrics(num_classes, device)
 model.eval()
 with torch.no_grad():
     for images, labels in test_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
-        _, preds = torch.max(outputs, 1)
-        total += labels.size(0)
-        correct += (preds == labels).sum().item()
-test_acc = 100 * correct / total
+        images, labels = step.prepare(batch_transform(images.to(device), train=False)), labels.to(device)
+        test_metrics.update(step.evaluate(images), labels)
+test_acc = 100 * test_metrics.compute()['accuracy']
 
 # STEP 9: Model Size & Summary
 model_size = sum(p.numel() for p in model.parameters()) * 4 / (1024**2)
@@ -202,8 +244,8 @@ print(f"Model Size: {model_size:.2f} MB")
 all_labels, all_preds, all_probs = [], [], []
 with torch.no_grad():
     for images, labels in test_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
+        images, labels = step.prepare(batch_transform(images.to(device), train=False)), labels.to(device)
+        outputs = step.evaluate(images)
         _, preds = torch.max(outputs, 1)
 
         all_labels.extend(labels.cpu().numpy())
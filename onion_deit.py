@@ -7,72 +7,43 @@ Original file is located at
     https://colab.research.google.com/drive/1mkMblnVm6F3EL61VpBWP5SXShzhigMOz
 """
 
-# STEP 1: Authenticate and download dataset from GCS
-from google.colab import files
-uploaded = files.upload()  # Upload your service account JSON key
-
-import os
-json_filename = list(uploaded.keys())[0]
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = json_filename
-
-GCS_URI = "gs://onion11"
-!mkdir -p OnionData
-!gsutil -m cp -r {GCS_URI}/* OnionData/
-
-import os, shutil, random
-
-base_dir = "OnionData"
-class_id_to_name = {}
-classes_txt_path = os.path.join(base_dir, 'classes.txt')
-
-# Load class ID to class name mapping
-if os.path.exists(classes_txt_path):
-    with open(classes_txt_path) as f:
-        for i, line in enumerate(f):
-            class_id_to_name[str(i)] = line.strip()
-
-# Match image and label files
-jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.jpg')}
-txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.txt')}
-paired = [base for base in jpgs if base in txts]
-
-# Create mapping from class to list of image filenames
-class_to_images = {}
-for base in paired:
-    txt_path = os.path.join(base_dir, txts[base])
-    with open(txt_path) as f:
-        line = f.readline().strip()
-        if not line:
-            continue  # Skip empty txt files
-        parts = line.split()
-        if len(parts) == 0:
-            continue  # Skip malformed txt files
-        class_id = parts[0]
-        label = class_id_to_name.get(class_id, f"class_{class_id}")
-        class_to_images.setdefault(label, []).append(jpgs[base])
-
-# Create folders for splits
-for split in ['train', 'val', 'test']:
-    for label in class_to_images:
-        os.makedirs(os.path.join(split, label), exist_ok=True)
-
-# Split data: 70% train, 15% val, 15% test
-for label, images in class_to_images.items():
-    random.shuffle(images)
-    n = len(images)
-    t, v = int(0.7 * n), int(0.15 * n)
-    for img in images[:t]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('train', label, img))
-    for img in images[t:t+v]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('val', label, img))
-    for img in images[t+v:]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('test', label, img))
-
-!pip install transformers timm torchmetrics seaborn
+# `python ddp.py --nproc N onion_deit.py` runs this script in N gloo DDP ranks
+# (one core block each); started directly it is a single process
+from ddp import init_distributed, wrap_model, shard_loader, set_epoch, finish
+rank, world_size = init_distributed()
+
+# Install packages, download and split the data; DDP ranks reuse the installed
+# packages and the split manifest (N ranks must not pip install concurrently)
+if world_size == 1:
+    # STEP 1: Authenticate and download dataset from GCS
+    from google.colab import files
+    uploaded = files.upload()  # Upload your service account JSON key
+
+    import os
+    json_filename = list(uploaded.keys())[0]
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = json_filename
+
+    GCS_URI = "gs://onion11"
+    !mkdir -p OnionData
+    !gsutil -m cp -r {GCS_URI}/* OnionData/
+
+    base_dir = "OnionData"
+    # Load class ID to class name mapping
+    from onion_labels import index_onion_labels, load_class_names, group_by_class
+    class_id_to_name = load_class_names(base_dir)
+
+    # Match image and label files, then map each class to its list of images
+    class_to_images = group_by_class(index_onion_labels(base_dir), class_id_to_name)
+
+    # Split data: 70% train, 15% val, 15% test
+    # Stable hash-based split, recorded in a manifest and updated incrementally
+    from data_splits import update_split_manifest
+    manifest = update_split_manifest(class_to_images, 'split_manifest_70_15.csv', ratios=(0.7, 0.15))
+
+    !pip install transformers timm torchmetrics seaborn
 
 import torch
 import torch.nn as nn
-from torchvision.datasets import ImageFolder
 from torchvision import transforms
 from torch.utils.data import DataLoader
 from transformers import DeiTForImageClassification
@@ -99,82 +70,201 @@ val_test_transform = transforms.Compose([
                          [0.229, 0.224, 0.225])
 ])
 
-train_ds = ImageFolder("train", transform=train_transform)
-val_ds = ImageFolder("val", transform=val_test_transform)
-test_ds = ImageFolder("test", transform=val_test_transform)
-
-train_loader = DataLoader(train_ds, batch_size=16, shuffle=True)
-val_loader = DataLoader(val_ds, batch_size=32)
+# Images are read straight from OnionData through the split manifest
+from data_splits import load_split_manifest, ManifestDataset
+if world_size > 1:
+    manifest = load_split_manifest('split_manifest_70_15.csv')  # written by a single-process run
+train_ds = ManifestDataset(manifest, "train", transform=train_transform)
+# Val/test only resize, so decode their JPEGs at reduced resolution
+# (train keeps full-resolution decoding for RandomResizedCrop)
+val_ds = ManifestDataset(manifest, "val", transform=val_test_transform, target_size=(224, 224))
+test_ds = ManifestDataset(manifest, "test", transform=val_test_transform, target_size=(224, 224))
+
+# Each loader batch is one optimizer update (the effective batch); TrainStep
+# splits it into micro-batches that fit MEMORY_BUDGET_MB of activations
+EFFECTIVE_BATCH = 16  # the original batch; larger values scale the lr below
+MEMORY_BUDGET_MB = 2048
+# Under DDP each rank loads its shard of every batch (batch sizes are global)
+train_loader = shard_loader(train_ds, batch_size=EFFECTIVE_BATCH, shuffle=True)
+val_loader = shard_loader(val_ds, batch_size=32)
 test_loader = DataLoader(test_ds, batch_size=32)
 
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs); the last epoch, and an epoch that triggers early
+# stopping, also report all of it. Early stopping and best.pt always compare
+# the subsample, so every epoch is judged on the same images. Accuracy comes
+# with a 95% confidence interval.
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.5
+val_subset_loader = shard_loader(Subset(val_ds, stratified_indices(val_ds.targets, VAL_FRACTION)), batch_size=32)
+val_schedule = ValidationSchedule(val_loader, val_subset_loader, every=VAL_EVERY)
+
 # Load DeiT model
 model = DeiTForImageClassification.from_pretrained(
     "facebook/deit-base-distilled-patch16-224",
     num_labels=len(train_ds.classes)
 )
 model.classifier.dropout = nn.Dropout(0.3)  # Add dropout
+
+# LoRA: train low-rank adapters on the attention / MLP projections plus the
+# classifier instead of all ~86M weights (far less optimizer state, cheaper
+# backward); the adapters are merged into the dense weights after training
+# (`python lora.py` compares LoRA and full fine-tuning memory / step time)
+from lora import add_lora, merge_lora, trainable_parameters
+LORA = False  # opt-in; the baseline fine-tunes all weights at the tuned lr
+if LORA:
+    add_lora(model, rank=8, alpha=16)
 model.to(device)
+ddp_model = wrap_model(model)
 
 criterion = nn.CrossEntropyLoss()
-optimizer = torch.optim.AdamW(model.parameters(), lr=1e-5)
+# Fused (or foreach) optimizer update; COMPILE=True runs forward, loss, backward
+# and update as one torch.compile graph (eager fallback, graphs cached on disk)
+from train_step import TrainStep, auto_precision, fast_optimizer, plan_micro_batch, scale_lr
+COMPILE = False
+
+# lr=1e-5 was tuned at batch 16 (adapters starting from zero need a larger
+# one); AdamW gets sqrt scaling to the effective batch
+optimizer = fast_optimizer(torch.optim.AdamW, trainable_parameters(model), lr=5e-4 if LORA else 1e-5)
+scale_lr(optimizer, EFFECTIVE_BATCH, base_batch=16, rule='sqrt')
+
+# bf16 autocast on CPUs / GPUs with native bf16 (fp32 otherwise); channels_last brings
+# nothing for DeiT's attention blocks (`python train_step.py` compares the modes)
+precision = auto_precision(device)
+# interpolate_pos_encoding resamples the position embeddings to the patch grid
+# of the smaller images used by progressive resizing below
+forward = lambda x: ddp_model(x, interpolate_pos_encoding=True).logits
+
+# Activation checkpointing: every k-th DeiT block keeps only its input and
+# recomputes the rest in backward. 'auto' picks the least checkpointing that
+# fits a CHECKPOINT_BATCH micro-batch into MEMORY_BUDGET_MB; the accumulation
+# plan then uses the checkpointed per-sample size
+# (`python activation_checkpoint.py` prints the peak-RSS / step-time trade-off)
+from activation_checkpoint import profile_blocks, choose_checkpointing, estimate_activation_mb, set_checkpointing
+CHECKPOINT_EVERY = 'auto'  # None, k or 'auto'
+CHECKPOINT_BATCH = 32
+model.train()
+profile = profile_blocks(model, lambda m, x: m(x).logits, device, precision)
+if CHECKPOINT_EVERY == 'auto':
+    CHECKPOINT_EVERY = choose_checkpointing(profile, CHECKPOINT_BATCH, MEMORY_BUDGET_MB)
+set_checkpointing(model, CHECKPOINT_EVERY)
+micro_batch = plan_micro_batch(EFFECTIVE_BATCH // world_size, estimate_activation_mb(profile, CHECKPOINT_EVERY),
+                               MEMORY_BUDGET_MB)
+step = TrainStep(ddp_model, criterion, optimizer, device, precision=precision, channels_last=False,
+                 forward=forward, compile=COMPILE, micro_batch_size=micro_batch)
 
 epochs = 10
 patience = 5
+
+# Progressive resizing: the first epochs train at 128 then 160 px (about 3x and
+# 2x cheaper per image), the last at 224. The effective batch (and so the lr)
+# stays fixed; the memory-bound micro-batch grows as the images shrink.
+from progressive import ResolutionSchedule, resize_batch, save_curve, plot_curves
+PROGRESSIVE = False  # opt-in; the baseline trains every epoch at 224
+MODE = 'progressive' if PROGRESSIVE else 'fixed'  # separate checkpoints / curve per mode
+schedule = ResolutionSchedule(epochs, sizes=(128, 160, 224) if PROGRESSIVE else (224,))
 best_val_loss = float("inf")
 trigger_times = 0
 
-train_accs, val_accs, train_losses, val_losses = [], [], [], []
+train_accs, val_accs, train_losses, val_losses, wall_clock = [], [], [], [], []
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+metrics = ClassificationMetrics(len(train_ds.classes), device)
+
+# Model/optimizer/RNG/epoch state is written every epoch on a background thread
+# (atomic rename); a rerun after preemption resumes from the last finished epoch,
+# a rerun with a different config starts fresh
+from checkpoints import CheckpointManager
+ckpt = CheckpointManager(f"checkpoints/onion_deit{'-lora' if LORA else ''}-{MODE}", keep_last=2, mode='min',
+                         config={'lr': optimizer.param_groups[0]['lr'], 'effective_batch': EFFECTIVE_BATCH,
+                                 'epochs': epochs, 'patience': patience, 'sizes': schedule.sizes,
+                                 'val_fraction': VAL_FRACTION})  # best / patience are measured on this sample
+start_epoch, extra = ckpt.resume(model, optimizer)
 start_time = time.time()
+if extra:
+    train_accs, val_accs, train_losses, val_losses, wall_clock = extra['history']
+    best_val_loss, trigger_times = extra['best_val_loss'], extra['trigger_times']
+    start_time -= extra.get('training_time', 0.0)  # count the epochs before the resume
 
-for epoch in range(epochs):
+def validate(loader):
+    model.eval()
+    metrics.reset()
+    with torch.no_grad():
+        for imgs, lbls in loader:
+            imgs, lbls = step.prepare(imgs), lbls.to(device)
+            outputs = step.evaluate(imgs)
+            metrics.update(outputs, lbls, criterion(outputs, lbls))
+    return metrics.compute()
+
+for epoch in range(start_epoch, epochs):
+    if trigger_times >= patience:
+        break  # the resumed run had already stopped early
+    size = schedule.size(epoch)
+    step.micro_batch_size = min(EFFECTIVE_BATCH // world_size, schedule.batch_size(epoch, micro_batch))
+    if epoch == start_epoch or schedule.stage_changed(epoch):
+        print(f"Training at {size}x{size}, micro-batch {step.micro_batch_size}")
+    set_epoch(train_loader, epoch)
+    epoch_start = time.time()
     model.train()
-    total_train_loss, correct_train = 0, 0
+    metrics.reset()
     for imgs, lbls in train_loader:
-        imgs, lbls = imgs.to(device), lbls.to(device)
-        optimizer.zero_grad()
-        outputs = model(imgs).logits
-        loss = criterion(outputs, lbls)
-        loss.backward()
-        optimizer.step()
-        total_train_loss += loss.item() * imgs.size(0)
-        correct_train += (outputs.argmax(1) == lbls).sum().item()
-
-    train_acc = correct_train / len(train_ds)
-    train_loss = total_train_loss / len(train_ds)
+        imgs, lbls = step.prepare(resize_batch(imgs.to(device), size)), lbls.to(device)
+        loss, outputs = step(imgs, lbls)
+        metrics.update(outputs, lbls, loss)
+
+    epoch_metrics = metrics.compute()
+    train_acc = epoch_metrics['accuracy']
+    train_loss = epoch_metrics['loss']
     train_accs.append(train_acc)
     train_losses.append(train_loss)
 
-    # Validation
-    model.eval()
-    total_val_loss, correct_val = 0, 0
-    with torch.no_grad():
-        for imgs, lbls in val_loader:
-            imgs, lbls = imgs.to(device), lbls.to(device)
-            outputs = model(imgs).logits
-            loss = criterion(outputs, lbls)
-            total_val_loss += loss.item() * imgs.size(0)
-            correct_val += (outputs.argmax(1) == lbls).sum().item()
-
-    val_acc = correct_val / len(val_ds)
-    val_loss = total_val_loss / len(val_ds)
+    # Validation (skipped or subsampled per val_schedule; NaN when skipped)
+    loader = val_schedule.loader(epoch, epochs)
+    if loader is not None:
+        stop_metrics = validate(val_subset_loader)
+        stop_loss = stop_metrics['loss']
+        # Early stopping (best.pt is kept by the checkpoint manager)
+        if stop_loss < best_val_loss:
+            best_val_loss = stop_loss
+            trigger_times = 0
+        else:
+            trigger_times += 1
+        if trigger_times >= patience:
+            # Stopping here: report the full split, not the subsample
+            loader = val_schedule.loader(epoch, epochs, final=True)
+        full = val_schedule.is_full(loader)
+        epoch_metrics = validate(loader) if full else stop_metrics
+        val_acc, val_loss = epoch_metrics['accuracy'], epoch_metrics['loss']
+        val_note = format_accuracy(epoch_metrics, full)
+    else:
+        val_acc = val_loss = float('nan')
+        val_note = "skipped"
     val_accs.append(val_acc)
     val_losses.append(val_loss)
 
-    print(f"Epoch {epoch+1}: Train Acc={train_acc:.4f}, Val Acc={val_acc:.4f}, Train Loss={train_loss:.4f}, Val Loss={val_loss:.4f}")
+    print(f"Epoch {epoch+1}: Train Acc={train_acc:.4f}, Val Acc={val_note}, Train Loss={train_loss:.4f}, Val Loss={val_loss:.4f}")
 
-    # Early stopping
-    if val_loss < best_val_loss:
-        best_val_loss = val_loss
-        trigger_times = 0
-        torch.save(model.state_dict(), "best_model.pt")
-    else:
-        trigger_times += 1
-        if trigger_times >= patience:
-            print("Early stopping!")
-            break
+    wall_clock.append((wall_clock[-1] if wall_clock else 0.0) + time.time() - epoch_start)
+    ckpt.save(epoch + 1, model, optimizer, metric=stop_loss if loader is not None else None,
+              extra={'history': (train_accs, val_accs, train_losses, val_losses, wall_clock),
+                     'best_val_loss': best_val_loss, 'trigger_times': trigger_times,
+                     'training_time': time.time() - start_time})
+    if trigger_times >= patience:
+        print("Early stopping!")
+        break
 
+finish()  # DDP ranks other than 0 exit here; rank 0 evaluates alone
 training_time = time.time() - start_time
-model.load_state_dict(torch.load("best_model.pt"))
+ckpt.load_best(model)
+if LORA:
+    merge_lora(model)  # plain dense DeiT for evaluation / export
+    step.forward = lambda x: model(x).logits
+
+# Wall-clock-to-accuracy curve of this run, overlaid with the other mode's run
+save_curve(f"curves/onion_deit-{MODE}.json", wall_clock, val_accs)
+plot_curves("curves/onion_deit")
 
 from sklearn.metrics import classification_report, confusion_matrix, roc_auc_score, roc_curve, auc
 from sklearn.preprocessing import label_binarize
@@ -186,8 +276,8 @@ y_true, y_probs = [], []
 
 with torch.no_grad():
     for imgs, lbls in test_loader:
-        imgs = imgs.to(device)
-        outputs = model(imgs).logits
+        imgs = step.prepare(imgs)
+        outputs = step.evaluate(imgs)
         y_probs.append(outputs.cpu())
         y_true.append(lbls)
 
@@ -23,63 +23,30 @@ GCS_URI = "gs://onion11"
 !gsutil -m cp -r {GCS_URI}/* OnionData/
 
 # STEP 4: Prepare dataset
-import shutil
-import random
+from onion_labels import index_onion_labels, load_class_names, group_by_class
 
 base_dir = 'OnionData'
-class_id_to_name = {}
-classes_txt_path = os.path.join(base_dir, 'classes.txt')
-
-if os.path.exists(classes_txt_path):
-    with open(classes_txt_path, 'r') as f:
-        for i, line in enumerate(f):
-            class_id_to_name[str(i)] = line.strip()
-
-jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.jpg')}
-txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.txt')}
-paired = [base for base in jpgs if base in txts]
-
-class_to_images = {}
-for base in paired:
-    with open(os.path.join(base_dir, txts[base]), 'r') as f:
-        line = f.readline().strip()
-        if line:
-            class_id = line.split()[0]
-            label = class_id_to_name.get(class_id, f"class_{class_id}")
-            class_to_images.setdefault(label, []).append(jpgs[base])
-
-for split in ['train', 'val', 'test']:
-    shutil.rmtree(split, ignore_errors=True)
-    for label in class_to_images:
-        os.makedirs(os.path.join(split, label), exist_ok=True)
-
-for label, images in class_to_images.items():
-    random.shuffle(images)
-    n = len(images)
-    train_n, val_n = int(0.8*n), int(0.1*n)
-    for img in images[:train_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('train', label, img))
-    for img in images[train_n:train_n+val_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('val', label, img))
-    for img in images[train_n+val_n:]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('test', label, img))
+class_id_to_name = load_class_names(base_dir)
+class_to_images = group_by_class(index_onion_labels(base_dir), class_id_to_name)
+
+# Record the split in a manifest instead of copying files
+from data_splits import update_split_manifest
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1))
 
 # STEP 5: Data loading
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tf_data import image_dataset
 
 IMG_SIZE = 224
 BATCH_SIZE = 32
 
-train_gen = ImageDataGenerator(rescale=1./255)
-val_gen = ImageDataGenerator(rescale=1./255)
-test_gen = ImageDataGenerator(rescale=1./255)
-
-train_loader = train_gen.flow_from_directory('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-val_loader = val_gen.flow_from_directory('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-test_loader = test_gen.flow_from_directory('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
+# tf.data pipelines: parallel decode/resize, packed uint8 cache, prefetching. Training
+# only sees cached features, so the train images are read once, unshuffled
+train_images = image_dataset(manifest, 'train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
+val_loader = image_dataset(manifest, 'val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
+test_loader = image_dataset(manifest, 'test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
 
-print("Detected classes:", train_loader.class_indices)
+print("Detected classes:", train_images.class_indices)
 
 # STEP 6: DenseNet121 model
 from tensorflow.keras.applications import DenseNet121
@@ -91,7 +58,7 @@ x = base_model.output
 x = GlobalAveragePooling2D()(x)
 x = Dense(512, activation='relu')(x)
 x = Dropout(0.5)(x)
-predictions = Dense(len(train_loader.class_indices), activation='softmax')(x)
+predictions = Dense(len(train_images.class_indices), activation='softmax')(x)
 model = Model(inputs=base_model.input, outputs=predictions)
 
 for layer in base_model.layers:
@@ -100,18 +67,35 @@ for layer in base_model.layers:
 model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
 model.summary()
 
+# Frozen base: compute its pooled features once per split, then train only the
+# Dense(512)/Dropout/softmax head on the cached features
+from keras_features import split_frozen_model, cache_keras_features, feature_dataset, assemble_model
+
+extractor, head = split_frozen_model(model)
+for split, images in (('train', train_images), ('val', val_loader), ('test', test_loader)):
+    cache_keras_features(extractor, images, f'features/densenet121_{split}', key='densenet121-imagenet')
+
+train_features = feature_dataset('features/densenet121_train', len(train_images.class_indices), batch_size=BATCH_SIZE, shuffle=True)
+val_features = feature_dataset('features/densenet121_val', len(train_images.class_indices), batch_size=BATCH_SIZE)
+test_features = feature_dataset('features/densenet121_test', len(train_images.class_indices), batch_size=BATCH_SIZE)
+head.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
 # STEP 7: Train the model
 import time
 EPOCHS = 10
 start_time = time.time()
 
-history = model.fit(train_loader, validation_data=val_loader, epochs=EPOCHS)
+history = head.fit(train_features, validation_data=val_features, epochs=EPOCHS)
 training_time = time.time() - start_time
 
+# Full image -> probabilities model (trained head on the frozen base) for export
+model = assemble_model(extractor, head)
+model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
 # STEP 8: Evaluate model
 import matplotlib.pyplot as plt
 
-test_loss, test_accuracy = model.evaluate(test_loader)
+test_loss, test_accuracy = head.evaluate(test_features)
 
 plt.plot(history.history["accuracy"], label="Train Accuracy")
 plt.plot(history.history["val_accuracy"], label="Validation Accuracy")
@@ -128,7 +112,7 @@ from sklearn.metrics import classification_report, confusion_matrix, roc_auc_sco
 from sklearn.preprocessing import label_binarize
 import seaborn as sns
 
-y_pred = model.predict(test_loader)
+y_pred = head.predict(test_features)
 y_pred_classes = np.argmax(y_pred, axis=1)
 y_true = test_loader.classes
 class_labels = list(test_loader.class_indices.keys())
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Cached YOLO label index for the OnionData bucket.
+
+One os.scandir pass pairs every .jpg with its .txt, label files are parsed
+in a thread pool, and the result is stored as columnar arrays in an .npz
+keyed by each label file's mtime/size so reruns only re-parse what changed.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+INDEX_FILE = '.label_index.npz'
+
+
+def load_class_names(base_dir):
+    class_map = {}
+    txt_path = os.path.join(base_dir, 'classes.txt')
+    if os.path.exists(txt_path):
+        with open(txt_path, 'r') as f:
+            for i, line in enumerate(f):
+                class_map[str(i)] = line.strip()
+    return class_map
+
+
+# Returns (class_id, boxes) where boxes is a (k, 5) array of "cls cx cy w h" rows.
+# class_id is -1 for empty or malformed files, matching the old "skip" behaviour.
+def parse_label_file(txt_path):
+    try:
+        with open(txt_path, 'r') as f:
+            lines = f.read().splitlines()
+    except OSError as e:
+        print(f"❌ Error processing {txt_path}: {e}")
+        return -1, np.zeros((0, 5), dtype=np.float32)
+
+    first = lines[0].split() if lines else []
+    try:
+        class_id = int(float(first[0])) if first else -1
+    except ValueError:
+        class_id = -1
+
+    rows = []
+    for line in lines:
+        tokens = line.split()
+        if len(tokens) < 5:
+            continue
+        try:
+            rows.append([float(t) for t in tokens[:5]])
+        except ValueError:
+            continue
+    return class_id, np.asarray(rows, dtype=np.float32).reshape(-1, 5)
+
+
+def _scan_pairs(base_dir):
+    jpgs, txts = {}, {}
+    with os.scandir(base_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            if ext == '.jpg':
+                jpgs[stem] = entry.name
+            elif ext == '.txt' and entry.name != 'classes.txt':
+                st = entry.stat()
+                txts[stem] = (entry.name, st.st_mtime_ns, st.st_size)
+    return [(stem, jpgs[stem]) + txts[stem] for stem in sorted(jpgs) if stem in txts]
+
+
+def _load_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return {}
+    try:
+        # Every NpzFile[...] lookup re-reads the whole array, so read each once
+        with np.load(cache_path, allow_pickle=False) as data:
+            label_files, mtimes, sizes = data['label_files'], data['mtime_ns'], data['size']
+            class_ids, offsets, boxes = data['class_ids'], data['box_offsets'], data['boxes']
+        cached = {}
+        for i, label_file in enumerate(label_files.tolist()):
+            key = (label_file, int(mtimes[i]), int(sizes[i]))
+            cached[key] = (int(class_ids[i]), boxes[offsets[i]:offsets[i + 1]])
+        return cached
+    except (OSError, KeyError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable label index {cache_path}: {e}")
+        return {}
+
+
+def _save_cache(cache_path, pairs, results):
+    boxes = [b for _, b in results]
+    offsets = np.zeros(len(boxes) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in boxes])
+    tmp_path = cache_path + '.tmp.npz'
+    np.savez(
+        tmp_path,
+        images=np.array([p[1] for p in pairs], dtype=str),
+        label_files=np.array([p[2] for p in pairs], dtype=str),
+        mtime_ns=np.array([p[3] for p in pairs], dtype=np.int64),
+        size=np.array([p[4] for p in pairs], dtype=np.int64),
+        class_ids=np.array([c for c, _ in results], dtype=np.int32),
+        box_offsets=offsets,
+        boxes=np.concatenate(boxes) if boxes else np.zeros((0, 5), dtype=np.float32),
+    )
+    os.replace(tmp_path, cache_path)
+
+
+# Build (or refresh) the label index for base_dir.
+# Returns a dict of columns: images, class_ids, box_offsets, boxes.
+def index_onion_labels(base_dir='OnionData', cache_path=None, max_workers=16):
+    cache_path = cache_path or os.path.join(base_dir, INDEX_FILE)
+    pairs = _scan_pairs(base_dir)
+    cached = _load_cache(cache_path)
+
+    results = [cached.get(p[2:]) for p in pairs]
+    stale = [i for i, r in enumerate(results) if r is None]
+    if stale:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            parsed = pool.map(parse_label_file, [os.path.join(base_dir, pairs[i][2]) for i in stale])
+            for i, r in zip(stale, parsed):
+                results[i] = r
+        _save_cache(cache_path, pairs, results)
+    print(f"Indexed {len(pairs)} image-label pairs ({len(stale)} parsed, {len(pairs) - len(stale)} cached).")
+
+    offsets = np.zeros(len(results) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for _, b in results])
+    return {
+        'images': [os.path.join(base_dir, p[1]) for p in pairs],
+        'class_ids': np.array([c for c, _ in results], dtype=np.int32),
+        'box_offsets': offsets,
+        'boxes': np.concatenate([b for _, b in results]) if results else np.zeros((0, 5), dtype=np.float32),
+    }
+
+
+# Same {label: [image paths]} grouping the prep scripts build by hand
+def group_by_class(index, class_map):
+    class_to_images = {}
+    for path, class_id in zip(index['images'], index['class_ids']):
+        if class_id < 0:
+            continue  # Skip empty or malformed label files
+        label = class_map.get(str(class_id), f"class_{class_id}")
+        class_to_images.setdefault(label, []).append(path)
+    return class_to_images
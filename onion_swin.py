@@ -25,63 +25,21 @@ GCS_PATH = "gs://onion11"
 !mkdir -p OnionData
 !gsutil -m cp -r "$GCS_PATH"/* OnionData/
 
-# Step 3: Organize dataset into train/val/test (similar to CoatNet code)
-import shutil, random
+# Step 3: Build a train/val/test split manifest (similar to CoatNet code)
+from data_splits import update_split_manifest, print_split_stats, ManifestDataset
+from onion_labels import index_onion_labels, load_class_names, group_by_class
 
 def prepare_onion_dataset(base_dir='OnionData'):
-    from collections import defaultdict
-    import os, shutil, random
-
-    class_map = {}
-    txt_path = os.path.join(base_dir, "classes.txt")
-    if os.path.exists(txt_path):
-        with open(txt_path, 'r') as f:
-            for i, line in enumerate(f):
-                class_map[str(i)] = line.strip()
-
-    jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith(".jpg")}
-    txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith(".txt")}
-    paired = [k for k in jpgs if k in txts]
-
-    class_to_images = defaultdict(list)
-    for k in paired:
-        txt_file_path = os.path.join(base_dir, txts[k])
-        try:
-            with open(txt_file_path, 'r') as f:
-                line = f.readline().strip()
-                if not line:
-                    print(f"⚠️ Skipping empty label file: {txt_file_path}")
-                    continue
-                tokens = line.split()
-                if len(tokens) == 0:
-                    print(f"⚠️ No tokens in line: {txt_file_path}")
-                    continue
-                cls_id = tokens[0]
-                label = class_map.get(cls_id, f"class_{cls_id}")
-                class_to_images[label].append(jpgs[k])
-        except Exception as e:
-            print(f"❌ Error processing {txt_file_path}: {e}")
-
-    # Create train/val/test directories
-    for split in ['train', 'val', 'test']:
-        for cls in class_to_images:
-            os.makedirs(os.path.join(split, cls), exist_ok=True)
-
-    # Copy files into respective folders
-    for cls, files in class_to_images.items():
-        random.shuffle(files)
-        n = len(files)
-        n_train, n_val = int(0.8 * n), int(0.1 * n)
-        for i, f in enumerate(files):
-            if i < n_train:
-                dest = 'train'
-            elif i < n_train + n_val:
-                dest = 'val'
-            else:
-                dest = 'test'
-            shutil.copyfile(os.path.join(base_dir, f), os.path.join(dest, cls, f))
-
-prepare_onion_dataset()
+    # One scandir pass + threaded, cached parsing of the YOLO label files
+    index = index_onion_labels(base_dir)
+    class_to_images = group_by_class(index, load_class_names(base_dir))
+
+    # Record the split instead of copying files into train/val/test folders
+    manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1))
+    return manifest
+
+manifest = prepare_onion_dataset()
+print_split_stats(manifest)
 
 # Step 4: PyTorch imports
 import torch
@@ -101,20 +59,23 @@ device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 print(f"Using device: {device}")
 
 # Step 5: Data Augmentation
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.RandomHorizontalFlip(),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+# Workers only resize and return uint8 CHW tensors; flip + normalize run
+# batched on the device (random flip for training batches only)
+from torch_loaders import uint8_transform, BatchTransform
+transform = uint8_transform((224, 224))
+batch_transform = BatchTransform(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225], hflip=True)
+
+train_data = ManifestDataset(manifest, "train", transform=transform, target_size=(224, 224))
+val_data = ManifestDataset(manifest, "val", transform=transform, target_size=(224, 224))
+test_data = ManifestDataset(manifest, "test", transform=transform, target_size=(224, 224))
 
-train_data = datasets.ImageFolder("train", transform=transform)
-val_data = datasets.ImageFolder("val", transform=transform)
-test_data = datasets.ImageFolder("test", transform=transform)
+# Workers / prefetch / pinning tuned for this machine (cached after the first run)
+from torch_loaders import tune_loader_settings, make_loader
+loader_settings = tune_loader_settings(train_data, batch_size=32)
 
-train_loader = DataLoader(train_data, batch_size=32, shuffle=True)
-val_loader = DataLoader(val_data, batch_size=32, shuffle=False)
-test_loader = DataLoader(test_data, batch_size=32, shuffle=False)
+train_loader = make_loader(train_data, batch_size=32, shuffle=True, settings=loader_settings)
+val_loader = make_loader(val_data, batch_size=32, settings=loader_settings)
+test_loader = make_loader(test_data, batch_size=32, settings=loader_settings)
 
 class_names = train_data.classes
 num_classes = len(class_names)
@@ -132,26 +93,112 @@ model = create_model(
 
 model.to(device)
 
+# FULL_FINETUNE trains the whole backbone on images instead of a probe on
+# cached features, with activation checkpointing of the Swin blocks
+FULL_FINETUNE = False
+
 # ✅ Freeze all layers except classification head
-for param in model.parameters():
-    param.requires_grad = False
-for param in model.head.parameters():
-    param.requires_grad = True
+if not FULL_FINETUNE:
+    for param in model.parameters():
+        param.requires_grad = False
+    for param in model.head.parameters():
+        param.requires_grad = True
+
+# Linear probe: only the head trains, so run the frozen backbone once per image
+# and augmentation view and train the head on the cached float16 features
+# instead of re-running Swin every epoch. Two views (as-is and flipped) cover
+# the flip augmentation; pass augment= to augment_views for richer random views.
+LINEAR_PROBE = not FULL_FINETUNE
+PROBE_VIEWS = 2
+PROBE_BUDGET_MB = 1024  # upper bound on the training feature store
+
+if LINEAR_PROBE:
+    from feature_cache import cache_features, feature_loader, augment_views
+    probe_views = augment_views(batch_transform)
+    for split, data, views in (("train", train_data, PROBE_VIEWS), ("val", val_data, 1), ("test", test_data, 1)):
+        cache_features(model, data, f"features/swin_{split}", probe_views, views=views, device=device,
+                       loader_settings=loader_settings, storage_budget_mb=PROBE_BUDGET_MB)
+    train_loader = feature_loader("features/swin_train", batch_size=32, shuffle=True)
+    val_loader = feature_loader("features/swin_val", batch_size=32)
+    test_loader = feature_loader("features/swin_test", batch_size=32)
+    net = model.get_classifier()  # head's Linear layer, applied to pooled features
+    prepare = lambda images, train: images.to(device, non_blocking=True)
+else:
+    net = model
+    prepare = lambda images, train: batch_transform(images.to(device, non_blocking=True), train=train)
+
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs), the last one on all of it; accuracy comes with a
+# 95% confidence interval
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.5
+val_indices = stratified_indices(val_data.targets, VAL_FRACTION)
+if LINEAR_PROBE:
+    val_subset_loader = feature_loader("features/swin_val", batch_size=32, indices=val_indices)
+else:
+    val_subset_loader = make_loader(Subset(val_data, val_indices), batch_size=32, settings=loader_settings)
+val_schedule = ValidationSchedule(val_loader, val_subset_loader, every=VAL_EVERY)
+
+if FULL_FINETUNE:
+    # Every k-th Swin block keeps only its input and recomputes the rest in
+    # backward; 'auto' picks the least checkpointing that fits a batch of 32
+    # into MEMORY_BUDGET_MB (`python activation_checkpoint.py` prints the
+    # peak-RSS / step-time trade-off)
+    from activation_checkpoint import profile_blocks, choose_checkpointing, set_checkpointing
+    from train_step import auto_precision
+    CHECKPOINT_EVERY = 'auto'  # None, k or 'auto'
+    MEMORY_BUDGET_MB = 2048
+    model.train()
+    if CHECKPOINT_EVERY == 'auto':
+        profile = profile_blocks(model, lambda m, x: m(x), device, auto_precision(device))
+        CHECKPOINT_EVERY = choose_checkpointing(profile, 32, MEMORY_BUDGET_MB)
+    set_checkpointing(model, CHECKPOINT_EVERY)
 
 criterion = nn.CrossEntropyLoss()
-optimizer = optim.AdamW(model.parameters(), lr=1e-4)
+# Fused (or foreach) optimizer update; COMPILE=True runs forward, loss, backward
+# and update as one torch.compile graph (eager fallback, graphs cached on disk)
+from train_step import TrainStep, auto_precision, fast_optimizer
+COMPILE = False
+
+optimizer = fast_optimizer(optim.AdamW, net.parameters(), lr=1e-4)
 scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', patience=3)
 
+# bf16 autocast on CPUs / GPUs with native bf16 (fp32 otherwise); channels_last brings
+# nothing for Swin's attention blocks (`python train_step.py` compares the modes)
+step = TrainStep(net, criterion, optimizer, device, precision=auto_precision(device),
+                 channels_last=False, compile=COMPILE)
+
 # Step 7: Train
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+metrics = ClassificationMetrics(num_classes, device)
 
-start = time.time()
+train_losses, val_losses, train_accs, val_accs = [], [], [], []
+
+# Model/optimizer/scheduler/RNG/epoch state is written every epoch on a background
+# thread (atomic rename); a rerun after preemption resumes from the last finished
+# epoch, a rerun with a different config starts fresh. The linear probe stores
+# only the head (`net`), the frozen backbone comes from the pretrained weights
+from checkpoints import CheckpointManager
 epochs = 10
-for epoch in range(epochs):
-    model.train()
-    train_loss, correct = 0.0, 0
+ckpt = CheckpointManager("checkpoints/onion_swin" + ("-full" if FULL_FINETUNE else "-probe"), keep_last=2, mode='min',
+                         config={'lr': 1e-4, 'batch_size': 32, 'epochs': epochs,
+                                 'val_every': VAL_EVERY, 'val_fraction': VAL_FRACTION,
+                                 'state': 'head' if LINEAR_PROBE else 'model'})
+start_epoch, extra = ckpt.resume(net, optimizer, scheduler)
+start = time.time()
+if extra:
+    train_losses, val_losses, train_accs, val_accs = extra['history']
+    start -= extra.get('training_time', 0.0)  # count the epochs before the resume
+
+for epoch in range(start_epoch, epochs):
+    net.train()
+    metrics.reset()
 
     for batch_idx, (images, labels) in enumerate(train_loader):
-        images = images.to(device)
+        images = prepare(images, train=True)
 
         # 🛠 Ensure labels are in correct shape: [batch_size]
         if labels.ndim > 1:
@@ -160,50 +207,55 @@ for epoch in range(epochs):
         labels = labels.long().to(device)
 
         # 👇 Uncomment this once to debug the shapes
-        # print(f"[DEBUG] outputs shape: {model(images).shape}, labels shape: {labels.shape}")
+        # print(f"[DEBUG] outputs shape: {net(images).shape}, labels shape: {labels.shape}")
 
-        optimizer.zero_grad()
-        outputs = model(images)
+        loss, outputs = step(images, labels)
 
         # Ensure outputs is [batch_size, num_classes] and labels is [batch_size]
         if outputs.ndim != 2 or labels.ndim != 1:
             raise ValueError(f"❌ Shape mismatch: outputs shape {outputs.shape}, labels shape {labels.shape}")
 
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
+        metrics.update(outputs, labels, loss)
 
-        train_loss += loss.item() * images.size(0)
-        correct += (outputs.argmax(1) == labels).sum().item()
-
-    train_acc = correct / len(train_loader.dataset)
-    train_losses.append(train_loss / len(train_loader.dataset))
+    epoch_metrics = metrics.compute()
+    train_acc = epoch_metrics['accuracy']
+    train_losses.append(epoch_metrics['loss'])
     train_accs.append(train_acc)
 
-    # Validation loop
-    model.eval()
-    val_loss, val_correct = 0.0, 0
-    with torch.no_grad():
-        for images, labels in val_loader:
-            images = images.to(device)
-            if labels.ndim > 1:
-                labels = torch.argmax(labels, dim=1)
-            labels = labels.long().to(device)
-
-            outputs = model(images)
-
-            if outputs.ndim != 2 or labels.ndim != 1:
-                raise ValueError(f"❌ VAL Shape mismatch: outputs shape {outputs.shape}, labels shape {labels.shape}")
-
-            val_loss += criterion(outputs, labels).item() * images.size(0)
-            val_correct += (outputs.argmax(1) == labels).sum().item()
-
-    val_acc = val_correct / len(val_loader.dataset)
-    val_losses.append(val_loss / len(val_loader.dataset))
+    # Validation loop (skipped or subsampled per val_schedule; NaN when skipped)
+    loader = val_schedule.loader(epoch, epochs)
+    if loader is not None:
+        net.eval()
+        metrics.reset()
+        with torch.no_grad():
+            for images, labels in loader:
+                images = prepare(images, train=False)
+                if labels.ndim > 1:
+                    labels = torch.argmax(labels, dim=1)
+                labels = labels.long().to(device)
+
+                outputs = step.evaluate(images)
+
+                if outputs.ndim != 2 or labels.ndim != 1:
+                    raise ValueError(f"❌ VAL Shape mismatch: outputs shape {outputs.shape}, labels shape {labels.shape}")
+
+                metrics.update(outputs, labels, criterion(outputs, labels))
+
+        epoch_metrics = metrics.compute()
+        val_acc = epoch_metrics['accuracy']
+        val_losses.append(epoch_metrics['loss'])
+        val_note = format_accuracy(epoch_metrics, val_schedule.is_full(loader))
+    else:
+        val_acc = float('nan')
+        val_losses.append(float('nan'))
+        val_note = "skipped"
     val_accs.append(val_acc)
 
-    print(f"Epoch {epoch+1}/{epochs} | Train Acc: {train_acc:.4f} | Val Acc: {val_acc:.4f}")
-
+    print(f"Epoch {epoch+1}/{epochs} | Train Acc: {train_acc:.4f} | Val Acc: {val_note}")
+    ckpt.save(epoch + 1, net, optimizer, scheduler, metric=val_losses[-1] if loader is not None else None,
+              extra={'history': (train_losses, val_losses, train_accs, val_accs),
+                     'training_time': time.time() - start})
+ckpt.wait()
 
 end = time.time()
 training_time = end - start
@@ -222,17 +274,17 @@ plt.legend()
 plt.show()
 
 # Step 9: Evaluate on Test Set
-model.eval()
+net.eval()
 y_true, y_pred, y_probs = [], [], []
 with torch.no_grad():
     for images, labels in test_loader:
-        images = images.to(device)
+        images = prepare(images, train=False)
         labels = labels.to(device)
         if labels.ndim > 1:
             labels = torch.argmax(labels, dim=1)
         labels = labels.long()
 
-        outputs = model(images)
+        outputs = step.evaluate(images)
         y_probs.extend(outputs.cpu().numpy())
         y_pred.extend(outputs.argmax(1).cpu().numpy())
         y_true.extend(labels.cpu().numpy())
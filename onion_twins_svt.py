@@ -21,55 +21,20 @@ GCS_URI = "gs://onion11"  # Update this if the URI is different
 !mkdir -p OnionData
 !gsutil -m cp -r {GCS_URI}/* OnionData/
 
-# Step 3: Organize dataset into train/val/test folders
-import shutil
-import random
+# Step 3: Split dataset into train/val/test
+# Split is a stable hash of each file name, recorded in a manifest and updated incrementally
+from onion_labels import index_onion_labels, load_class_names, group_by_class
+from data_splits import update_split_manifest, ManifestDataset
 
 base_dir = 'OnionData'
-class_id_to_name = {}
-classes_txt_path = os.path.join(base_dir, 'classes.txt')
-
-if os.path.exists(classes_txt_path):
-    with open(classes_txt_path, 'r') as f:
-        for i, line in enumerate(f):
-            class_id_to_name[str(i)] = line.strip()
-
-jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.jpg')}
-txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.txt')}
-paired = [base for base in jpgs if base in txts]
-
-class_to_images = {}
-for base in paired:
-    with open(os.path.join(base_dir, txts[base]), 'r') as f:
-        line = f.readline().strip()
-        if not line: continue
-        class_id = line.split()[0]
-        class_label = class_id_to_name.get(class_id, f"class_{class_id}")
-        class_to_images.setdefault(class_label, []).append(jpgs[base])
-
-# Split and copy into train, val, test folders
-for split in ['train', 'val', 'test']:
-    shutil.rmtree(split, ignore_errors=True)
-    for label in class_to_images.keys():
-        os.makedirs(os.path.join(split, label), exist_ok=True)
-
-for label, images in class_to_images.items():
-    random.shuffle(images)
-    total = len(images)
-    train_n = int(0.8 * total)
-    val_n = int(0.1 * total)
-
-    for img in images[:train_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('train', label, img))
-    for img in images[train_n:train_n+val_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('val', label, img))
-    for img in images[train_n+val_n:]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('test', label, img))
+class_id_to_name = load_class_names(base_dir)
+class_to_images = group_by_class(index_onion_labels(base_dir), class_id_to_name)
+
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1))
 
 # Step 4: Data Preprocessing and Loading
 import torch
 import torchvision.transforms as transforms
-from torchvision.datasets import ImageFolder
 from torch.utils.data import DataLoader
 from sklearn.metrics import classification_report, confusion_matrix
 import numpy as np
@@ -86,79 +51,116 @@ transform = transforms.Compose([
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
 ])
 
-train_dataset = ImageFolder('train', transform=transform)
-val_dataset = ImageFolder('val', transform=transform)
-test_dataset = ImageFolder('test', transform=transform)
-
-train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
-val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
-test_loader = DataLoader(test_dataset, batch_size=32, shuffle=False)
+# Images are read straight from OnionData through the split manifest,
+# JPEGs decoded at reduced resolution before the 224x224 resize
+train_dataset = ManifestDataset(manifest, 'train', transform=transform, target_size=(224, 224))
+val_dataset = ManifestDataset(manifest, 'val', transform=transform, target_size=(224, 224))
+test_dataset = ManifestDataset(manifest, 'test', transform=transform, target_size=(224, 224))
+
+# Workers / prefetch / pinning tuned for this machine (cached after the first run)
+from torch_loaders import tune_loader_settings, make_loader
+loader_settings = tune_loader_settings(train_dataset, batch_size=32)
+
+train_loader = make_loader(train_dataset, batch_size=32, shuffle=True, settings=loader_settings)
+val_loader = make_loader(val_dataset, batch_size=32, settings=loader_settings)
+test_loader = make_loader(test_dataset, batch_size=32, settings=loader_settings)
+
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs), the last one on all of it; accuracy comes with a
+# 95% confidence interval
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.5
+val_subset_loader = make_loader(Subset(val_dataset, stratified_indices(val_dataset.targets, VAL_FRACTION)),
+                                batch_size=32, settings=loader_settings)
+val_schedule = ValidationSchedule(val_loader, val_subset_loader, every=VAL_EVERY)
+
+# The conv TwinsSVT trains a batch faster than the workers decode one: reuse
+# each decoded batch (flipped / shifted copies), factor picked from measured
+# loader wait vs step time (ECHO = 1 turns echoing off)
+from data_echo import EchoLoader
+ECHO = 'auto'
+train_loader = EchoLoader(train_loader, factor=ECHO)
 
 # Step 5: Define Twins-SVT Model
 import torch.nn as nn
-
-class TwinsSVT(nn.Module):
-    def __init__(self, num_classes):
-        super(TwinsSVT, self).__init__()
-        self.conv1 = nn.Conv2d(3, 64, 3, padding=1)
-        self.conv2 = nn.Conv2d(64, 128, 3, padding=1)
-        self.pool = nn.MaxPool2d(2)
-        self.fc1 = nn.Linear(128 * 56 * 56, 512)
-        self.fc2 = nn.Linear(512, num_classes)
-        self.relu = nn.ReLU()
-        self.dropout = nn.Dropout(0.5)
-
-    def forward(self, x):
-        x = self.pool(self.relu(self.conv1(x)))
-        x = self.pool(self.relu(self.conv2(x)))
-        x = x.view(x.size(0), -1)
-        x = self.dropout(self.relu(self.fc1(x)))
-        return self.fc2(x)
-
-model = TwinsSVT(len(train_dataset.classes)).to(device)
+# Global average ('avg') or attention pooling before fc1 instead of flattening
+# the 128x56x56 map into a 205M-parameter Linear ('flatten', the original head);
+# TWINS_BACKBONE = 'timm' swaps in a real Twins-SVT (`python twins_model.py`
+# benchmarks the variants)
+from twins_model import TwinsSVT
+TWINS_POOL = 'avg'
+TWINS_BACKBONE = 'conv'
+
+model = TwinsSVT(len(train_dataset.classes), pool=TWINS_POOL, backbone=TWINS_BACKBONE).to(device)
 criterion = nn.CrossEntropyLoss()
 optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
 
+# bf16 autocast where the hardware runs it natively (fp32 otherwise) and NHWC weights/batches
+# for the conv layers; `python train_step.py` compares the modes
+from train_step import TrainStep, auto_precision
+step = TrainStep(model, criterion, optimizer, device, precision=auto_precision(device), channels_last=True)
+
 # Step 6: Train the Model
 num_epochs = 10
 train_losses, val_losses, train_accuracies, val_accuracies = [], [], [], []
 
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+metrics = ClassificationMetrics(len(train_dataset.classes), device)
+
+# Model/optimizer/RNG/epoch state is written every epoch on a background thread
+# (atomic rename); a rerun after preemption resumes from the last finished epoch,
+# a rerun with a different config starts fresh
+from checkpoints import CheckpointManager
+ckpt = CheckpointManager(f"checkpoints/onion_twins_svt-{TWINS_BACKBONE}-{TWINS_POOL}", keep_last=2, mode='min',
+                         config={'lr': 0.001, 'batch_size': 32, 'epochs': num_epochs, 'echo': ECHO,
+                                 'val_every': VAL_EVERY, 'val_fraction': VAL_FRACTION})
+start_epoch, extra = ckpt.resume(model, optimizer)
 start_time = time.time()
+if extra:
+    train_losses, val_losses, train_accuracies, val_accuracies = extra['history']
+    start_time -= extra.get('training_time', 0.0)  # count the epochs before the resume
 
-for epoch in range(num_epochs):
+for epoch in range(start_epoch, num_epochs):
     model.train()
-    running_loss, running_corrects = 0, 0
+    metrics.reset()
     for inputs, labels in train_loader:
-        inputs, labels = inputs.to(device), labels.to(device)
-        optimizer.zero_grad()
-        outputs = model(inputs)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
-        _, preds = torch.max(outputs, 1)
-        running_loss += loss.item() * inputs.size(0)
-        running_corrects += (preds == labels).sum().item()
-    epoch_loss = running_loss / len(train_dataset)
-    epoch_acc = running_corrects / len(train_dataset)
+        inputs, labels = step.prepare(inputs), labels.to(device)
+        loss, outputs = step(inputs, labels)
+        metrics.update(outputs, labels, loss)
+    epoch_metrics = metrics.compute()
+    epoch_loss = epoch_metrics['loss']
+    epoch_acc = epoch_metrics['accuracy']
     train_losses.append(epoch_loss)
     train_accuracies.append(epoch_acc)
 
-    model.eval()
-    val_loss, val_corrects = 0, 0
-    with torch.no_grad():
-        for inputs, labels in val_loader:
-            inputs, labels = inputs.to(device), labels.to(device)
-            outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            _, preds = torch.max(outputs, 1)
-            val_loss += loss.item() * inputs.size(0)
-            val_corrects += (preds == labels).sum().item()
-    val_loss /= len(val_dataset)
-    val_acc = val_corrects / len(val_dataset)
+    # Validation (skipped or subsampled per val_schedule; NaN when skipped)
+    loader = val_schedule.loader(epoch, num_epochs)
+    if loader is not None:
+        model.eval()
+        metrics.reset()
+        with torch.no_grad():
+            for inputs, labels in loader:
+                inputs, labels = step.prepare(inputs), labels.to(device)
+                outputs = step.evaluate(inputs)
+                metrics.update(outputs, labels, criterion(outputs, labels))
+        epoch_metrics = metrics.compute()
+        val_loss = epoch_metrics['loss']
+        val_acc = epoch_metrics['accuracy']
+        val_note = format_accuracy(epoch_metrics, val_schedule.is_full(loader))
+    else:
+        val_loss = val_acc = float('nan')
+        val_note = "skipped"
     val_losses.append(val_loss)
     val_accuracies.append(val_acc)
 
-    print(f"Epoch {epoch+1}: Train Acc: {epoch_acc:.4f}, Val Acc: {val_acc:.4f}")
+    print(f"Epoch {epoch+1}: Train Acc: {epoch_acc:.4f}, Val Acc: {val_note}")
+    ckpt.save(epoch + 1, model, optimizer, metric=val_loss if loader is not None else None,
+              extra={'history': (train_losses, val_losses, train_accuracies, val_accuracies),
+                     'training_time': time.time() - start_time})
+ckpt.wait()
 
 training_time = timedelta(seconds=int(time.time() - start_time))
 
@@ -180,8 +182,8 @@ all_preds, all_labels = [], []
 
 with torch.no_grad():
     for inputs, labels in test_loader:
-        inputs, labels = inputs.to(device), labels.to(device)
-        outputs = model(inputs)
+        inputs, labels = step.prepare(inputs), labels.to(device)
+        outputs = step.evaluate(inputs)
         _, preds = torch.max(outputs, 1)
         all_preds.extend(preds.cpu().numpy())
         all_labels.extend(labels.cpu().numpy())
@@ -216,8 +218,7 @@ y_pred_probs = []
 
 with torch.no_grad():
     for inputs, _ in test_loader:
-        inputs = inputs.to(device)
-        outputs = torch.softmax(model(inputs), dim=1)
+        outputs = torch.softmax(step.evaluate(step.prepare(inputs)), dim=1)
         y_pred_probs.extend(outputs.cpu().numpy())
 
 y_pred_probs = np.array(y_pred_probs)
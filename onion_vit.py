@@ -22,78 +22,35 @@ GCS_URI = "gs://onion11"
 !gsutil -m cp -r {GCS_URI}/* OnionData/
 
 # STEP 3: Data preprocessing (same as CoatNet)
-import shutil, random, warnings
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+import warnings
+from tf_data import image_dataset
+
+from onion_labels import index_onion_labels, load_class_names, group_by_class
+from data_splits import update_split_manifest, link_split_dirs
 
 base_dir = 'OnionData'
-class_id_to_name = {}
-classes_txt_path = os.path.join(base_dir, 'classes.txt')
-if os.path.exists(classes_txt_path):
-    with open(classes_txt_path, 'r') as f:
-        for i, line in enumerate(f):
-            class_id_to_name[str(i)] = line.strip()
-
-jpgs = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.jpg')}
-txts = {os.path.splitext(f)[0]: f for f in os.listdir(base_dir) if f.endswith('.txt')}
-paired = [base for base in jpgs if base in txts]
-
-class_to_images = {}
-for base in paired:
-    txt_path = os.path.join(base_dir, txts[base])
-    try:
-        with open(txt_path, 'r') as f:
-            line = f.readline().strip()
-            if not line:
-                continue
-            class_id = line.split()[0]
-            class_label = class_id_to_name.get(class_id, f"class_{class_id}")
-            class_to_images.setdefault(class_label, []).append(jpgs[base])
-    except Exception as e:
-        print(f"Skipping {txt_path} due to error: {e}")
-
-for split in ['train', 'val', 'test']:
-    shutil.rmtree(split, ignore_errors=True)
-    for label in class_to_images:
-        os.makedirs(os.path.join(split, label), exist_ok=True)
-
-for label, images in class_to_images.items():
-    random.shuffle(images)
-    total = len(images)
-    train_n = int(0.8 * total)
-    val_n = int(0.1 * total)
-    test_n = total - train_n - val_n
-    for img in images[:train_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('train', label, img))
-    for img in images[train_n:train_n+val_n]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('val', label, img))
-    for img in images[train_n+val_n:]:
-        shutil.copy(os.path.join(base_dir, img), os.path.join('test', label, img))
+class_id_to_name = load_class_names(base_dir)
+class_to_images = group_by_class(index_onion_labels(base_dir), class_id_to_name)
+
+# Stable hash-based split; train/val/test are hardlinks, updated incrementally
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1))
+link_split_dirs(manifest)
 
 # 4. Data generators with augmentation
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tf_data import image_dataset
 
 IMG_SIZE = 224
 BATCH_SIZE = 32
 
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=25,
-    zoom_range=0.15,
-    width_shift_range=0.1,
-    height_shift_range=0.1,
-    horizontal_flip=True,
-    shear_range=0.1,
-    fill_mode='nearest'
-)
-
-val_test_datagen = ImageDataGenerator(rescale=1./255)
+# tf.data pipelines: parallel decode/resize, packed uint8 cache. Training only sees
+# cached features (augmented views below), so the train images are read once,
+# unaugmented and unshuffled; they also fix the class order
+train_images = image_dataset('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
+val_generator = image_dataset('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed', classes=list(train_images.class_indices))
+test_generator = image_dataset('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed', classes=list(train_images.class_indices))
 
-train_generator = train_datagen.flow_from_directory('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-val_generator = val_test_datagen.flow_from_directory('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-test_generator = val_test_datagen.flow_from_directory('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-
-num_classes = len(train_generator.class_indices)
-class_labels = list(train_generator.class_indices.keys())
+num_classes = len(train_images.class_indices)
+class_labels = list(train_images.class_indices.keys())
 
 # 5. Define ViT model with frozen base
 !pip install -q transformers
@@ -121,9 +78,31 @@ def create_vit_model(num_classes):
     return Model(inputs, outputs)
 
 model = create_vit_model(num_classes)
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
 model.summary()
 
+# Frozen base: compute its pooled features once per split, then train only the
+# Dense(512)/Dropout/softmax head on the cached features
+from keras_features import split_frozen_model, cache_keras_features, feature_dataset, assemble_model
+from tf_data import augmentation_layers
+
+# The training augmentation survives as PROBE_VIEWS cached views per image
+# (view 0 clean, the rest randomly augmented); one is drawn per sample per epoch
+PROBE_VIEWS = 4
+PROBE_BUDGET_MB = 2048  # upper bound on the training feature store
+train_augment = augmentation_layers(rotation_range=25, zoom_range=0.15, width_shift_range=0.1, height_shift_range=0.1,
+                                    horizontal_flip=True, fill_mode='nearest')
+
+extractor, head = split_frozen_model(model)
+cache_keras_features(extractor, train_images, 'features/vit_train', key='google/vit-base-patch16-224',
+                     views=PROBE_VIEWS, augment=train_augment, storage_budget_mb=PROBE_BUDGET_MB)
+for split, images in (('val', val_generator), ('test', test_generator)):
+    cache_keras_features(extractor, images, f'features/vit_{split}', key='google/vit-base-patch16-224')
+
+train_features = feature_dataset('features/vit_train', num_classes, batch_size=BATCH_SIZE, shuffle=True)
+val_features = feature_dataset('features/vit_val', num_classes, batch_size=BATCH_SIZE)
+test_features = feature_dataset('features/vit_test', num_classes, batch_size=BATCH_SIZE)
+head.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
 # 6. Train model with EarlyStopping and ReduceLROnPlateau
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
 
@@ -132,17 +111,21 @@ lr_scheduler = ReduceLROnPlateau(factor=0.5, patience=3)
 
 import time
 start_time = time.time()
-history = model.fit(
-    train_generator,
-    validation_data=val_generator,
+history = head.fit(
+    train_features,
+    validation_data=val_features,
     epochs=10,
     callbacks=[early_stop, lr_scheduler]
 )
 training_time = time.time() - start_time
 
+# Full image -> probabilities model (trained head on the frozen base) for export;
+# only the head is trained and evaluated, so neither model needs compiling
+model = assemble_model(extractor, head)
+
 # STEP 7: Evaluate Model
 import matplotlib.pyplot as plt
-test_loss, test_accuracy = model.evaluate(test_generator)
+test_loss, test_accuracy = head.evaluate(test_features)
 
 # Curves
 plt.plot(history.history["accuracy"], label="Train Accuracy")
@@ -179,7 +162,7 @@ from sklearn.metrics import classification_report, confusion_matrix, roc_auc_sco
 from sklearn.preprocessing import label_binarize
 import seaborn as sns
 
-y_pred = model.predict(test_generator)
+y_pred = head.predict(test_features)
 y_pred_classes = np.argmax(y_pred, axis=1)
 y_true = test_generator.classes
 
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Packed uint8 image store for fixed-size training.
+
+Images are decoded and resized once into a single N x H x W x 3 uint8
+np.memmap with a parallel label array and a JSON header describing the
+resize policy. PyTorch and tf.data sources then read straight from the
+memmap, so an epoch costs memory bandwidth instead of JPEG decoding.
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from image_io import open_rgb
+
+try:
+    import torch
+    from torch.utils.data import Dataset
+except ImportError:  # Keras-only scripts don't need torch
+    torch = None
+    Dataset = object
+
+INTERPOLATIONS = {'nearest': Image.NEAREST, 'bilinear': Image.BILINEAR, 'bicubic': Image.BICUBIC}
+
+
+def _paths(prefix):
+    return prefix + '.json', prefix + '.images.npy', prefix + '.labels.npy'
+
+
+def read_header(prefix):
+    with open(_paths(prefix)[0]) as f:
+        return json.load(f)
+
+
+def _load_resized(path, size, interpolation):
+    # 'stretch' matches transforms.Resize((224, 224)) and Keras target_size
+    image = open_rgb(path, size)
+    return np.asarray(image.resize((size[1], size[0]), INTERPOLATIONS[interpolation]), dtype=np.uint8)
+
+
+# Pack manifest rows (dicts with 'path' and 'label') into prefix.*.
+# Skips the work if the existing header already describes the same files and policy.
+def pack_images(rows, prefix, size=(224, 224), interpolation='bilinear', classes=None, num_workers=8):
+    header_path, images_path, labels_path = _paths(prefix)
+    classes = classes or sorted({r['label'] for r in rows})
+    class_to_idx = {c: i for i, c in enumerate(classes)}
+    header = {
+        'count': len(rows),
+        'height': size[0],
+        'width': size[1],
+        'channels': 3,
+        'dtype': 'uint8',
+        'resize': 'stretch',
+        'interpolation': interpolation,
+        'classes': classes,
+        'paths': [r['path'] for r in rows],
+    }
+    if os.path.exists(header_path) and os.path.exists(images_path) and read_header(prefix) == header:
+        print(f"✅ Reusing packed store {prefix} ({len(rows)} images)")
+        return header
+
+    os.makedirs(os.path.dirname(prefix) or '.', exist_ok=True)
+    images = np.lib.format.open_memmap(images_path + '.tmp.npy', mode='w+', dtype=np.uint8,
+                                       shape=(len(rows), size[0], size[1], 3))
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        # PIL releases the GIL while decoding/resizing, so threads scale here
+        for i, arr in enumerate(pool.map(lambda r: _load_resized(r['path'], size, interpolation), rows)):
+            images[i] = arr
+    images.flush()
+    del images
+    os.replace(images_path + '.tmp.npy', images_path)
+
+    np.save(labels_path, np.array([class_to_idx[r['label']] for r in rows], dtype=np.int64))
+    with open(header_path + '.tmp', 'w') as f:
+        json.dump(header, f)
+    os.replace(header_path + '.tmp', header_path)
+    print(f"✅ Packed {len(rows)} images into {images_path}")
+    return header
+
+
+# Pack one split of a split manifest to <out_dir>/<split>; class order comes from
+# the whole manifest so label ids agree across splits
+def pack_split(manifest, split, out_dir='packed', **kwargs):
+    classes = sorted({r['label'] for r in manifest})
+    rows = [r for r in manifest if r['split'] == split]
+    prefix = os.path.join(out_dir, split)
+    pack_images(rows, prefix, classes=classes, **kwargs)
+    return prefix
+
+
+# Opened lazily so each DataLoader worker maps the file itself
+def open_packed(prefix):
+    header = read_header(prefix)
+    images = np.load(_paths(prefix)[1], mmap_mode='c')  # copy-on-write: writable view, no copy
+    labels = np.load(_paths(prefix)[2])
+    return header, images, labels
+
+
+# torch Dataset over the packed store. Without a transform it returns uint8
+# CHW tensors that share memory with the memmap; with one, the transform gets
+# a PIL image (already resized, so drop transforms.Resize from the pipeline).
+class PackedImageDataset(Dataset):
+    def __init__(self, prefix, transform=None):
+        self.prefix = prefix
+        self.transform = transform
+        header = read_header(prefix)
+        self.classes = header['classes']
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.targets = np.load(_paths(prefix)[2]).tolist()
+        self._images = None
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, idx):
+        if self._images is None:
+            _, self._images, _ = open_packed(self.prefix)
+        arr = self._images[idx]
+        target = self.targets[idx]
+        if self.transform:
+            return self.transform(Image.fromarray(arr)), target
+        return torch.from_numpy(arr).permute(2, 0, 1), target
+
+
+# tf.data source over the packed store: yields (uint8 HWC batch, labels).
+# Indices are batched first and gathered from the memmap in one read per batch.
+def packed_tf_dataset(prefix, batch_size=32, shuffle=False, one_hot=True, seed=None):
+    import tensorflow as tf
+
+    header, images, labels = open_packed(prefix)
+    num_classes = len(header['classes'])
+    h, w = header['height'], header['width']
+
+    def gather(idx):
+        idx = np.sort(idx)  # sequential reads from the memmap
+        return images[idx], labels[idx]
+
+    ds = tf.data.Dataset.range(len(labels))
+    if shuffle:
+        ds = ds.shuffle(len(labels), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size)
+    ds = ds.map(lambda idx: tf.numpy_function(gather, [idx], (tf.uint8, tf.int64)),
+                num_parallel_calls=tf.data.AUTOTUNE)
+
+    def set_shapes(x, y):
+        x.set_shape([None, h, w, 3])
+        y.set_shape([None])
+        return x, tf.one_hot(y, num_classes) if one_hot else y
+
+    return ds.map(set_shapes).prefetch(tf.data.AUTOTUNE)
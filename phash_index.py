@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Perceptual-hash duplicate index.
+
+PlantVillage has many near-duplicate leaf photos; if a random split puts
+copies in both train and test, training wastes epochs on them and test
+accuracy is inflated. find_duplicate_groups() computes a 64-bit DCT
+perceptual hash per image (in parallel, cached by mtime/size so reruns
+only hash new files), finds near-duplicates with a BK-tree in sub-linear
+time, and returns a group key per image. update_split_manifest(groups=...)
+then sends each group to a single split.
+
+Grouping is complete-linkage: two groups only merge if every pair of their
+images is within max_distance bits. Plain transitive linking (A~B, B~C)
+would chain runs of similar captures (same leaf, same background) into one
+huge "duplicate" group that lands in a single split, even when A and C are
+far apart. The largest groups are printed so outliers are visible.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_io import open_rgb
+
+INDEX_FILE = '.phash_index.npz'
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT32 = _dct_matrix(32)
+
+
+# pHash: 32x32 grayscale -> 2D DCT -> top-left 8x8 low frequencies -> bits above median
+def phash(path):
+    image = open_rgb(path, (32, 32)).convert('L').resize((32, 32))
+    pixels = np.asarray(image, dtype=np.float64)
+    low = (_DCT32 @ pixels @ _DCT32.T)[:8, :8].flatten()
+    bits = low[1:] > np.median(low[1:])  # skip the DC term
+    return int(sum(1 << i for i, b in enumerate(bits) if b))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+# BK-tree over Hamming distance: query(h, r) only visits subtrees whose edge
+# distance lies in [d - r, d + r] (triangle inequality)
+class BKTree:
+    def __init__(self):
+        self.root = None
+
+    def add(self, h, item):
+        if self.root is None:
+            self.root = (h, item, {})
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (h, item, {})
+                return
+            node = child
+
+    def query(self, h, radius):
+        found, stack = [], [self.root] if self.root else []
+        while stack:
+            node_h, item, children = stack.pop()
+            d = hamming(h, node_h)
+            if d <= radius:
+                found.append(item)
+            for dist, child in children.items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        return found
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+# Hash every path, re-using cached hashes whose file mtime/size are unchanged
+def index_hashes(paths, cache_path=INDEX_FILE, max_workers=16):
+    cached = {}
+    if os.path.exists(cache_path):
+        data = np.load(cache_path, allow_pickle=False)
+        for p, m, s, h in zip(data['paths'], data['mtime_ns'], data['size'], data['hashes']):
+            cached[(str(p), int(m), int(s))] = int(h)
+
+    keys = [_stat_key(p) for p in paths]
+    hashes = [cached.get(k) for k in keys]
+    stale = [i for i, h in enumerate(hashes) if h is None]
+    if stale:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for i, h in zip(stale, pool.map(phash, [paths[i] for i in stale])):
+                hashes[i] = h
+        tmp_path = cache_path + '.tmp.npz'
+        np.savez(tmp_path,
+                 paths=np.array([k[0] for k in keys], dtype=str),
+                 mtime_ns=np.array([k[1] for k in keys], dtype=np.int64),
+                 size=np.array([k[2] for k in keys], dtype=np.int64),
+                 hashes=np.array(hashes, dtype=np.uint64))
+        os.replace(tmp_path, cache_path)
+    print(f"Perceptual hashes: {len(paths)} images ({len(stale)} hashed, {len(paths) - len(stale)} cached)")
+    return hashes
+
+
+# Group index (the group's lowest index) per hash. Groups merge only if all
+# pairs across them are within max_distance bits (complete linkage).
+def group_hashes(hashes, max_distance=4):
+    parent = list(range(len(hashes)))
+    members = {i: [i] for i in range(len(hashes))}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        for j in sorted(tree.query(h, max_distance)):
+            ri, rj = find(i), find(j)
+            if ri == rj:
+                continue
+            if any(hamming(hashes[a], hashes[b]) > max_distance for a in members[ri] for b in members[rj]):
+                continue
+            root, other = min(ri, rj), max(ri, rj)
+            parent[other] = root
+            members[root].extend(members.pop(other))
+        tree.add(h, i)
+    return [find(i) for i in range(len(hashes))]
+
+
+# {path: group key}. Images within max_distance bits of every other image in
+# their group share it; the key is the group's first file name, so it is stable.
+def find_duplicate_groups(class_to_images, max_distance=4, cache_path=INDEX_FILE, max_workers=16):
+    paths = sorted(p for images in class_to_images.values() for p in images)
+    hashes = index_hashes(paths, cache_path, max_workers)
+    roots = group_hashes(hashes, max_distance)
+
+    groups = {p: os.path.basename(paths[r]) for p, r in zip(paths, roots)}
+    n_dup = sum(1 for i, r in enumerate(roots) if r != i)
+    print(f"✅ {n_dup} near-duplicate images folded into {len(set(groups.values()))} groups")
+    sizes = sorted(np.bincount(roots).tolist(), reverse=True) if roots else []
+    if sizes and sizes[0] > 1:
+        print(f"   largest groups: {', '.join(str(s) for s in sizes[:5] if s > 1)} images")
+    return groups
@@ -35,19 +35,35 @@ transform = transforms.Compose([
     transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
 ])
 
-# Load dataset
-dataset = datasets.ImageFolder(data_dir, transform=transform)
+# Step 3: Split Dataset into Training & Validation
+# Stable hash-based 80/20 split recorded in a manifest, read from the original files
+from data_splits import scan_class_folders, update_split_manifest, ManifestDataset
+from phash_index import find_duplicate_groups
+
+class_to_images = scan_class_folders(data_dir)
+# Near-duplicate photos are grouped by perceptual hash so each group lands in one split
+duplicate_groups = find_duplicate_groups(class_to_images)
+manifest = update_split_manifest(class_to_images, 'split_manifest_80_20.csv', ratios=(0.8, 0.2), groups=duplicate_groups)
+dataset_train = ManifestDataset(manifest, "train", transform=transform, target_size=(224, 224))
+dataset_valid = ManifestDataset(manifest, "val", transform=transform, target_size=(224, 224))
+dataset = dataset_train
 num_classes = len(dataset.classes)
 print(f"Number of Classes: {num_classes}")
 
-# Step 3: Split Dataset into Training & Validation
-train_size = int(0.8 * len(dataset))
-valid_size = len(dataset) - train_size
-dataset_train, dataset_valid = random_split(dataset, [train_size, valid_size])
-
 train_loader = DataLoader(dataset_train, batch_size=32, shuffle=True)
 valid_loader = DataLoader(dataset_valid, batch_size=32, shuffle=False)
 
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs), the last one on all of it; accuracy comes with a
+# 95% confidence interval
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.25
+val_subset_loader = DataLoader(Subset(dataset_valid, stratified_indices(dataset_valid.targets, VAL_FRACTION)),
+                               batch_size=32, shuffle=False)
+val_schedule = ValidationSchedule(valid_loader, val_subset_loader, every=VAL_EVERY)
+
 # Step 4: Define ConvNeXt Model
 class PlantDiseaseModel(nn.Module):
     def __init__(self, num_classes):
@@ -66,56 +82,101 @@ model = PlantDiseaseModel(num_classes).to(device)
 
 # Step 5: Define Loss Function & Optimizer
 criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=0.001)
+# Fused (or foreach) optimizer update; COMPILE=True runs forward, loss, backward
+# and update as one torch.compile graph (eager fallback, graphs cached on disk)
+from train_step import TrainStep, auto_precision, fast_optimizer
+COMPILE = False
+
+optimizer = fast_optimizer(optim.Adam, model.parameters(), lr=0.001)
+
+# bf16 autocast where the hardware runs it natively (fp32 otherwise) and NHWC weights/batches,
+# which the convolution kernels prefer; `python train_step.py` compares the modes
+step = TrainStep(model, criterion, optimizer, device, precision=auto_precision(device),
+                 channels_last=True, compile=COMPILE)
 
 # Step 6: Training Function
+# Progressive resizing: the first epochs train at 128 then 160 px (about 3x and
+# 2x cheaper per image) with a proportionally larger batch, the last at 224
+from progressive import ResolutionSchedule, resize_batch, save_curve, plot_curves
+PROGRESSIVE = False  # opt-in; the baseline trains every epoch at 224
+MODE = 'progressive' if PROGRESSIVE else 'fixed'  # separate checkpoints / curve per mode
+EPOCHS = 10
+schedule = ResolutionSchedule(EPOCHS, sizes=(128, 160, 224) if PROGRESSIVE else (224,))
+
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+
+# Model/optimizer/RNG/epoch state is written every epoch on a background thread
+# (atomic rename); a rerun after preemption resumes from the last finished epoch,
+# a rerun with a different config starts fresh
+from checkpoints import CheckpointManager
+ckpt = CheckpointManager(f"checkpoints/plantvillage_convnext-{MODE}", keep_last=2, mode='min',
+                         config={'lr': 0.001, 'batch_size': 32, 'epochs': EPOCHS, 'sizes': schedule.sizes,
+                                 'val_every': VAL_EVERY, 'val_fraction': VAL_FRACTION})
+
 def train_model(model, train_loader, valid_loader, criterion, optimizer, epochs=10):
     start_time = time.time()
-    train_acc, val_acc, train_loss, val_loss = [], [], [], []
-
-    for epoch in range(epochs):
+    train_acc, val_acc, train_loss, val_loss, wall_clock = [], [], [], [], []
+    metrics = ClassificationMetrics(num_classes, device)
+    start_epoch, extra = ckpt.resume(model, optimizer)
+    if extra:
+        train_acc, val_acc, train_loss, val_loss, wall_clock = extra['history']
+        start_time -= extra.get('training_time', 0.0)  # count the epochs before the resume
+
+    for epoch in range(start_epoch, epochs):
+        size = schedule.size(epoch)
+        if epoch == start_epoch or schedule.stage_changed(epoch):
+            batch_size = schedule.batch_size(epoch, 32)
+            train_loader = DataLoader(dataset_train, batch_size=batch_size, shuffle=True)
+            print(f"Training at {size}x{size}, batch size {batch_size}")
+        epoch_start = time.time()
         model.train()
-        correct, total, running_loss = 0, 0, 0
+        metrics.reset()
 
         for images, labels in train_loader:
-            images, labels = images.to(device), labels.to(device)
-            optimizer.zero_grad()
-            outputs = model(images)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
-
-            running_loss += loss.item()
-            _, predicted = torch.max(outputs, 1)
-            total += labels.size(0)
-            correct += (predicted == labels).sum().item()
-
-        train_loss.append(running_loss / len(train_loader))
-        train_acc.append(100 * correct / total)
-
-        # Validation Step
-        model.eval()
-        correct, total, running_loss = 0, 0, 0
-        with torch.no_grad():
-            for images, labels in valid_loader:
-                images, labels = images.to(device), labels.to(device)
-                outputs = model(images)
-                loss = criterion(outputs, labels)
-                running_loss += loss.item()
-                _, predicted = torch.max(outputs, 1)
-                total += labels.size(0)
-                correct += (predicted == labels).sum().item()
-
-        val_loss.append(running_loss / len(valid_loader))
-        val_acc.append(100 * correct / total)
-
-        print(f"Epoch [{epoch+1}/{epochs}], Train Acc: {train_acc[-1]:.2f}%, Val Acc: {val_acc[-1]:.2f}%")
-
+            images, labels = step.prepare(resize_batch(images.to(device), size)), labels.to(device)
+            loss, outputs = step(images, labels)
+            metrics.update(outputs, labels, loss)
+
+        epoch_metrics = metrics.compute()
+        train_loss.append(epoch_metrics['loss'])
+        train_acc.append(100 * epoch_metrics['accuracy'])
+
+        # Validation Step (skipped or subsampled per val_schedule; NaN when skipped)
+        loader = val_schedule.loader(epoch, epochs)
+        if loader is not None:
+            model.eval()
+            metrics.reset()
+            with torch.no_grad():
+                for images, labels in loader:
+                    images, labels = step.prepare(images), labels.to(device)
+                    outputs = step.evaluate(images)
+                    metrics.update(outputs, labels, criterion(outputs, labels))
+
+            epoch_metrics = metrics.compute()
+            val_loss.append(epoch_metrics['loss'])
+            val_acc.append(100 * epoch_metrics['accuracy'])
+            val_note = format_accuracy(epoch_metrics, val_schedule.is_full(loader))
+        else:
+            val_loss.append(float('nan'))
+            val_acc.append(float('nan'))
+            val_note = "skipped"
+
+        print(f"Epoch [{epoch+1}/{epochs}], Train Acc: {train_acc[-1]:.2f}%, Val Acc: {val_note}")
+        wall_clock.append((wall_clock[-1] if wall_clock else 0.0) + time.time() - epoch_start)
+        ckpt.save(epoch + 1, model, optimizer, metric=val_loss[-1] if loader is not None else None,
+                  extra={'history': (train_acc, val_acc, train_loss, val_loss, wall_clock),
+                         'training_time': time.time() - start_time})
+
+    ckpt.wait()
     training_time = time.time() - start_time
+    # Wall-clock-to-accuracy curve of this run, overlaid with the other mode's run
+    save_curve(f"curves/plantvillage_convnext-{MODE}.json", wall_clock, val_acc)
+    plot_curves("curves/plantvillage_convnext")
     return train_acc, val_acc, train_loss, val_loss, training_time
 
 # Step 7: Train Model
-train_acc, val_acc, train_loss, val_loss, training_time = train_model(model, train_loader, valid_loader, criterion, optimizer, epochs=10)
+train_acc, val_acc, train_loss, val_loss, training_time = train_model(model, train_loader, valid_loader, criterion, optimizer, epochs=EPOCHS)
 
 # Step 8: Plot Loss Curve
 plt.figure(figsize=(10,5))
@@ -128,17 +189,14 @@ plt.legend()
 plt.show()
 
 # Step 9: Model Evaluation
-correct, total = 0, 0
+test_metrics = ClassificationMetrics(num_classes, device)
 model.eval()
 with torch.no_grad():
     for images, labels in valid_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
-        _, predicted = torch.max(outputs, 1)
-        total += labels.size(0)
-        correct += (predicted == labels).sum().item()
+        images, labels = step.prepare(images), labels.to(device)
+        test_metrics.update(step.evaluate(images), labels)
 
-test_acc = 100 * correct / total
+test_acc = 100 * test_metrics.compute()['accuracy']
 
 # Step 10: Model Summary
 model_size = sum(p.numel() for p in model.parameters()) * 4 / (1024 ** 2)  # Convert to MB
@@ -163,8 +221,8 @@ all_probs = []
 
 with torch.no_grad():
     for images, labels in valid_loader:
-        images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
+        images, labels = step.prepare(images), labels.to(device)
+        outputs = step.evaluate(images)
         _, predicted = torch.max(outputs, 1)
 
         all_labels.extend(labels.cpu().numpy())
@@ -36,55 +36,33 @@ uploaded = files.upload()
 # Unzip the downloaded dataset
 !unzip plantdisease.zip -d plant_disease
 
-# STEP 3: Organize dataset into train/val/test folders (Corrected)
-import shutil
-import random
-import os
+# STEP 3: Organize dataset into train/val/test folders
+# Stable hash-based split; train/val/test are hardlinks, updated incrementally
+from data_splits import scan_class_folders, update_split_manifest, link_split_dirs
+from phash_index import find_duplicate_groups
 
-# Define source and output paths
+# Define source path
 data_dir = 'plant_disease/PlantVillage'
-output_dirs = ['train', 'val', 'test']
 valid_exts = ('.jpg', '.jpeg', '.png')
 
-# Clear previous folders
-for d in output_dirs:
-    shutil.rmtree(d, ignore_errors=True)
-
-# Loop through all folders (classes)
-classes = [cls for cls in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, cls))]
-
-for cls in classes:
-    img_folder = os.path.join(data_dir, cls)
-    images = [f for f in os.listdir(img_folder) if f.lower().endswith(valid_exts)]
-
-    if len(images) < 10:
-        continue  # Skip classes with too few samples
-
-    random.shuffle(images)
-    n = len(images)
-    train_n = int(0.8 * n)
-    val_n = int(0.1 * n)
-
-    for i, img in enumerate(images):
-        split = 'train' if i < train_n else 'val' if i < train_n + val_n else 'test'
-        dst_dir = os.path.join(split, cls)
-        os.makedirs(dst_dir, exist_ok=True)
-        shutil.copy(os.path.join(img_folder, img), os.path.join(dst_dir, img))
+# Skip classes with too few samples
+class_to_images = scan_class_folders(data_dir, valid_exts=valid_exts, min_images=10)
+# Near-duplicate photos are grouped by perceptual hash so each group lands in one split
+duplicate_groups = find_duplicate_groups(class_to_images)
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1), groups=duplicate_groups)
+link_split_dirs(manifest)
 
 # STEP 4: Data loading
 import tensorflow as tf
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tf_data import image_dataset
 
 IMG_SIZE = 224
 BATCH_SIZE = 32
 
-train_gen = ImageDataGenerator(rescale=1./255)
-val_gen = ImageDataGenerator(rescale=1./255)
-test_gen = ImageDataGenerator(rescale=1./255)
-
-train_loader = train_gen.flow_from_directory('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-val_loader = val_gen.flow_from_directory('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-test_loader = test_gen.flow_from_directory('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
+# tf.data pipelines: parallel decode/resize, packed uint8 cache, prefetching
+train_loader = image_dataset('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, shuffle=True, cache='packed')
+val_loader = image_dataset('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed', classes=list(train_loader.class_indices))
+test_loader = image_dataset('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed', classes=list(train_loader.class_indices))
 
 print("Detected classes:", train_loader.class_indices)
 
@@ -107,18 +85,37 @@ for layer in base_model.layers:
 model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
 model.summary()
 
+# Frozen base: compute its pooled features once per split, then train only the
+# Dense(512)/Dropout/softmax head on the cached features
+from keras_features import split_frozen_model, cache_keras_features, feature_dataset, assemble_model
+
+extractor, head = split_frozen_model(model)
+# Unaugmented, unshuffled pass over the training images (re-uses the packed cache)
+train_images = image_dataset('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
+for split, images in (('train', train_images), ('val', val_loader), ('test', test_loader)):
+    cache_keras_features(extractor, images, f'features/densenet121_{split}', key='densenet121-imagenet')
+
+train_features = feature_dataset('features/densenet121_train', len(train_loader.class_indices), batch_size=BATCH_SIZE, shuffle=True)
+val_features = feature_dataset('features/densenet121_val', len(train_loader.class_indices), batch_size=BATCH_SIZE)
+test_features = feature_dataset('features/densenet121_test', len(train_loader.class_indices), batch_size=BATCH_SIZE)
+head.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
 # STEP 6: Train the model
 import time
 EPOCHS = 10
 start_time = time.time()
 
-history = model.fit(train_loader, validation_data=val_loader, epochs=EPOCHS)
+history = head.fit(train_features, validation_data=val_features, epochs=EPOCHS)
 training_time = time.time() - start_time
 
+# Full image -> probabilities model (trained head on the frozen base) for export
+model = assemble_model(extractor, head)
+model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
 # STEP 7: Evaluate model
 import matplotlib.pyplot as plt
 
-test_loss, test_accuracy = model.evaluate(test_loader)
+test_loss, test_accuracy = head.evaluate(test_features)
 
 plt.plot(history.history["accuracy"], label="Train Accuracy")
 plt.plot(history.history["val_accuracy"], label="Validation Accuracy")
@@ -135,7 +132,7 @@ from sklearn.metrics import classification_report, confusion_matrix, roc_auc_sco
 from sklearn.preprocessing import label_binarize
 import seaborn as sns
 
-y_pred = model.predict(test_loader)
+y_pred = head.predict(test_features)
 y_pred_classes = np.argmax(y_pred, axis=1)
 y_true = test_loader.classes
 class_labels = list(test_loader.class_indices.keys())
@@ -25,33 +25,15 @@ os.rename(kaggle_json, f"{os.environ['KAGGLE_CONFIG_DIR']}/kaggle.json")
 with zipfile.ZipFile("plantdisease.zip", 'r') as zip_ref:
     zip_ref.extractall("PlantVillage")
 
-# Step 3: Organize dataset into train/val/test
-import shutil, os, random
-from collections import defaultdict
+# Step 3: Build a train/val/test split manifest (no copying)
+from data_splits import scan_class_folders, update_split_manifest
+from phash_index import find_duplicate_groups
 
 base_dir = "PlantVillage/PlantVillage"
-output_dirs = ['train', 'val', 'test']
-
-for d in output_dirs:
-    for cls in os.listdir(base_dir):
-        os.makedirs(os.path.join(d, cls), exist_ok=True)
-
-for cls in os.listdir(base_dir):
-    cls_path = os.path.join(base_dir, cls)
-    images = os.listdir(cls_path)
-    random.shuffle(images)
-    n = len(images)
-    n_train, n_val = int(0.8 * n), int(0.1 * n)
-
-    for i, img in enumerate(images):
-        src = os.path.join(cls_path, img)
-        if i < n_train:
-            dst = os.path.join('train', cls, img)
-        elif i < n_train + n_val:
-            dst = os.path.join('val', cls, img)
-        else:
-            dst = os.path.join('test', cls, img)
-        shutil.copyfile(src, dst)
+class_to_images = scan_class_folders(base_dir)
+# Near-duplicate photos are grouped by perceptual hash so each group lands in one split
+duplicate_groups = find_duplicate_groups(class_to_images)
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1), groups=duplicate_groups)
 
 # Step 4: Imports
 import torch
@@ -79,9 +61,26 @@ transform = transforms.Compose([
                          [0.229, 0.224, 0.225])
 ])
 
-train_data = datasets.ImageFolder("train", transform=transform)
-val_data = datasets.ImageFolder("val", transform=transform)
-test_data = datasets.ImageFolder("test", transform=transform)
+# Decode + resize every image once into a packed uint8 memmap per split;
+# later epochs (and reruns) read pre-resized pixels instead of JPEGs
+from packed_store import pack_split, PackedImageDataset
+
+packed_transform = transforms.Compose([
+    transforms.RandomHorizontalFlip(),
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406],
+                         [0.229, 0.224, 0.225])
+])
+# Val/test are scored on the images as-is (no random flip)
+packed_eval_transform = transforms.Compose([
+    transforms.ToTensor(),
+    transforms.Normalize([0.485, 0.456, 0.406],
+                         [0.229, 0.224, 0.225])
+])
+
+train_data = PackedImageDataset(pack_split(manifest, "train", size=(224, 224)), transform=packed_transform)
+val_data = PackedImageDataset(pack_split(manifest, "val", size=(224, 224)), transform=packed_eval_transform)
+test_data = PackedImageDataset(pack_split(manifest, "test", size=(224, 224)), transform=packed_eval_transform)
 
 train_loader = DataLoader(train_data, batch_size=32, shuffle=True)
 val_loader = DataLoader(val_data, batch_size=32, shuffle=False)
@@ -105,47 +104,95 @@ for param in model.parameters():
 for param in model.head.parameters():
     param.requires_grad = True
 
+# Linear probe: only the head trains, so run the frozen backbone once per image
+# and augmentation view and train the head on the cached float16 features
+# instead of re-running Swin every epoch. Two views (as-is and flipped) cover
+# the flip augmentation; pass augment= to augment_views for richer random views.
+LINEAR_PROBE = True
+PROBE_VIEWS = 2
+PROBE_BUDGET_MB = 1024  # upper bound on the training feature store
+
+if LINEAR_PROBE:
+    from feature_cache import cache_features, feature_loader, augment_views
+    from torch_loaders import BatchTransform
+    probe_views = augment_views(BatchTransform([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]))
+    for split, views in (("train", PROBE_VIEWS), ("val", 1), ("test", 1)):
+        # Untransformed packed data: uint8 CHW tensors, flipped/normalized on the device
+        cache_features(model, PackedImageDataset(f"packed/{split}"), f"features/swin_{split}",
+                       probe_views, views=views, device=device, storage_budget_mb=PROBE_BUDGET_MB)
+    train_loader = feature_loader("features/swin_train", batch_size=32, shuffle=True)
+    val_loader = feature_loader("features/swin_val", batch_size=32)
+    test_loader = feature_loader("features/swin_test", batch_size=32)
+    net = model.get_classifier()  # head's Linear layer, applied to pooled features
+else:
+    net = model
+
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs), the last one on all of it; accuracy comes with a
+# 95% confidence interval
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.25
+val_indices = stratified_indices(val_data.targets, VAL_FRACTION)
+if LINEAR_PROBE:
+    val_subset_loader = feature_loader("features/swin_val", batch_size=32, indices=val_indices)
+else:
+    val_subset_loader = DataLoader(Subset(val_data, val_indices), batch_size=32, shuffle=False)
+val_schedule = ValidationSchedule(val_loader, val_subset_loader, every=VAL_EVERY)
+
 criterion = nn.CrossEntropyLoss()
 optimizer = optim.AdamW(model.parameters(), lr=1e-4)
 scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer, mode='min', patience=3)
 
 # Step 7: Train
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+metrics = ClassificationMetrics(num_classes, device)
+
 train_losses, val_losses, train_accs, val_accs = [], [], [], []
 start = time.time()
 epochs = 10
 
 for epoch in range(epochs):
-    model.train()
-    total_loss, correct = 0.0, 0
+    net.train()
+    metrics.reset()
 
     for images, labels in train_loader:
         images, labels = images.to(device), labels.to(device)
         optimizer.zero_grad()
-        outputs = model(images)
+        outputs = net(images)
         loss = criterion(outputs, labels)
         loss.backward()
         optimizer.step()
 
-        total_loss += loss.item() * images.size(0)
-        correct += (outputs.argmax(1) == labels).sum().item()
-
-    train_losses.append(total_loss / len(train_loader.dataset))
-    train_accs.append(correct / len(train_loader.dataset))
-
-    # Validation
-    model.eval()
-    val_loss, val_correct = 0.0, 0
-    with torch.no_grad():
-        for images, labels in val_loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            val_loss += criterion(outputs, labels).item() * images.size(0)
-            val_correct += (outputs.argmax(1) == labels).sum().item()
-
-    val_losses.append(val_loss / len(val_loader.dataset))
-    val_accs.append(val_correct / len(val_loader.dataset))
-
-    print(f"Epoch {epoch+1}/{epochs} | Train Acc: {train_accs[-1]:.4f} | Val Acc: {val_accs[-1]:.4f}")
+        metrics.update(outputs, labels, loss)
+
+    epoch_metrics = metrics.compute()
+    train_losses.append(epoch_metrics['loss'])
+    train_accs.append(epoch_metrics['accuracy'])
+
+    # Validation (skipped or subsampled per val_schedule; NaN when skipped)
+    loader = val_schedule.loader(epoch, epochs)
+    if loader is not None:
+        net.eval()
+        metrics.reset()
+        with torch.no_grad():
+            for images, labels in loader:
+                images, labels = images.to(device), labels.to(device)
+                outputs = net(images)
+                metrics.update(outputs, labels, criterion(outputs, labels))
+
+        epoch_metrics = metrics.compute()
+        val_losses.append(epoch_metrics['loss'])
+        val_accs.append(epoch_metrics['accuracy'])
+        val_note = format_accuracy(epoch_metrics, val_schedule.is_full(loader))
+    else:
+        val_losses.append(float('nan'))
+        val_accs.append(float('nan'))
+        val_note = "skipped"
+
+    print(f"Epoch {epoch+1}/{epochs} | Train Acc: {train_accs[-1]:.4f} | Val Acc: {val_note}")
 
 end = time.time()
 training_time = end - start
@@ -164,12 +211,12 @@ plt.legend()
 plt.show()
 
 # Step 9: Test Evaluation
-model.eval()
+net.eval()
 y_true, y_pred, y_probs = [], [], []
 with torch.no_grad():
     for images, labels in test_loader:
         images, labels = images.to(device), labels.to(device)
-        outputs = model(images)
+        outputs = net(images)
         y_probs.extend(outputs.cpu().numpy())
         y_pred.extend(outputs.argmax(1).cpu().numpy())
         y_true.extend(labels.cpu().numpy())
@@ -25,12 +25,18 @@ from datetime import timedelta
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
 print(f"Using device: {device}")
 
-# Step 1: Downloading the Dataset from Kaggle
-!mkdir -p ~/.kaggle
-!cp kaggle.json ~/.kaggle/
-!chmod 600 ~/.kaggle/kaggle.json
-!kaggle datasets download -d emmarex/plantdisease
-!unzip plantdisease.zip -d PlantVillage
+# `python ddp.py --nproc N plantvillage_twins_svt.py` runs this script in N gloo
+# DDP ranks (one core block each); started directly it is a single process
+from ddp import init_distributed, wrap_model, shard_loader, set_epoch, finish
+rank, world_size = init_distributed()
+
+# Step 1: Downloading the Dataset from Kaggle (DDP ranks reuse the download)
+if world_size == 1:
+    !mkdir -p ~/.kaggle
+    !cp kaggle.json ~/.kaggle/
+    !chmod 600 ~/.kaggle/kaggle.json
+    !kaggle datasets download -d emmarex/plantdisease
+    !unzip plantdisease.zip -d PlantVillage
 
 # Step 2: Data Preprocessing
 transform = transforms.Compose([
@@ -41,41 +47,59 @@ transform = transforms.Compose([
 
 # Loading Dataset
 data_dir = "PlantVillage/PlantVillage"
-dataset = ImageFolder(root=data_dir, transform=transform)
 
-# Splitting Dataset
-train_size = int(0.8 * len(dataset))
-val_size = len(dataset) - train_size
-train_dataset, val_dataset = random_split(dataset, [train_size, val_size])
-
-train_loader = DataLoader(train_dataset, batch_size=32, shuffle=True)
+# Splitting Dataset (stable hash-based 80/20 split, read from the original files)
+from data_splits import scan_class_folders, update_split_manifest, load_split_manifest, ManifestDataset
+from phash_index import find_duplicate_groups
+
+if world_size == 1:
+    class_to_images = scan_class_folders(data_dir)
+    # Near-duplicate photos are grouped by perceptual hash so each group lands in one split
+    duplicate_groups = find_duplicate_groups(class_to_images)
+    manifest = update_split_manifest(class_to_images, 'split_manifest_80_20.csv', ratios=(0.8, 0.2), groups=duplicate_groups)
+else:
+    manifest = load_split_manifest('split_manifest_80_20.csv')  # written by a single-process run
+train_dataset = ManifestDataset(manifest, "train", transform=transform, target_size=(224, 224))
+val_dataset = ManifestDataset(manifest, "val", transform=transform, target_size=(224, 224))
+dataset = train_dataset
+
+# Each DDP rank trains and validates on its shard (global batch 32);
+# val_loader covers the whole split for the evaluation after training
+train_loader = shard_loader(train_dataset, batch_size=32, shuffle=True)
+val_shard_loader = shard_loader(val_dataset, batch_size=32)
 val_loader = DataLoader(val_dataset, batch_size=32, shuffle=False)
 
+# The conv TwinsSVT trains a batch faster than the workers decode one: reuse
+# each decoded batch (flipped / shifted copies), factor picked from measured
+# loader wait vs step time (ECHO = 1 turns echoing off)
+from data_echo import EchoLoader
+ECHO = 'auto'
+train_loader = EchoLoader(train_loader, factor=ECHO)
+
+# Intermediate epochs validate on a fixed stratified VAL_FRACTION of the split
+# (every VAL_EVERY epochs), the last one on all of it; accuracy comes with a
+# 95% confidence interval
+from torch.utils.data import Subset
+from validation import ValidationSchedule, stratified_indices, format_accuracy
+VAL_EVERY = 1
+VAL_FRACTION = 0.25
+val_subset_loader = shard_loader(Subset(val_dataset, stratified_indices(val_dataset.targets, VAL_FRACTION)),
+                                 batch_size=32)
+val_schedule = ValidationSchedule(val_shard_loader, val_subset_loader, every=VAL_EVERY)
+
 # Step 3: Twins-SVT Model Definition
-class TwinsSVT(nn.Module):
-    def __init__(self, num_classes):
-        super(TwinsSVT, self).__init__()
-        self.conv1 = nn.Conv2d(3, 64, kernel_size=3, stride=1, padding=1)
-        self.conv2 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
-        self.pool = nn.MaxPool2d(kernel_size=2, stride=2, padding=0)
-        self.fc1 = nn.Linear(128 * 56 * 56, 512)
-        self.fc2 = nn.Linear(512, num_classes)
-        self.relu = nn.ReLU()
-        self.dropout = nn.Dropout(0.5)
-
-    def forward(self, x):
-        x = self.relu(self.conv1(x))
-        x = self.pool(x)
-        x = self.relu(self.conv2(x))
-        x = self.pool(x)
-        x = x.view(x.size(0), -1)
-        x = self.dropout(self.relu(self.fc1(x)))
-        x = self.fc2(x)
-        return x
+# Global average ('avg') or attention pooling before fc1 instead of flattening
+# the 128x56x56 map into a 205M-parameter Linear ('flatten', the original head);
+# TWINS_BACKBONE = 'timm' swaps in a real Twins-SVT (`python twins_model.py`
+# benchmarks the variants)
+from twins_model import TwinsSVT
+TWINS_POOL = 'avg'
+TWINS_BACKBONE = 'conv'
 
 # Initialize the model
 num_classes = len(dataset.classes)
-model = TwinsSVT(num_classes).to(device)
+model = TwinsSVT(num_classes, pool=TWINS_POOL, backbone=TWINS_BACKBONE).to(device)
+ddp_model = wrap_model(model)
 criterion = nn.CrossEntropyLoss()
 optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
 
@@ -87,46 +111,57 @@ num_epochs = 10
 train_losses, val_losses = [], []
 train_accuracies, val_accuracies = [], []
 
+# Loss / accuracy are summed on the device and read back once per epoch
+from device_metrics import ClassificationMetrics
+metrics = ClassificationMetrics(len(train_dataset.classes), device)
+
 for epoch in range(num_epochs):
+    set_epoch(train_loader, epoch)
     model.train()
-    running_loss, running_corrects = 0.0, 0
+    metrics.reset()
 
     for inputs, labels in train_loader:
         inputs, labels = inputs.to(device), labels.to(device)
         optimizer.zero_grad()
-        outputs = model(inputs)
+        outputs = ddp_model(inputs)
         loss = criterion(outputs, labels)
         loss.backward()
         optimizer.step()
 
-        _, preds = torch.max(outputs, 1)
-        running_loss += loss.item() * inputs.size(0)
-        running_corrects += torch.sum(preds == labels.data)
+        metrics.update(outputs, labels, loss)
 
-    epoch_loss = running_loss / len(train_dataset)
-    epoch_acc = running_corrects.double() / len(train_dataset)
+    epoch_metrics = metrics.compute()
+    epoch_loss = epoch_metrics['loss']
+    epoch_acc = epoch_metrics['accuracy']
     train_losses.append(epoch_loss)
-    train_accuracies.append(epoch_acc.item())
-
-    # Validation Loop
+    train_accuracies.append(epoch_acc)
+
+    # Validation Loop (skipped (NaN) or subsampled per val_schedule; the last epoch is full)
+    loader = val_schedule.loader(epoch, num_epochs)
+    if loader is None:
+        val_losses.append(float('nan'))
+        val_accuracies.append(float('nan'))
+        print(f"Epoch {epoch+1}/{num_epochs}, Train Loss: {epoch_loss:.4f}, Train Acc: {epoch_acc:.4f}, Val skipped")
+        continue
     model.eval()
-    val_loss, val_corrects = 0.0, 0
+    metrics.reset()
 
     with torch.no_grad():
-        for inputs, labels in val_loader:
+        for inputs, labels in loader:
             inputs, labels = inputs.to(device), labels.to(device)
             outputs = model(inputs)
-            loss = criterion(outputs, labels)
-            _, preds = torch.max(outputs, 1)
-            val_loss += loss.item() * inputs.size(0)
-            val_corrects += torch.sum(preds == labels.data)
+            metrics.update(outputs, labels, criterion(outputs, labels))
 
-    val_loss /= len(val_dataset)
-    val_acc = val_corrects.double() / len(val_dataset)
+    epoch_metrics = metrics.compute()
+    val_loss = epoch_metrics['loss']
+    val_acc = epoch_metrics['accuracy']
     val_losses.append(val_loss)
-    val_accuracies.append(val_acc.item())
+    val_accuracies.append(val_acc)
+
+    print(f"Epoch {epoch+1}/{num_epochs}, Train Loss: {epoch_loss:.4f}, Train Acc: {epoch_acc:.4f}, Val Loss: {val_loss:.4f}, "
+          f"Val Acc: {format_accuracy(epoch_metrics, val_schedule.is_full(loader))}")
 
-    print(f"Epoch {epoch+1}/{num_epochs}, Train Loss: {epoch_loss:.4f}, Train Acc: {epoch_acc:.4f}, Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}")
+finish()  # DDP ranks other than 0 exit here; rank 0 evaluates alone
 
 # Training Time
 end_time = time.time()
@@ -169,18 +204,15 @@ plt.title("Confusion Matrix")
 plt.show()
 
 # Final Summary
-correct, total = 0, 0
+metrics.reset()
 model.eval()
 
 with torch.no_grad():
     for inputs, labels in val_loader:
         inputs, labels = inputs.to(device), labels.to(device)
-        outputs = model(inputs)
-        _, preds = torch.max(outputs, 1)
-        total += labels.size(0)
-        correct += (preds == labels).sum().item()
+        metrics.update(model(inputs), labels)
 
-test_accuracy = 100 * correct / total
+test_accuracy = 100 * metrics.compute()['accuracy']
 model_size = sum(p.numel() for p in model.parameters()) * 4 / (1024 * 1024)  # in MB
 
 print("\n================ Summary ================")
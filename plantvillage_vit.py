@@ -20,50 +20,31 @@ print(f"✅ Using Kaggle credential: {json_filename}")
 !kaggle datasets download -d emmarex/plantdisease
 !unzip -qo plantdisease.zip -d PlantVillageData
 
-# STEP 3: Reorganize data into train/val/test split
-import shutil, random
+# STEP 3: Build a train/val/test split manifest (no copying)
+from data_splits import scan_class_folders, update_split_manifest
+from phash_index import find_duplicate_groups
 base_dir = "PlantVillageData/PlantVillage"
-output_dirs = ['train', 'val', 'test']
-for dir_name in output_dirs:
-    shutil.rmtree(dir_name, ignore_errors=True)
-
-all_classes = os.listdir(base_dir)
-for cls in all_classes:
-    imgs = os.listdir(os.path.join(base_dir, cls))
-    random.shuffle(imgs)
-    n = len(imgs)
-    train_n, val_n = int(0.8 * n), int(0.1 * n)
-
-    for split, img_range in zip(output_dirs, [imgs[:train_n], imgs[train_n:train_n+val_n], imgs[train_n+val_n:]]):
-        cls_dir = os.path.join(split, cls)
-        os.makedirs(cls_dir, exist_ok=True)
-        for img in img_range:
-            shutil.copy(os.path.join(base_dir, cls, img), os.path.join(cls_dir, img))
+
+class_to_images = scan_class_folders(base_dir)
+# Near-duplicate photos are grouped by perceptual hash so each group lands in one split
+duplicate_groups = find_duplicate_groups(class_to_images)
+manifest = update_split_manifest(class_to_images, 'split_manifest.csv', ratios=(0.8, 0.1), groups=duplicate_groups)
 
 # STEP 4: Data generators
-from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tf_data import image_dataset
 
 IMG_SIZE = 224
 BATCH_SIZE = 32
 
-train_datagen = ImageDataGenerator(
-    rescale=1./255,
-    rotation_range=25,
-    zoom_range=0.15,
-    width_shift_range=0.1,
-    height_shift_range=0.1,
-    horizontal_flip=True,
-    shear_range=0.1,
-    fill_mode='nearest'
-)
-val_test_datagen = ImageDataGenerator(rescale=1./255)
-
-train_generator = train_datagen.flow_from_directory('train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-val_generator = val_test_datagen.flow_from_directory('val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
-test_generator = val_test_datagen.flow_from_directory('test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, class_mode='categorical')
+# tf.data pipelines: parallel decode/resize, packed uint8 cache. Training only sees
+# cached features (augmented views below), so the train images are read once,
+# unaugmented and unshuffled; they also fix the class order
+train_images = image_dataset(manifest, 'train', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
+val_generator = image_dataset(manifest, 'val', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
+test_generator = image_dataset(manifest, 'test', target_size=(IMG_SIZE, IMG_SIZE), batch_size=BATCH_SIZE, cache='packed')
 
-num_classes = len(train_generator.class_indices)
-class_labels = list(train_generator.class_indices.keys())
+num_classes = len(train_images.class_indices)
+class_labels = list(train_images.class_indices.keys())
 
 # STEP 5: Define ViT Model
 !pip install -q transformers
@@ -91,9 +72,31 @@ def create_vit_model(num_classes):
     return Model(inputs, outputs)
 
 model = create_vit_model(num_classes)
-model.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
 model.summary()
 
+# Frozen base: compute its pooled features once per split, then train only the
+# Dense(512)/Dropout/softmax head on the cached features
+from keras_features import split_frozen_model, cache_keras_features, feature_dataset, assemble_model
+from tf_data import augmentation_layers
+
+# The training augmentation survives as PROBE_VIEWS cached views per image
+# (view 0 clean, the rest randomly augmented); one is drawn per sample per epoch
+PROBE_VIEWS = 4
+PROBE_BUDGET_MB = 2048  # upper bound on the training feature store
+train_augment = augmentation_layers(rotation_range=25, zoom_range=0.15, width_shift_range=0.1, height_shift_range=0.1,
+                                    horizontal_flip=True, fill_mode='nearest')
+
+extractor, head = split_frozen_model(model)
+cache_keras_features(extractor, train_images, 'features/vit_train', key='google/vit-base-patch16-224',
+                     views=PROBE_VIEWS, augment=train_augment, storage_budget_mb=PROBE_BUDGET_MB)
+for split, images in (('val', val_generator), ('test', test_generator)):
+    cache_keras_features(extractor, images, f'features/vit_{split}', key='google/vit-base-patch16-224')
+
+train_features = feature_dataset('features/vit_train', num_classes, batch_size=BATCH_SIZE, shuffle=True)
+val_features = feature_dataset('features/vit_val', num_classes, batch_size=BATCH_SIZE)
+test_features = feature_dataset('features/vit_test', num_classes, batch_size=BATCH_SIZE)
+head.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+
 # STEP 6: Train Model
 from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
 import time
@@ -102,17 +105,21 @@ early_stop = EarlyStopping(patience=5, restore_best_weights=True)
 lr_scheduler = ReduceLROnPlateau(factor=0.5, patience=3)
 
 start_time = time.time()
-history = model.fit(
-    train_generator,
-    validation_data=val_generator,
+history = head.fit(
+    train_features,
+    validation_data=val_features,
     epochs=10,
     callbacks=[early_stop, lr_scheduler]
 )
 training_time = time.time() - start_time
 
+# Full image -> probabilities model (trained head on the frozen base) for export;
+# only the head is trained and evaluated, so neither model needs compiling
+model = assemble_model(extractor, head)
+
 # STEP 7: Evaluation
 import matplotlib.pyplot as plt
-test_loss, test_accuracy = model.evaluate(test_generator)
+test_loss, test_accuracy = head.evaluate(test_features)
 
 plt.plot(history.history["accuracy"], label="Train Accuracy")
 plt.plot(history.history["val_accuracy"], label="Val Accuracy")
@@ -148,7 +155,7 @@ from sklearn.metrics import classification_report, confusion_matrix, roc_auc_sco
 from sklearn.preprocessing import label_binarize
 import seaborn as sns
 
-y_pred = model.predict(test_generator)
+y_pred = head.predict(test_features)
 y_pred_classes = np.argmax(y_pred, axis=1)
 y_true = test_generator.classes
 
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Progressive-resolution training schedule.
+
+Early epochs mostly learn coarse features, so running them at 128x128
+instead of 224x224 cuts their forward/backward compute by about
+(224/128)^2 ~ 3x. ResolutionSchedule maps each epoch to an image size
+(e.g. 128 -> 160 -> 224, ending at the evaluation size) and grows the
+memory-bound batch by (full / size)^2, so each step uses about the same
+activation memory. resize_batch() shrinks the normalised batch on the
+device, so loaders keep producing full-size images.
+
+ViTs see a smaller patch grid at low resolution and need their position
+embeddings interpolated: call Hugging Face ViT/DeiT models with
+interpolate_pos_encoding=True, create timm ViTs with dynamic_img_size=True.
+
+save_curve() records a run's (wall-clock seconds, val accuracy) per epoch
+and plot_curves() overlays all runs of a script (e.g. progressive vs fixed
+224) and prints the time each needed to reach the accuracy all of them hit.
+"""
+
+import glob
+import json
+import os
+
+import torch.nn.functional as F
+
+
+class ResolutionSchedule:
+    # sizes are split evenly over the epochs; the last one is the full size
+    def __init__(self, epochs, sizes=(128, 160, 224)):
+        self.epochs = epochs
+        self.sizes = list(sizes)
+        self.full_size = self.sizes[-1]
+
+    def size(self, epoch):
+        return self.sizes[min(len(self.sizes) - 1, epoch * len(self.sizes) // max(self.epochs, 1))]
+
+    # True on the first epoch of each resolution stage
+    def stage_changed(self, epoch):
+        return epoch == 0 or self.size(epoch) != self.size(epoch - 1)
+
+    # full_batch (the batch that fits at the full size) scaled to this epoch's
+    # size, rounded down to a multiple of 8 once it is large enough
+    def batch_size(self, epoch, full_batch):
+        scaled = int(full_batch * (self.full_size / self.size(epoch)) ** 2)
+        return scaled // 8 * 8 if scaled >= 16 else max(full_batch, scaled)
+
+
+# Bilinear (antialiased) resize of an NCHW batch to size x size; no-op at that size
+def resize_batch(images, size):
+    if images.shape[-2:] == (size, size):
+        return images
+    return F.interpolate(images, size=(size, size), mode='bilinear', align_corners=False, antialias=True)
+
+
+# First wall-clock time at which accuracy reached target, or None
+def time_to_accuracy(times, accuracies, target):
+    for t, acc in zip(times, accuracies):
+        if acc >= target:
+            return t
+    return None
+
+
+def save_curve(path, times, accuracies):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'times': list(times), 'accuracies': list(accuracies)}, f)
+    os.replace(path + '.tmp', path)
+
+
+# Overlay every saved curve matching prefix + '-*.json' (label = the suffix)
+def plot_curves(prefix):
+    import matplotlib.pyplot as plt
+
+    curves = {}
+    for path in sorted(glob.glob(prefix + '-*.json')):
+        with open(path) as f:
+            curve = json.load(f)
+        # Epochs without validation are stored as NaN
+        points = [(t, acc) for t, acc in zip(curve['times'], curve['accuracies']) if acc == acc]
+        if points:
+            times, accuracies = zip(*points)
+            label = os.path.basename(path)[len(os.path.basename(prefix)) + 1:-len('.json')]
+            curves[label] = {'times': list(times), 'accuracies': list(accuracies)}
+    if not curves:
+        return
+    target = min(max(c['accuracies']) for c in curves.values())
+    plt.figure(figsize=(10, 5))
+    for label, c in curves.items():
+        plt.plot(c['times'], c['accuracies'], marker='o', label=label)
+        reached = time_to_accuracy(c['times'], c['accuracies'], target)
+        print(f"{label:<12} reached {target:.2f} val accuracy after {reached:.0f}s "
+              f"(total {c['times'][-1]:.0f}s, best {max(c['accuracies']):.2f})")
+    plt.xlabel("Wall-clock time (s)")
+    plt.ylabel("Validation accuracy")
+    plt.title("Validation accuracy vs wall-clock time")
+    plt.legend()
+    plt.grid(True)
+    plt.show()
@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from phash_index import BKTree, group_hashes, hamming
+
+
+def test_chained_near_duplicates_do_not_merge_far_ends():
+    # A~B and B~C (3 bits each) but A and C are 6 bits apart
+    a, b, c = 0b000000, 0b000111, 0b111111
+    assert hamming(a, b) == 3 and hamming(b, c) == 3 and hamming(a, c) == 6
+    roots = group_hashes([a, b, c], max_distance=4)
+    assert roots[0] == roots[1]
+    assert roots[2] != roots[0]
+
+
+def test_close_images_share_a_group():
+    roots = group_hashes([0b1, 0b11, 0b111, 0xFFFF << 40], max_distance=4)
+    assert roots[:3] == [0, 0, 0]
+    assert roots[3] == 3
+
+
+def test_bktree_query_radius():
+    tree = BKTree()
+    for i, h in enumerate([0, 0b1, 0b1111, 0b11111111]):
+        tree.add(h, i)
+    assert sorted(tree.query(0, 1)) == [0, 1]
+    assert sorted(tree.query(0, 4)) == [0, 1, 2]
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""tf.data input pipelines for the Keras scripts.
+
+image_dataset() is a drop-in replacement for
+ImageDataGenerator(...).flow_from_directory / flow_from_dataframe: JPEG
+decode and resize run in parallel inside tf.data, decoded uint8 images can
+be cached in RAM, on disk or in the packed memmap store, augmentation runs
+on whole batches, and batches are prefetched with AUTOTUNE.
+
+The returned dataset carries the same class_indices / classes / filepaths
+attributes as the Keras iterators, so the evaluation code keeps working.
+Unlike flow_from_directory, non-training sets are never shuffled, so
+model.predict(test_ds) lines up with test_ds.classes.
+
+echo_batches() repeats every batch `factor` times (data echoing, see
+data_echo.py), the copies randomly flipped and shifted, and
+measure_echo_factor() picks the factor from the time the pipeline needs per
+batch versus the time the model needs to train on one.
+"""
+
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from data_echo import echo_factor
+
+WHITE_LIST_FORMATS = ('png', 'jpg', 'jpeg', 'bmp', 'ppm', 'tif', 'tiff')
+
+
+# Same file/class ordering as flow_from_directory: sorted class sub-folders,
+# sorted files inside each. classes fixes the class list (e.g. train's for
+# val/test); a class without a folder simply has no images.
+def _list_directory(directory, classes=None):
+    if classes is None:
+        classes = sorted(d for d in os.listdir(directory) if os.path.isdir(os.path.join(directory, d)))
+    paths, labels = [], []
+    for i, cls in enumerate(classes):
+        for root, _, files in sorted(os.walk(os.path.join(directory, cls))):
+            for f in sorted(files):
+                if f.lower().endswith(WHITE_LIST_FORMATS):
+                    paths.append(os.path.join(root, f))
+                    labels.append(i)
+    return classes, paths, labels
+
+
+def _list_manifest(rows, split):
+    classes = sorted({r['label'] for r in rows})
+    class_to_idx = {c: i for i, c in enumerate(classes)}
+    split_rows = [r for r in rows if r['split'] == split]
+    return classes, [r['path'] for r in split_rows], [class_to_idx[r['label']] for r in split_rows]
+
+
+# Batched equivalent of the ImageDataGenerator augmentation arguments.
+# shear_range has no Keras preprocessing layer and is ignored.
+def augmentation_layers(rotation_range=0, zoom_range=0.0, width_shift_range=0.0,
+                        height_shift_range=0.0, horizontal_flip=False, shear_range=0.0,
+                        fill_mode='nearest', seed=None):
+    layers = tf.keras.layers
+    aug = []
+    if horizontal_flip:
+        aug.append(layers.RandomFlip('horizontal', seed=seed))
+    if rotation_range:
+        aug.append(layers.RandomRotation(rotation_range / 360.0, fill_mode=fill_mode, seed=seed))
+    if zoom_range:
+        aug.append(layers.RandomZoom(zoom_range, fill_mode=fill_mode, seed=seed))
+    if width_shift_range or height_shift_range:
+        aug.append(layers.RandomTranslation(height_shift_range, width_shift_range,
+                                            fill_mode=fill_mode, seed=seed))
+    return tf.keras.Sequential(aug) if aug else None
+
+
+def _decode(path, label, target_size, interpolation):
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, target_size, method=interpolation)
+    return tf.cast(tf.round(image), tf.uint8), label
+
+
+# source: a split directory ('train') or split-manifest rows plus split='train'.
+# cache: None, 'ram', a file path for tf.data's disk cache, or 'packed' to
+# decode once into the packed uint8 memmap store under packed_dir.
+# augment: dict of ImageDataGenerator-style arguments (training only).
+# classes: class list for a split directory, so val/test use train's indices.
+def image_dataset(source, split=None, target_size=(224, 224), batch_size=32, shuffle=False,
+                  augment=None, cache=None, rescale=1. / 255, class_mode='categorical',
+                  interpolation='nearest', packed_dir='packed_tf', seed=None, classes=None):
+    if isinstance(source, str):
+        classes, paths, labels = _list_directory(source, classes)
+    else:
+        classes, paths, labels = _list_manifest(source, split)
+    num_classes = len(classes)
+    print(f"Found {len(paths)} images belonging to {num_classes} classes.")
+
+    if cache == 'packed':
+        from packed_store import pack_images, packed_tf_dataset
+        prefix = os.path.join(packed_dir, split or os.path.basename(os.path.normpath(source)))
+        rows = [{'path': p, 'label': classes[l]} for p, l in zip(paths, labels)]
+        pack_images(rows, prefix, size=target_size, interpolation=interpolation, classes=classes)
+        ds = packed_tf_dataset(prefix, batch_size=batch_size, shuffle=shuffle, one_hot=False, seed=seed)
+    else:
+        ds = tf.data.Dataset.from_tensor_slices((paths, np.array(labels, dtype=np.int64)))
+        if shuffle and cache is None:
+            # Shuffling paths is cheap, so use the whole dataset as the buffer
+            ds = ds.shuffle(len(paths), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.map(lambda p, l: _decode(p, l, target_size, interpolation),
+                    num_parallel_calls=tf.data.AUTOTUNE)
+        if cache is not None:
+            ds = ds.cache() if cache == 'ram' else ds.cache(cache)
+            if shuffle:
+                ds = ds.shuffle(min(len(paths), 2048), seed=seed, reshuffle_each_iteration=True)
+        ds = ds.batch(batch_size)
+
+    aug = augmentation_layers(seed=seed, **augment) if augment else None
+
+    def finish(x, y):
+        x = tf.cast(x, tf.float32) * rescale
+        if aug is not None:
+            x = aug(x, training=True)
+        if class_mode == 'categorical':
+            y = tf.one_hot(y, num_classes)
+        return x, y
+
+    ds = ds.map(finish, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+    # Same attributes as the Keras DirectoryIterator
+    ds.class_indices = {c: i for i, c in enumerate(classes)}
+    ds.classes = np.array(labels, dtype=np.int32)
+    ds.filepaths = paths
+    ds.samples = len(paths)
+    return ds
+
+
+# Random horizontal flip and random shift by up to `padding` pixels (zero
+# padded), drawn per image, of an NHWC batch
+def _reaugment(x, padding):
+    x = tf.image.random_flip_left_right(x)
+    if not padding:
+        return x
+    shape = tf.shape(x)
+    padded = tf.pad(x, [[0, 0], [padding, padding], [padding, padding], [0, 0]])
+    return tf.map_fn(lambda im: tf.image.random_crop(im, shape[1:]), padded)
+
+
+# Yield each batch of ds factor times: as is, then re-augmented copies.
+# Keeps the Keras iterator attributes of ds.
+def echo_batches(ds, factor, padding=16):
+    if factor <= 1:
+        return ds
+    attrs = {k: getattr(ds, k) for k in ('class_indices', 'classes', 'filepaths', 'samples') if hasattr(ds, k)}
+
+    def echo(x, y):
+        copies = tf.data.Dataset.range(factor)
+        return copies.map(lambda i: (tf.cond(i > 0, lambda: _reaugment(x, padding), lambda: x), y))
+
+    echoed = ds.flat_map(echo).prefetch(tf.data.AUTOTUNE)
+    for k, v in attrs.items():
+        setattr(echoed, k, v)
+    return echoed
+
+
+# Echo factor for training model on ds: seconds per batch the pipeline needs
+# (timed without the model) over seconds per forward + backward pass of the
+# model on one of those batches. Weights are not updated.
+def measure_echo_factor(ds, model, batches=20, max_factor=4):
+    it = iter(ds)
+    x, y = next(it)  # pipeline start-up
+    start = time.perf_counter()
+    fetched = 0
+    for x, y in it:
+        fetched += 1
+        if fetched == batches:
+            break
+    loader_s = (time.perf_counter() - start) / max(fetched, 1)
+
+    loss_fn = tf.keras.losses.get(model.loss)
+
+    @tf.function
+    def train_pass():
+        with tf.GradientTape() as tape:
+            loss = tf.reduce_mean(loss_fn(y, model(x, training=True)))
+        return tape.gradient(loss, model.trainable_variables)
+
+    train_pass()  # warm-up (graph tracing, allocation)
+    start = time.perf_counter()
+    for _ in range(3):
+        train_pass()
+    compute_s = (time.perf_counter() - start) / 3
+    factor = echo_factor(loader_s, compute_s, max_factor)
+    print(f"Data echoing x{factor} (pipeline {loader_s * 1000:.0f} ms/batch, "
+          f"model {compute_s * 1000:.0f} ms/step)")
+    return factor
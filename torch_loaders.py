@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Auto-tuned DataLoader factory shared by the PyTorch scripts.
+
+make_loader() times a short warm-up for a few num_workers / prefetch_factor
+candidates, keeps the fastest, and turns on persistent_workers and
+pin_memory where they help. Results are cached in .loader_tuning.json per
+machine, dataset, per-sample pipeline (transform, decode size) and batch
+size, so only the first run pays for tuning. A dataset too small to time
+gets the default DataLoader settings.
+
+The uint8 mode (uint8_transform + BatchTransform) keeps decoded images as
+uint8 until they reach the training device, where flip, float conversion and
+normalisation run once per batch instead of once per sample.
+"""
+
+import hashlib
+import json
+import os
+import re
+import time
+
+import torch
+from torch.utils.data import DataLoader
+
+TUNING_FILE = '.loader_tuning.json'
+
+
+# Transform and decode size decide the per-sample cost, so they are part of
+# the key (object addresses in reprs, e.g. of lambdas, are dropped)
+def _pipeline_signature(dataset):
+    while hasattr(dataset, 'dataset') and not hasattr(dataset, 'transform'):
+        dataset = dataset.dataset  # Subset
+    parts = [repr(getattr(dataset, 'transform', None)), repr(getattr(dataset, 'target_size', None)),
+             repr(getattr(dataset, 'loader', None))]
+    text = re.sub(r' at 0x[0-9a-f]+', '', '|'.join(parts))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:10]
+
+
+def _cache_key(dataset, batch_size):
+    return (f"{type(dataset).__name__}|{len(dataset)}|{_pipeline_signature(dataset)}"
+            f"|bs{batch_size}|cpu{os.cpu_count()}")
+
+
+def _load_tuning():
+    if os.path.exists(TUNING_FILE):
+        with open(TUNING_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_tuning(tuning):
+    with open(TUNING_FILE + '.tmp', 'w') as f:
+        json.dump(tuning, f, indent=2)
+    os.replace(TUNING_FILE + '.tmp', TUNING_FILE)
+
+
+def _images_per_sec(dataset, batch_size, num_workers, prefetch_factor, warmup_batches):
+    kwargs = {'num_workers': num_workers}
+    if num_workers > 0:
+        kwargs['prefetch_factor'] = prefetch_factor
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, **kwargs)
+    it = iter(loader)
+    try:
+        next(it)  # worker start-up is not steady-state throughput
+    except StopIteration:
+        return 0.0
+    seen, start = 0, time.perf_counter()
+    for _ in range(warmup_batches):
+        try:
+            batch = next(it)
+        except StopIteration:
+            break
+        seen += len(batch[0]) if isinstance(batch, (list, tuple)) else len(batch)
+    elapsed = time.perf_counter() - start
+    del it
+    return seen / elapsed if elapsed > 0 else 0.0
+
+
+# Measure candidate settings and return the fastest as DataLoader kwargs
+def tune_loader_settings(dataset, batch_size=32, warmup_batches=10, worker_candidates=None,
+                         prefetch_candidates=(2, 4)):
+    tuning = _load_tuning()
+    key = _cache_key(dataset, batch_size)
+    if key in tuning:
+        return tuning[key]
+    if len(dataset) < 2 * batch_size:
+        print(f"⚠️ {len(dataset)} samples are too few to tune the DataLoader; using the defaults")
+        return {}
+
+    cpus = os.cpu_count() or 1
+    if worker_candidates is None:
+        worker_candidates = [w for w in sorted({0, 2, 4, 8, cpus // 2, cpus}) if w <= cpus]
+    # Don't time more batches than the dataset has
+    warmup_batches = max(1, min(warmup_batches, len(dataset) // batch_size - 1))
+
+    best, best_rate = None, -1.0
+    for workers in worker_candidates:
+        for prefetch in (prefetch_candidates if workers > 0 else (None,)):
+            rate = _images_per_sec(dataset, batch_size, workers, prefetch, warmup_batches)
+            print(f"  num_workers={workers:<2} prefetch_factor={prefetch}: {rate:.1f} img/s")
+            if rate > best_rate:
+                best, best_rate = (workers, prefetch), rate
+
+    if best_rate <= 0:
+        print("⚠️ No DataLoader candidate produced a timed batch; using the defaults")
+        return {}
+    workers, prefetch = best
+    settings = {
+        'num_workers': workers,
+        'pin_memory': torch.cuda.is_available(),
+        'persistent_workers': workers > 0,
+    }
+    if workers > 0:
+        settings['prefetch_factor'] = prefetch
+    print(f"✅ DataLoader tuned: {settings} ({best_rate:.1f} img/s)")
+    tuning[key] = settings
+    _save_tuning(tuning)
+    return settings
+
+
+# DataLoader with machine-tuned worker settings. Pass settings=... to reuse
+# the train loader's tuning for val/test instead of tuning each one.
+def make_loader(dataset, batch_size=32, shuffle=False, settings=None, tune=True, **kwargs):
+    if settings is None:
+        settings = tune_loader_settings(dataset, batch_size) if tune else {}
+    return DataLoader(dataset, batch_size=batch_size, shuffle=shuffle, **{**settings, **kwargs})
+
+
+# Per-sample stage for the uint8 mode: resize only and keep uint8 CHW, so
+# workers ship 1 byte per pixel across the process boundary instead of 4
+def uint8_transform(size=(224, 224)):
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.Resize(size),
+        transforms.PILToTensor(),
+    ])
+
+
+# Batch stage for the uint8 mode: random horizontal flip, float conversion and
+# mean/std normalisation as a few vectorised ops on the whole (device) batch
+class BatchTransform:
+    def __init__(self, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), hflip=True):
+        self.mean = torch.tensor(mean).view(1, -1, 1, 1) * 255
+        self.std = torch.tensor(std).view(1, -1, 1, 1) * 255
+        self.hflip = hflip
+
+    def __call__(self, images, train=True):
+        if self.mean.device != images.device:
+            self.mean, self.std = self.mean.to(images.device), self.std.to(images.device)
+        if train and self.hflip:
+            flip = torch.rand(images.size(0), 1, 1, 1, device=images.device) < 0.5
+            images = torch.where(flip, images.flip(3), images)
+        # (x / 255 - mean) / std == (x - 255 * mean) / (255 * std)
+        return (images.float() - self.mean) / self.std
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Shared classifier training step with precision / memory-format options.
+
+TrainStep wraps forward, loss, backward and the optimizer update for one
+batch. precision='bf16' runs the forward pass under torch.autocast, which
+works on CPU (where torch.cuda.amp.autocast does nothing) and needs no loss
+scaling; 'fp16' (CUDA only) adds a GradScaler. auto_precision() only picks
+bf16 on CPUs with native bf16 instructions (AVX512-BF16 / AMX), since
+emulated bf16 is usually slower than fp32. channels_last=True converts
+weights and input batches to NHWC, which the oneDNN / cuDNN convolution
+kernels prefer; it helps convolutional backbones (ConvNeXt, the TwinsSVT
+conv stem) and is a no-op for pure transformers.
+
+compile=True runs the whole step (forward, loss, backward, optimizer update)
+as one torch.compile graph instead of many small eager kernel launches, and
+falls back to eager if compilation fails. Inductor's graph cache is kept in
+.torchinductor_cache next to the script, so later runs skip most of the
+compile time. fast_optimizer() builds the fused (or foreach) Adam/AdamW
+update that the compiled step fuses best with.
+
+micro_batch_size=k splits each loader batch into micro-batches of at most k
+samples and accumulates their gradients before a single optimizer update,
+so the loader batch is the effective batch. plan_micro_batch() picks k from
+a measured per-sample activation size and a memory budget, and scale_lr()
+applies the matching learning-rate scaling. When model is wrapped in
+DistributedDataParallel, gradients are only all-reduced on the last
+micro-batch.
+
+Run `python train_step.py [timm_model ...]` to compare training throughput
+of every precision / memory-format combination on this machine.
+"""
+
+import contextlib
+import copy
+import math
+import os
+import sys
+import time
+
+import torch
+
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+COMPILE_CACHE_DIR = '.torchinductor_cache'
+
+
+# True if the CPU has native bf16 matmul instructions (AVX512-BF16 or AMX);
+# elsewhere oneDNN emulates bf16 and autocast is usually slower than fp32
+def cpu_has_native_bf16():
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    flags = set(line.split(':', 1)[1].split())
+                    return bool(flags & {'avx512_bf16', 'amx_bf16'})
+    except OSError:
+        pass
+    return False
+
+
+# bf16 on Ampere+ GPUs and CPUs with native bf16, fp16 on older GPUs, else
+# fp32 (`python train_step.py` measures whether bf16 pays off on this machine)
+def auto_precision(device):
+    device = torch.device(device)
+    if device.type == 'cuda':
+        return 'bf16' if torch.cuda.is_bf16_supported() else 'fp16'
+    return 'bf16' if cpu_has_native_bf16() else 'fp32'
+
+
+def autocast(device, precision='fp32'):
+    device = torch.device(device)
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected one of {list(PRECISIONS)}")
+    if precision == 'fp32':
+        return contextlib.nullcontext()
+    if precision == 'fp16' and device.type != 'cuda':
+        raise ValueError("fp16 autocast needs a CUDA device; use bf16 on CPU")
+    return torch.autocast(device_type=device.type, dtype=PRECISIONS[precision])
+
+
+# optimizer_cls(params, **kwargs) with the fused multi-tensor update where this
+# torch build supports it for the parameters' device, else the foreach one
+def fast_optimizer(optimizer_cls, params, **kwargs):
+    params = list(params)
+    try:
+        return optimizer_cls(params, fused=True, **kwargs)
+    except (RuntimeError, TypeError, ValueError):
+        return optimizer_cls(params, foreach=True, **kwargs)
+
+
+# Activation memory (MB) one extra sample adds to a training forward pass,
+# measured as the size of the tensors autograd saves for backward at batch 1
+# vs batch 2 (weights saved for backward cancel out)
+def activation_mb_per_sample(forward, device='cpu', precision='fp32', image_size=224):
+    def saved_bytes(n):
+        total = 0
+
+        def pack(t):
+            nonlocal total
+            total += t.numel() * t.element_size()
+            return t
+
+        x = torch.randn(n, 3, image_size, image_size, device=device)
+        with torch.random.fork_rng(devices=[]), torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+            with autocast(device, precision):
+                forward(x)
+        return total
+
+    return (saved_bytes(2) - saved_bytes(1)) / 1024 ** 2
+
+
+# Largest micro-batch whose activations fit memory_budget_mb, balanced so the
+# effective batch splits into equal chunks
+def plan_micro_batch(effective_batch, sample_mb, memory_budget_mb):
+    micro = max(1, min(effective_batch, int(memory_budget_mb // max(sample_mb, 1e-6))))
+    steps = math.ceil(effective_batch / micro)
+    micro = math.ceil(effective_batch / steps)
+    print(f"✅ Effective batch {effective_batch} = {steps} x {micro} "
+          f"(~{sample_mb * micro:.0f} MB activations per micro-batch, budget {memory_budget_mb} MB)")
+    return micro
+
+
+# Rescale every param group's lr from base_batch to effective_batch: 'linear'
+# (SGD-style) or 'sqrt' (the usual rule for Adam/AdamW)
+def scale_lr(optimizer, effective_batch, base_batch, rule='sqrt'):
+    ratio = effective_batch / base_batch
+    factor = ratio if rule == 'linear' else math.sqrt(ratio)
+    for group in optimizer.param_groups:
+        group['lr'] *= factor
+    print(f"✅ LR scaled x{factor:.3g} ({rule}, batch {base_batch} -> {effective_batch})")
+    return factor
+
+
+def _enable_compile_cache():
+    # Inductor reads the cache location from the environment when it compiles
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(COMPILE_CACHE_DIR))
+    import torch._inductor.config as inductor_config
+    for flag in ('fx_graph_cache', 'autograd_cache'):
+        if hasattr(inductor_config, flag):
+            setattr(inductor_config, flag, True)
+
+
+# One optimisation step per call: step(images, labels) -> (loss, logits), both
+# detached, logits in fp32. forward defaults to model(images); pass e.g.
+# lambda x: model(x).logits for Hugging Face models. For DDP pass the DDP
+# wrapper as model (and call it in forward); with channels_last, convert the
+# model to NHWC before wrapping it, as DDP lays out its gradient buckets then.
+class TrainStep:
+    def __init__(self, model, criterion, optimizer, device, precision='fp32', channels_last=False, forward=None,
+                 compile=False, micro_batch_size=None):
+        self.model = model
+        self.criterion = criterion
+        self.optimizer = optimizer
+        self.device = torch.device(device)
+        self.precision = precision
+        self.channels_last = channels_last
+        self.forward = forward or model
+        self.micro_batch_size = micro_batch_size
+        self.scaler = torch.cuda.amp.GradScaler() if precision == 'fp16' else None
+        if channels_last:
+            model.to(memory_format=torch.channels_last)
+        self._compiled = None
+        self._compiled_ok = False
+        if compile:
+            if hasattr(torch, 'compile'):
+                _enable_compile_cache()
+                self._compiled = torch.compile(self._step)
+            else:
+                print("⚠️ torch.compile needs PyTorch 2.x; training eagerly")
+
+    # Move a batch to the device (and to NHWC for channels_last)
+    def prepare(self, images):
+        images = images.to(self.device, non_blocking=True)
+        if self.channels_last and images.dim() == 4:
+            images = images.contiguous(memory_format=torch.channels_last)
+        return images
+
+    def __call__(self, images, labels):
+        if self._compiled is not None:
+            try:
+                result = self._compiled(images, labels)
+                self._compiled_ok = True
+                return result
+            except Exception as e:
+                if self._compiled_ok:
+                    raise  # the graph already ran, so this is a real error
+                print(f"⚠️ torch.compile failed ({type(e).__name__}: {e}); falling back to eager")
+                self._compiled = None
+        return self._step(images, labels)
+
+    def _step(self, images, labels):
+        self.optimizer.zero_grad()
+        n = images.size(0)
+        micro = self.micro_batch_size or n
+        total_loss, outputs = 0.0, []
+        for start in range(0, n, micro):
+            x, y = images[start:start + micro], labels[start:start + micro]
+            last = start + micro >= n
+            sync = contextlib.nullcontext() if last or not hasattr(self.model, 'no_sync') else self.model.no_sync()
+            with sync:
+                with autocast(self.device, self.precision):
+                    out = self.forward(x)
+                    # Weighted so the accumulated gradient is the full batch's mean
+                    loss = self.criterion(out, y) * (x.size(0) / n)
+                if self.scaler is not None:
+                    self.scaler.scale(loss).backward()
+                else:
+                    loss.backward()
+            total_loss = total_loss + loss.detach()
+            outputs.append(out.detach())
+        if self.scaler is not None:
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
+        else:
+            self.optimizer.step()
+        return total_loss, torch.cat(outputs).float()
+
+    # Inference forward with the same precision; returns fp32 logits
+    @torch.no_grad()
+    def evaluate(self, images):
+        with autocast(self.device, self.precision):
+            return self.forward(images).float()
+
+
+# Training images/s of a model for each (precision, channels_last) mode on
+# synthetic data. Each mode gets a fresh copy of the model and optimizer.
+def benchmark_modes(model, num_classes, device='cpu', batch_size=16, image_size=224, steps=5, modes=None):
+    device = torch.device(device)
+    if modes is None:
+        precisions = ['fp32', 'bf16'] + (['fp16'] if device.type == 'cuda' else [])
+        modes = [(p, cl) for p in precisions for cl in (False, True)]
+    images = torch.randn(batch_size, 3, image_size, image_size, device=device)
+    labels = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    results = {}
+    for precision, channels_last in modes:
+        candidate = copy.deepcopy(model).to(device).train()
+        step = TrainStep(candidate, torch.nn.CrossEntropyLoss(), torch.optim.AdamW(candidate.parameters()),
+                         device, precision=precision, channels_last=channels_last)
+        x = step.prepare(images)
+        step(x, labels)  # warm-up: allocator, oneDNN primitive cache
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(steps):
+            step(x, labels)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        results[(precision, channels_last)] = batch_size * steps / (time.perf_counter() - start)
+    return results
+
+
+if __name__ == '__main__':
+    from timm import create_model
+
+    names = sys.argv[1:] or ['convnext_tiny', 'swin_tiny_patch4_window7_224',
+                             'deit_base_distilled_patch16_224', 'twins_svt_small']
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    print(f"Training throughput on {device} (batch 16, 224x224, img/s):")
+    for name in names:
+        results = benchmark_modes(create_model(name, pretrained=False, num_classes=10), 10, device)
+        base = results[('fp32', False)]
+        for (precision, channels_last), rate in results.items():
+            layout = 'channels_last' if channels_last else 'NCHW'
+            print(f"  {name:<34} {precision:<5} {layout:<13} {rate:7.1f} ({rate / base:.2f}x)")
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""TwinsSVT classifier with a compact head.
+
+The original TwinsSVT (two conv + max-pool stages) flattens the 128x56x56
+feature map into nn.Linear(128 * 56 * 56, 512): ~205M parameters, ~800 MB
+of fp32 weights and another ~2.4 GB for their gradients and Adam state,
+for a model whose convolutions have ~75K. pool='avg' (global average
+pooling) or pool='attention' (one learned query attending over the 56x56
+positions) reduce the map to 128 features first, so fc1 is 128 -> 512;
+both also work at any input resolution. pool='flatten' keeps the original
+head. backbone='timm' puts a real Twins-SVT from timm (twins_svt_small by
+default, with its own average-pooled head) behind the same class name.
+
+`python twins_model.py` prints parameters, training memory (weights,
+gradients and Adam state) and training throughput for each variant.
+"""
+
+import sys
+import time
+
+import torch
+import torch.nn as nn
+
+POOLS = ('avg', 'attention', 'flatten')
+
+
+# A learned query attends over the H*W positions of a B x C x H x W map -> B x C
+class AttentionPool(nn.Module):
+    def __init__(self, channels, heads=4):
+        super().__init__()
+        self.query = nn.Parameter(torch.zeros(1, 1, channels))
+        nn.init.trunc_normal_(self.query, std=0.02)
+        self.norm = nn.LayerNorm(channels)
+        self.attn = nn.MultiheadAttention(channels, heads, batch_first=True)
+
+    def forward(self, x):
+        tokens = self.norm(x.flatten(2).transpose(1, 2))
+        pooled, _ = self.attn(self.query.expand(x.size(0), -1, -1), tokens, tokens, need_weights=False)
+        return pooled[:, 0]
+
+
+class TwinsSVT(nn.Module):
+    def __init__(self, num_classes, pool='avg', backbone='conv', timm_name='twins_svt_small', pretrained=True):
+        super(TwinsSVT, self).__init__()
+        if pool not in POOLS:
+            raise ValueError(f"Unknown pool {pool!r}, expected one of {POOLS}")
+        self.backbone = backbone
+        if backbone == 'timm':
+            from timm import create_model
+            self.model = create_model(timm_name, pretrained=pretrained, num_classes=num_classes)
+            return
+        if backbone != 'conv':
+            raise ValueError(f"Unknown backbone {backbone!r}, expected 'conv' or 'timm'")
+
+        self.conv1 = nn.Conv2d(3, 64, 3, padding=1)
+        self.conv2 = nn.Conv2d(64, 128, 3, padding=1)
+        self.pool = nn.MaxPool2d(2)
+        if pool == 'avg':
+            self.head_pool = nn.Sequential(nn.AdaptiveAvgPool2d(1), nn.Flatten())
+            features = 128
+        elif pool == 'attention':
+            self.head_pool = AttentionPool(128)
+            features = 128
+        else:
+            self.head_pool = nn.Flatten()
+            features = 128 * 56 * 56  # 224x224 inputs only
+        self.fc1 = nn.Linear(features, 512)
+        self.fc2 = nn.Linear(512, num_classes)
+        self.relu = nn.ReLU()
+        self.dropout = nn.Dropout(0.5)
+
+    def forward(self, x):
+        if self.backbone == 'timm':
+            return self.model(x)
+        x = self.pool(self.relu(self.conv1(x)))
+        x = self.pool(self.relu(self.conv2(x)))
+        x = self.head_pool(x)
+        x = self.dropout(self.relu(self.fc1(x)))
+        return self.fc2(x)
+
+
+# {(backbone, pool): {'params', 'train_mb', 'images_per_s'}} for TwinsSVT variants.
+# train_mb counts fp32 weights + gradients + Adam's two state tensors.
+def benchmark_heads(num_classes=10, device='cpu', batch_size=32, image_size=224, steps=3, variants=None):
+    from train_step import TrainStep
+
+    device = torch.device(device)
+    variants = variants or [('conv', 'flatten'), ('conv', 'avg'), ('conv', 'attention'), ('timm', 'avg')]
+    images = torch.randn(batch_size, 3, image_size, image_size, device=device)
+    labels = torch.randint(0, num_classes, (batch_size,), device=device)
+
+    results = {}
+    for backbone, pool in variants:
+        model = TwinsSVT(num_classes, pool=pool, backbone=backbone, pretrained=False).to(device).train()
+        params = sum(p.numel() for p in model.parameters())
+        step = TrainStep(model, nn.CrossEntropyLoss(), torch.optim.Adam(model.parameters(), lr=1e-3), device,
+                         channels_last=True)
+        x = step.prepare(images)
+        step(x, labels)  # warm-up, allocates the Adam state
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(steps):
+            step(x, labels)
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        results[(backbone, pool)] = {
+            'params': params,
+            'train_mb': params * 4 * 4 / 1024 ** 2,
+            'images_per_s': batch_size * steps / (time.perf_counter() - start),
+        }
+        del model, step
+
+    base = results.get(('conv', 'flatten'))
+    print(f"TwinsSVT variants on {device} (batch {batch_size}, {image_size}x{image_size}):")
+    for (backbone, pool), r in results.items():
+        line = (f"  {backbone:<4} {pool:<9} {r['params']:>12,} params  {r['train_mb']:8.1f} MB train state  "
+                f"{r['images_per_s']:7.1f} img/s")
+        if base is not None and (backbone, pool) != ('conv', 'flatten'):
+            line += (f"  ({base['params'] / r['params']:.0f}x fewer params, "
+                     f"{r['images_per_s'] / base['images_per_s']:.2f}x throughput)")
+        print(line)
+    return results
+
+
+if __name__ == '__main__':
+    benchmark_heads(device=sys.argv[1] if len(sys.argv) > 1 else 'cpu')
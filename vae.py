@@ -31,50 +31,27 @@ uploaded = files.upload()
 for fname in uploaded.keys():
     zip_path = fname
 
-extracted_dir = 'healthy_images'
-os.makedirs(extracted_dir, exist_ok=True)
+# Images are read straight from the zip (no extraction); index its members once
+from zip_dataset import ZipImageDataset, build_member_index
 
-with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-    zip_ref.extractall(extracted_dir)
-
-print("✅ Extracted to:", extracted_dir)
-
-def get_all_image_paths(root_folder):
-    valid_exts = ['.jpg', '.jpeg', '.png']
-    image_paths = []
-    for root, dirs, files in os.walk(root_folder):
-        for file in files:
-            if os.path.splitext(file)[1].lower() in valid_exts:
-                image_paths.append(os.path.join(root, file))
-    return image_paths
-
-all_image_paths = get_all_image_paths(extracted_dir)
+all_image_paths = [m[0] for m in build_member_index(zip_path, valid_exts=('.jpg', '.jpeg', '.png'))]
 if len(all_image_paths) == 0:
     raise ValueError("❌ No images found!")
 
 print(f"✅ Found {len(all_image_paths)} images.")
 
 # STEP 4: Dataset and Transforms
-class HealthyDataset(Dataset):
-    def __init__(self, image_paths, transform=None):
-        self.image_paths = image_paths
-        self.transform = transform
-
-    def __len__(self):
-        return len(self.image_paths)
-
-    def __getitem__(self, idx):
-        image = Image.open(self.image_paths[idx]).convert('RGB')
-        if self.transform:
-            image = self.transform(image)
-        return image
+class HealthyDataset(ZipImageDataset):
+    def __init__(self, zip_path, transform=None, target_size=None):
+        super().__init__(zip_path, transform=transform, target_size=target_size,
+                         valid_exts=('.jpg', '.jpeg', '.png'))
 
 transform = transforms.Compose([
     transforms.Resize((128, 128)),
     transforms.ToTensor()
 ])
 
-dataset = HealthyDataset(all_image_paths, transform=transform)
+dataset = HealthyDataset(zip_path, transform=transform, target_size=(128, 128))
 dataloader = DataLoader(dataset, batch_size=min(32, len(dataset)), shuffle=True)
 
 # STEP 5: Show Images Helper
@@ -158,10 +135,14 @@ def loss_function(recon_x, x, mu, logvar):
     kl_div = -0.5 * torch.sum(1 + logvar - mu.pow(2) - logvar.exp())
     return recon_loss + kl_div
 
+# The epoch loss is summed on the device and read back once per epoch
+from device_metrics import RunningSums
+running = RunningSums()
+
 epochs = 30
 vae.train()
 for epoch in range(epochs):
-    total_loss = 0
+    running.reset()
     for batch in dataloader:
         batch = batch.to(device)
         optimizer.zero_grad()
@@ -169,8 +150,8 @@ for epoch in range(epochs):
         loss = loss_function(recon, batch, mu, logvar)
         loss.backward()
         optimizer.step()
-        total_loss += loss.item()
-    print(f"Epoch {epoch+1}/{epochs}, Loss: {total_loss / len(dataset):.2f}")
+        running.add(loss=loss)
+    print(f"Epoch {epoch+1}/{epochs}, Loss: {running.totals()['loss'] / len(dataset):.2f}")
 
 # STEP 8: Visualize Intermediate Decoder Outputs
 vae.eval()
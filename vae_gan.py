@@ -34,9 +34,12 @@ transform = transforms.Compose([
 ])
 
 # Custom Dataset that searches all subdirectories
+from image_io import open_rgb
+
 class HealthyDataset(Dataset):
-    def __init__(self, image_dir, transform=None):
+    def __init__(self, image_dir, transform=None, target_size=None):
         self.transform = transform
+        self.target_size = target_size  # decode JPEGs at reduced resolution
         self.image_paths = []
 
         valid_exts = ('.jpg', '.jpeg', '.png', '.bmp')
@@ -53,16 +56,18 @@ class HealthyDataset(Dataset):
 
     def __getitem__(self, idx):
         img_path = self.image_paths[idx]
-        image = Image.open(img_path).convert('RGB')
+        image = open_rgb(img_path, self.target_size)
         if self.transform:
             image = self.transform(image)
         return image
 
 # Load dataset and visualize samples
 image_dir = './healthy_dataset/'
-dataset = HealthyDataset(image_dir, transform)
+dataset = HealthyDataset(image_dir, transform, target_size=(64, 64))
 print(f"✅ Total images found: {len(dataset)}")
-dataloader = DataLoader(dataset, batch_size=32, shuffle=True)
+# Workers / prefetch / pinning tuned for this machine (cached after the first run)
+from torch_loaders import make_loader
+dataloader = make_loader(dataset, batch_size=32, shuffle=True)
 
 # Show 10 sample preprocessed images
 sample_batch = next(iter(dataloader))
@@ -194,7 +199,12 @@ discriminator.apply(weights_init)
 def train(num_epochs=100):  # Increased epochs for better convergence
     start_time = time.time()
 
+    # Epoch-mean losses are summed on the device and read back once per epoch
+    from device_metrics import RunningSums
+    running = RunningSums()
+
     for epoch in range(num_epochs):
+        running.reset()
         for batch_idx, real_imgs in enumerate(dataloader):
             real_imgs = real_imgs.to(device)
             batch_size = real_imgs.size(0)
@@ -238,9 +248,11 @@ def train(num_epochs=100):  # Increased epochs for better convergence
             d_loss = 0.5 * (loss_real + loss_fake)
             d_loss.backward()
             optimizer_D.step()
+            running.add(n=batch_size, d_loss=d_loss, g_loss=g_loss)
 
         # Epoch Summary
-        print(f"Epoch [{epoch+1}/{num_epochs}] | D Loss: {d_loss.item():.4f} | G Loss: {g_loss.item():.4f}")
+        epoch_losses = running.means()
+        print(f"Epoch [{epoch+1}/{num_epochs}] | D Loss: {epoch_losses['d_loss']:.4f} | G Loss: {epoch_losses['g_loss']:.4f}")
 
         # Display 10 generated images after each epoch
         with torch.no_grad():
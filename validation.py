@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Validation scheduling with confidence intervals.
+
+A full pass over the validation split every epoch costs as much as a good
+fraction of a training epoch on PlantVillage. ValidationSchedule decides,
+per epoch, whether to validate and on which loader: every=k validates after
+every k-th epoch, and a subset loader built from stratified_indices() (a
+fixed, class-proportional sample, identical every epoch so the numbers stay
+comparable) replaces the full split for the intermediate epochs. The last
+epoch always validates on the full split; scripts with early stopping call
+loader(..., final=True) to re-validate fully before they stop.
+
+accuracy_interval() is the Wilson score interval for an accuracy measured on
+`count` images, and format_accuracy() prints it next to the accuracy so a
+subsampled estimate is read with its uncertainty.
+"""
+
+import math
+
+import numpy as np
+
+
+# Sorted indices of a fixed class-stratified sample: round(fraction * n_c)
+# images of each class c (at least one), drawn with a fixed seed
+def stratified_indices(labels, fraction, seed=0):
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(seed)
+    picked = []
+    for label in np.unique(labels):
+        idx = np.flatnonzero(labels == label)
+        k = min(len(idx), max(1, int(round(fraction * len(idx)))))
+        picked.append(rng.choice(idx, size=k, replace=False))
+    return np.sort(np.concatenate(picked)).tolist()
+
+
+# Wilson score interval (lower, upper) for correct / count at confidence z
+def accuracy_interval(correct, count, z=1.96):
+    if count == 0:
+        return 0.0, 1.0
+    p = correct / count
+    denom = 1 + z * z / count
+    centre = (p + z * z / (2 * count)) / denom
+    half = z * math.sqrt(p * (1 - p) / count + z * z / (4 * count * count)) / denom
+    return max(0.0, centre - half), min(1.0, centre + half)
+
+
+# "0.9812 (95% CI 0.9741-0.9866, 1,234 images, subsample)" from a
+# ClassificationMetrics.compute() result
+def format_accuracy(result, full=True):
+    low, high = accuracy_interval(result['accuracy'] * result['count'], result['count'])
+    kind = '' if full else ', subsample'
+    return f"{result['accuracy']:.4f} (95% CI {low:.4f}-{high:.4f}, {result['count']:,} images{kind})"
+
+
+class ValidationSchedule:
+    # full_loader: the whole validation split; subset_loader: optional loader
+    # over a stratified_indices() sample used for the intermediate epochs
+    def __init__(self, full_loader, subset_loader=None, every=1):
+        self.full_loader = full_loader
+        self.subset_loader = subset_loader
+        self.every = max(1, every)
+
+    # Loader to validate with after epoch (0-based) of epochs, or None to skip.
+    # final=True (last epoch, early stop) always returns the full split.
+    def loader(self, epoch, epochs, final=False):
+        if final or epoch + 1 >= epochs:
+            return self.full_loader
+        if (epoch + 1) % self.every:
+            return None
+        return self.subset_loader if self.subset_loader is not None else self.full_loader
+
+    def is_full(self, loader):
+        return loader is self.full_loader
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Read images straight out of a dataset .zip, without extracting it.
+
+ZipImageDataset reads the central directory once to build a member index
+(data offset, sizes, compression per image). __getitem__ then random-accesses
+one member through a file handle owned by the current worker process:
+stored members are read in place from an mmap of the archive, deflated
+members are inflated straight from their mmapped compressed bytes.
+"""
+
+import io
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+
+from image_io import open_rgb
+
+try:
+    from torch.utils.data import Dataset
+except ImportError:  # Keras-only scripts don't need torch
+    Dataset = object
+
+VALID_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
+_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')  # zip local file header, 30 bytes
+
+
+# File-like view over a byte range of an mmap; PIL reads from it directly
+class _MmapSlice(io.RawIOBase):
+    def __init__(self, mm, start, size):
+        self._view = memoryview(mm)[start:start + size]
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+# [(name, data_offset, compress_size, file_size, compress_type)] for image members
+def build_member_index(zip_path, valid_exts=VALID_EXTS):
+    members = []
+    with zipfile.ZipFile(zip_path) as zf, open(zip_path, 'rb') as f:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(valid_exts):
+                continue
+            if '__MACOSX' in info.filename or os.path.basename(info.filename).startswith('._'):
+                continue
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or info.flag_bits & 0x1:
+                raise ValueError(f"Unsupported zip member (compression/encryption): {info.filename}")
+            # The local header's name/extra lengths can differ from the central directory's
+            f.seek(info.header_offset)
+            header = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            data_offset = info.header_offset + _LOCAL_HEADER.size + header[10] + header[11]
+            members.append((info.filename, data_offset, info.compress_size, info.file_size, info.compress_type))
+    return sorted(members)
+
+
+# Dataset over the images in a zip. labeled=True returns (image, class index) with
+# the class taken from the member's parent folder, like ImageFolder; labeled=False
+# returns just the image (VAE/GAN/diffusion use).
+class ZipImageDataset(Dataset):
+    def __init__(self, zip_path, transform=None, target_size=None, labeled=False, valid_exts=VALID_EXTS):
+        self.zip_path = zip_path
+        self.transform = transform
+        self.target_size = target_size
+        self.labeled = labeled
+        self.members = build_member_index(zip_path, valid_exts)
+        if not self.members:
+            raise ValueError(f"No valid images found in {zip_path}")
+        self.classes = sorted({os.path.basename(os.path.dirname(m[0])) for m in self.members})
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.targets = [self.class_to_idx[os.path.basename(os.path.dirname(m[0]))] for m in self.members]
+        self._pid = None
+
+    def __len__(self):
+        return len(self.members)
+
+    # Handles are per process: DataLoader workers re-open after fork
+    def _handles(self):
+        if self._pid != os.getpid():
+            self._file = open(self.zip_path, 'rb')
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._pid = os.getpid()
+        return self._file, self._mmap
+
+    def open_member(self, idx):
+        _, offset, compress_size, file_size, compress_type = self.members[idx]
+        _, mm = self._handles()
+        if compress_type == zipfile.ZIP_STORED:
+            return _MmapSlice(mm, offset, file_size)
+        return io.BytesIO(zlib.decompress(mm[offset:offset + compress_size], -15, file_size))
+
+    def __getitem__(self, idx):
+        image = open_rgb(self.open_member(idx), self.target_size)
+        if self.transform:
+            image = self.transform(image)
+        return (image, self.targets[idx]) if self.labeled else image
+
+    def __getstate__(self):
+        # Open handles can't be pickled into spawned workers
+        state = self.__dict__.copy()
+        for key in ('_file', '_mmap'):
+            state.pop(key, None)
+        state['_pid'] = None
+        return state